@@ -0,0 +1 @@
+from .synthetic import synthetic_movie
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+__all__ = []
+
+
+def synthetic_movie(shape=(10, 1, 256, 256),
+                    n_spots=20,
+                    sigma=1.5,
+                    sigma_z=1.,
+                    intensity=(50., 200.),
+                    background=100.,
+                    read_noise=2.,
+                    pixel_size=0.1,
+                    z_step=0.3,
+                    time_increment=1.,
+                    seed=None):
+    """Generate a TZYX movie of gaussian spots with known positions.
+
+    Spots are drawn at random positions in every frame (uniform density)
+    over a constant background. Poisson (shot) noise and gaussian (read)
+    noise are added.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Movie shape (T, Z, Y, X).
+    n_spots : int
+        Number of spots per frame.
+    sigma : float
+        Lateral standard deviation of the spots (in pixels).
+    sigma_z : float
+        Axial standard deviation of the spots (in planes). Unused if Z is 1.
+    intensity : tuple of float
+        Spot amplitudes are uniformly drawn in this range.
+    background : float
+        Mean background level.
+    read_noise : float
+        Standard deviation of the gaussian noise.
+    pixel_size : float
+        Lateral pixel size (in um) written in the metadata.
+    z_step : float
+        Distance between planes (in um) written in the metadata.
+    time_increment : float
+        Time between frames written in the metadata.
+    seed : int or None
+        Seed of the random generator.
+
+    Returns
+    -------
+    movie : numpy.ndarray
+        The float TZYX movie.
+    truth : :class:`pandas.DataFrame`
+        Spot positions (in pixels) and amplitudes with columns x, y, z and I,
+        indexed by `t_stamp` and `label`.
+    metadata : dict
+        Metadata compatible with :func:`spindle_tracker.detector.peak_detector`.
+
+    Examples
+    --------
+    >>> from spindle_tracker.data import synthetic_movie
+    >>> movie, truth, metadata = synthetic_movie(shape=(20, 1, 512, 512), n_spots=100)
+    """
+    rng = np.random.RandomState(seed)
+    size_t, size_z, size_y, size_x = shape
+
+    # Keep spots far enough from borders to be detectable
+    margin = 4 * sigma
+    margin_z = 2 * sigma_z if size_z > 1 else 0
+
+    n = size_t * n_spots
+    t = np.repeat(np.arange(size_t), n_spots)
+    x = rng.uniform(margin, size_x - 1 - margin, n)
+    y = rng.uniform(margin, size_y - 1 - margin, n)
+    if size_z > 1:
+        z = rng.uniform(margin_z, size_z - 1 - margin_z, n)
+    else:
+        z = np.zeros(n)
+    amplitudes = rng.uniform(intensity[0], intensity[1], n)
+
+    movie = np.ones(shape) * background
+
+    # Each spot is only rendered in a window around its center
+    half = int(np.ceil(4 * sigma))
+    half_z = int(np.ceil(4 * sigma_z)) if size_z > 1 else 0
+    for ti, xi, yi, zi, I in zip(t, x, y, z, amplitudes):
+        sl_x = slice(max(int(xi) - half, 0), min(int(xi) + half + 2, size_x))
+        sl_y = slice(max(int(yi) - half, 0), min(int(yi) + half + 2, size_y))
+        sl_z = slice(max(int(zi) - half_z, 0), min(int(zi) + half_z + 2, size_z))
+
+        gx = np.exp(-(np.arange(sl_x.start, sl_x.stop) - xi) ** 2 / (2 * sigma ** 2))
+        gy = np.exp(-(np.arange(sl_y.start, sl_y.stop) - yi) ** 2 / (2 * sigma ** 2))
+        if size_z > 1:
+            gz = np.exp(-(np.arange(sl_z.start, sl_z.stop) - zi) ** 2 / (2 * sigma_z ** 2))
+        else:
+            gz = np.ones(1)
+
+        movie[ti, sl_z, sl_y, sl_x] += I * gz[:, None, None] * gy[None, :, None] * gx[None, None, :]
+
+    movie = rng.poisson(movie).astype('float')
+    if read_noise > 0:
+        movie += rng.normal(0, read_noise, movie.shape)
+
+    index = pd.MultiIndex.from_arrays([t, np.arange(n)], names=['t_stamp', 'label'])
+    truth = pd.DataFrame({'x': x, 'y': y, 'z': z, 'I': amplitudes},
+                         index=index, columns=['x', 'y', 'z', 'I'])
+
+    metadata = {'SizeT': size_t,
+                'SizeZ': size_z,
+                'SizeY': size_y,
+                'SizeX': size_x,
+                'SizeC': 1,
+                'DimensionOrder': 'TZYX',
+                'Shape': list(shape),
+                'PhysicalSizeX': pixel_size,
+                'PhysicalSizeY': pixel_size,
+                'PhysicalSizeZ': z_step,
+                'TimeIncrement': time_increment}
+
+    return movie, truth, metadata
@@ -1,2 +1,8 @@
 from .log_detector import log_detector
+from .log_detector import multiscale_log_detector
 from .peak_detector import peak_detector
+from .peak_detector import calibrate_threshold
+from .peak_detector import multichannel_peak_detector
+from .executor import DetectionExecutor
+from .cache import DetectionCache
+from .metrics import DetectionMetrics
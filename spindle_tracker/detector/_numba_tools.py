@@ -0,0 +1,96 @@
+from __future__ import division, print_function
+import numpy as np
+import numba
+
+
+@numba.jit(nopython=True, cache=True)
+def glrt_map_kernel(image, g_patch, hmap):
+    """Sliding window GLRT statistic (see `peak_detector.template_glrt_map`).
+    `hmap[i, j]` is computed from the window starting at `(i, j)`.
+    """
+    w_x, w_y = g_patch.shape
+    n = w_x * w_y
+
+    g_centered = g_patch - g_patch.mean()
+    g_squaresum = np.sum(g_centered ** 2)
+
+    for i in range(hmap.shape[0]):
+        for j in range(hmap.shape[1]):
+
+            mean = 0.
+            for u in range(w_x):
+                for v in range(w_y):
+                    mean += image[i + u, j + v]
+            mean /= n
+
+            variance = 0.
+            intensity = 0.
+            for u in range(w_x):
+                for v in range(w_y):
+                    value = image[i + u, j + v] - mean
+                    variance += value * value
+                    intensity += g_centered[u, v] * value
+            variance /= n
+
+            if variance <= 0:
+                hmap[i, j] = np.nan
+                continue
+
+            normalised = intensity / np.sqrt(n * variance)
+            hmap[i, j] = -n * np.log(1 - normalised * normalised / g_squaresum)
+
+
+@numba.jit(nopython=True, cache=True)
+def gauss_continuous_kernel(params, w_s, out):
+    """Fill `out` (a `(n, w_s * w_s)` array) with the gauss model of
+    `peak_detector.gauss_continuous_batch`.
+    """
+    for p in range(params.shape[0]):
+        xc, yc, width, amplitude, bg = params[p]
+        for k in range(w_s):
+            x = np.exp(- (k - xc) ** 2 / width ** 2)
+            for m in range(w_s):
+                y = np.exp(- (m - yc) ** 2 / width ** 2)
+                out[p, k * w_s + m] = amplitude * x * y + bg
+
+
+@numba.jit(nopython=True, cache=True)
+def gauss_jacobian_kernel(params, w_s, out):
+    """Fill `out` (a `(n, w_s * w_s, 5)` array) with the jacobian of
+    `peak_detector.gauss_jacobian_batch`.
+    """
+    for p in range(params.shape[0]):
+        xc, yc, width, amplitude, bg = params[p]
+        for k in range(w_s):
+            dx = k - xc
+            x = np.exp(- dx ** 2 / width ** 2)
+            for m in range(w_s):
+                dy = m - yc
+                gauss = x * np.exp(- dy ** 2 / width ** 2)
+                idx = k * w_s + m
+                out[p, idx, 0] = amplitude * gauss * 2 * dx / width ** 2
+                out[p, idx, 1] = amplitude * gauss * 2 * dy / width ** 2
+                out[p, idx, 2] = amplitude * gauss * 2 * (dx ** 2 + dy ** 2) / width ** 3
+                out[p, idx, 3] = gauss
+                out[p, idx, 4] = 1.
+
+
+@numba.jit(nopython=True, cache=True)
+def deflation_kernel(image, peaks, w_s):
+    """Subtract in place the gauss peaks (`(n, 4)` array of
+    `(xc, yc, width, I)`) from `image` (see `peak_detector.image_deflation`).
+    """
+    for p in range(peaks.shape[0]):
+        xc, yc, width, amplitude = peaks[p]
+        xc_rel = w_s // 2 + xc - np.floor(xc)
+        yc_rel = w_s // 2 + yc - np.floor(yc)
+        low_x = int(xc - w_s // 2)
+        low_y = int(yc - w_s // 2)
+
+        if (low_x > 0 and low_y > 0 and low_x + w_s <= image.shape[0] and
+           low_y + w_s <= image.shape[1]):
+            for k in range(w_s):
+                x = np.exp(- (k - xc_rel) ** 2 / width ** 2)
+                for m in range(w_s):
+                    y = np.exp(- (m - yc_rel) ** 2 / width ** 2)
+                    image[low_x + k, low_y + m] -= amplitude * x * y
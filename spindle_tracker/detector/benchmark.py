@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+
+import time
+import logging
+import tracemalloc
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial.distance import cdist
+
+from ..data import synthetic_movie
+from .peak_detector import peak_detector
+from .log_detector import log_detector
+
+log = logging.getLogger(__name__)
+
+__all__ = []
+
+
+def run_benchmark(shape=(10, 1, 256, 256), n_spots=20, detectors=None,
+                  max_distance=2., seed=0, **movie_parameters):
+    """Generate a synthetic movie (see
+    :func:`spindle_tracker.data.synthetic_movie`) and benchmark detectors on
+    it.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Movie shape (T, Z, Y, X). If Z is higher than 1, detection is done
+        in 3D.
+    n_spots : int
+        Number of spots per frame.
+    detectors : dict or None
+        See :func:`benchmark_detectors`. Default to
+        :func:`default_detectors`.
+    max_distance : float
+        Maximum distance (in pixels) between a detected and a true spot to
+        count it as found.
+    seed : int
+        Seed of the movie random generator.
+    **movie_parameters : passed to :func:`spindle_tracker.data.synthetic_movie`.
+
+    Returns
+    -------
+    report : :class:`pandas.DataFrame`
+        See :func:`benchmark_detectors`.
+
+    Examples
+    --------
+    >>> from spindle_tracker.detector.benchmark import run_benchmark
+    >>> run_benchmark(shape=(20, 1, 512, 512), n_spots=100)
+    """
+    movie, truth, metadata = synthetic_movie(shape=shape, n_spots=n_spots,
+                                             seed=seed, **movie_parameters)
+
+    if detectors is None:
+        sigma = movie_parameters.get('sigma', 1.5)
+        detectors = default_detectors(metadata, sigma=sigma)
+
+    return benchmark_detectors(movie, truth, metadata, detectors,
+                               max_distance=max_distance)
+
+
+def default_detectors(metadata, sigma=1.5):
+    """Detectors to benchmark: :func:`peak_detector` with the numpy and the
+    numba backends (2D only) and :func:`log_detector`, configured for spots
+    of standard deviation `sigma` (in pixels).
+
+    Returns
+    -------
+    detectors : OrderedDict
+        Keys are names and values are functions (see
+        :func:`benchmark_detectors`).
+    """
+    volume = metadata['SizeZ'] > 1
+    pixel_size = metadata['PhysicalSizeX']
+
+    # peak_detector radius is the 1/e radius of the gaussian
+    parameters = {'w_s': (4 * int(np.ceil(sigma)) + 1) * pixel_size,
+                  'peak_radius': np.sqrt(2) * sigma * pixel_size}
+
+    detectors = OrderedDict()
+    detectors['peak_detector'] = lambda movie, md: detect_with_peak_detector(
+        movie, md, parameters=parameters, volume=volume)
+
+    if not volume:
+        numba_parameters = dict(parameters, backend='numba')
+        detectors['peak_detector_numba'] = lambda movie, md: detect_with_peak_detector(
+            movie, md, parameters=numba_parameters)
+
+    detectors['log_detector'] = lambda movie, md: detect_with_log_detector(
+        movie, md, radius=np.sqrt(3 if volume else 2) * sigma * pixel_size)
+
+    return detectors
+
+
+def benchmark_detectors(movie, truth, metadata, detectors, max_distance=2.,
+                        warm_up=True):
+    """Run every detector on `movie` and compare detected spots with `truth`.
+
+    Peak memory is measured with :mod:`tracemalloc` and only accounts for
+    allocations of the current process.
+
+    Parameters
+    ----------
+    movie : numpy.ndarray
+        A TZYX movie.
+    truth : :class:`pandas.DataFrame`
+        True positions (in pixels) with x, y and z columns and a `t_stamp`
+        index level.
+    metadata : dict
+    detectors : dict
+        Keys are names and values are functions `detector(movie, metadata)`
+        returning a DataFrame with t, x, y and z columns (in pixels and frame
+        index).
+    max_distance : float
+        Maximum distance (in pixels) between a detected and a true spot to
+        count it as found.
+    warm_up : bool
+        Run each detector on the first frame before measuring it, so one
+        time costs such as numba compilation are not counted.
+
+    Returns
+    -------
+    report : :class:`pandas.DataFrame`
+        One line per detector with frames per second, peak memory (in MB),
+        recall, precision and the RMS lateral localization error (in pixels).
+    """
+    n_frames = movie.shape[0]
+    report = []
+
+    first_metadata = dict(metadata, SizeT=1)
+    if 'Shape' in metadata:
+        first_metadata['Shape'] = [1] + list(metadata['Shape'][1:])
+
+    for name, detector in detectors.items():
+        log.info('Benchmarking {}'.format(name))
+
+        if warm_up:
+            detector(movie[:1], first_metadata)
+
+        tracemalloc.start()
+        start = time.time()
+        try:
+            detected = detector(movie, metadata)
+        finally:
+            duration = time.time() - start
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        scores = match_spots(detected, truth, max_distance=max_distance)
+
+        report.append(OrderedDict([('detector', name),
+                                   ('fps', n_frames / duration),
+                                   ('peak_memory', peak_memory / 1024 ** 2),
+                                   ('recall', scores['recall']),
+                                   ('precision', scores['precision']),
+                                   ('rms_error', scores['rms_error']),
+                                   ('n_detected', scores['n_detected']),
+                                   ('n_true', scores['n_true'])]))
+
+    return pd.DataFrame(report).set_index('detector')
+
+
+def match_spots(detected, truth, max_distance=2.):
+    """Match detected and true spots frame by frame (one to one, minimizing
+    the total distance) and compute detection scores.
+
+    Returns
+    -------
+    scores : dict
+        recall, precision, rms_error (lateral, in pixels), n_detected and
+        n_true.
+    """
+    truth_t = truth.index.get_level_values('t_stamp').values
+    n_found = 0
+    squared_errors = []
+
+    detected_t = detected['t'].values if len(detected) else np.array([])
+
+    for t in np.unique(truth_t):
+        true_pos = truth[truth_t == t][['x', 'y', 'z']].values
+        det_pos = detected[detected_t == t][['x', 'y', 'z']].values if len(detected) else []
+        if not len(det_pos):
+            continue
+
+        distances = cdist(true_pos, det_pos)
+        # Pairs too far away can't be matched
+        costs = np.where(distances <= max_distance, distances, 1e6)
+        rows, cols = linear_sum_assignment(costs)
+        matched = distances[rows, cols] <= max_distance
+        rows, cols = rows[matched], cols[matched]
+
+        n_found += len(rows)
+        squared_errors.append(np.sum((true_pos[rows, :2] - det_pos[cols, :2]) ** 2, axis=1))
+
+    n_true = len(truth)
+    n_detected = len(detected)
+    squared_errors = np.concatenate(squared_errors) if squared_errors else np.array([])
+
+    return {'recall': n_found / n_true if n_true else np.nan,
+            'precision': n_found / n_detected if n_detected else np.nan,
+            'rms_error': np.sqrt(squared_errors.mean()) if len(squared_errors) else np.nan,
+            'n_detected': n_detected,
+            'n_true': n_true}
+
+
+def detect_with_peak_detector(movie, metadata, parameters={}, volume=False,
+                              parallel=False):
+    """Run :func:`peak_detector` on a TZYX movie and return positions in
+    pixels.
+    """
+    if volume:
+        frames = iter(movie)
+    else:
+        frames = iter(movie.reshape((-1,) + movie.shape[-2:]))
+
+    peaks = peak_detector(frames, metadata, parallel=parallel,
+                          parameters=parameters, volume=volume)
+
+    detected = pd.DataFrame(columns=['t', 'x', 'y', 'z'])
+    if not len(peaks):
+        return detected
+
+    detected['t'] = peaks.index.get_level_values('t_stamp').values
+    detected['x'] = peaks['x'].values / metadata['PhysicalSizeX']
+    detected['y'] = peaks['y'].values / metadata['PhysicalSizeY']
+    detected['z'] = peaks['z'].values / metadata['PhysicalSizeZ']
+
+    return detected
+
+
+def detect_with_log_detector(movie, metadata, radius, threshold=None):
+    """Run :func:`log_detector` on every frame of a TZYX movie and return
+    positions in pixels.
+
+    Spots with a quality lower than `threshold` are discarded. If None,
+    the threshold is 6 robust standard deviations (from the median absolute
+    deviation) above the median quality of each frame.
+    """
+    volume = movie.shape[1] > 1
+    if volume:
+        ndims = 3
+        calibration = [metadata['PhysicalSizeZ'], metadata['PhysicalSizeY'],
+                       metadata['PhysicalSizeX']]
+    else:
+        ndims = 2
+        calibration = [metadata['PhysicalSizeY'], metadata['PhysicalSizeX']]
+
+    all_spots = []
+    for t, stack in enumerate(movie):
+        source = stack if volume else stack[0]
+        spots = log_detector(source, radius, ndims, calibration)
+
+        if threshold is None:
+            median = np.median(spots['quality'])
+            mad = np.median(np.abs(spots['quality'] - median))
+            frame_threshold = median + 6 * 1.4826 * mad
+        else:
+            frame_threshold = threshold
+
+        spots = spots[spots['quality'] > frame_threshold]
+        all_spots.append(pd.DataFrame({'t': t,
+                                       'x': spots['x'].values,
+                                       'y': spots['y'].values,
+                                       'z': spots['z'].values},
+                                      columns=['t', 'x', 'y', 'z']))
+
+    return pd.concat(all_spots, ignore_index=True)
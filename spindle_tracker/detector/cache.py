@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+
+import os
+import json
+import hashlib
+import logging
+import tempfile
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+__all__ = ["DetectionCache", "file_fingerprint", "array_fingerprint"]
+
+# Bump it when detection results change for the same input and parameters
+CACHE_VERSION = 3
+
+
+class DetectionCache(object):
+    """On disk cache of detection results (one file per frame).
+
+    Entries are addressed by a hash of the source fingerprint (see
+    :func:`file_fingerprint`), the frame index, the frame content and the
+    normalized detection parameters. When the cache grows above `max_size`, least recently used
+    entries are removed.
+
+    Parameters
+    ----------
+    directory : str or None
+        Where entries are stored. Default to `~/.cache/spindle_tracker/detection`.
+    max_size : int
+        Maximum size of the cache in bytes.
+
+    Examples
+    --------
+    >>> cache = DetectionCache(max_size=2 * 1024 ** 3)
+    >>> for threshold in [20, 25, 30]:
+    >>>     parameters['threshold'] = threshold
+    >>>     tracker.detect_peaks(parameters, erase=True, cache=cache)
+    """
+
+    def __init__(self, directory=None, max_size=1024 ** 3):
+
+        if directory is None:
+            directory = os.path.join(os.path.expanduser('~'), '.cache',
+                                     'spindle_tracker', 'detection')
+        self.directory = directory
+        self.max_size = int(max_size)
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        self.hits = 0
+        self.misses = 0
+        self._size = sum(size for _, _, size in self._entries())
+
+    @property
+    def size(self):
+        return self._size
+
+    def key(self, source_key, frame, parameters, data=None):
+        """Build the key of a frame.
+
+        Parameters
+        ----------
+        source_key : dict
+            Identify the source data (file fingerprint, channel, etc).
+        frame : int
+            Frame position in the source.
+        parameters : dict
+            Detection parameters.
+        data : numpy.ndarray or None
+            Frame content. If given, the key changes when the frame changes
+            even if `source_key` doesn't.
+
+        Returns
+        -------
+        str
+        """
+        content = [CACHE_VERSION, _normalize(source_key), int(frame),
+                   _normalize(parameters)]
+        if data is not None:
+            content.append(array_fingerprint(data))
+        content = json.dumps(content, sort_keys=True).encode('utf-8')
+        return hashlib.sha1(content).hexdigest()
+
+    def get(self, key):
+        """Return the cached result or None.
+        """
+        path = self._path(key)
+        try:
+            result = np.load(path)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+
+        # Used as access time for LRU eviction
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        """Store `result` (a numpy array) and evict old entries if needed.
+        """
+        path = self._path(key)
+        old_size = os.path.getsize(path) if os.path.isfile(path) else 0
+
+        # Write then rename so a concurrent reader never gets a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.asarray(result))
+        os.rename(tmp_path, path)
+
+        self._size += os.path.getsize(path) - old_size
+
+        if self._size > self.max_size:
+            self.evict()
+
+    def evict(self, max_size=None):
+        """Remove least recently used entries until the cache size is lower
+        than `max_size` (default to `self.max_size`).
+        """
+        if max_size is None:
+            max_size = self.max_size
+
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self._size = sum(size for _, _, size in entries)
+
+        n_removed = 0
+        for path, _, size in entries:
+            if self._size <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+            n_removed += 1
+
+        if n_removed:
+            log.info('Detection cache: {} entries evicted'.format(n_removed))
+
+    def clear(self):
+        """Remove every entry.
+        """
+        self.evict(max_size=0)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def _entries(self):
+        """Yield `(path, mtime, size)` for every entry.
+        """
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            yield path, stat.st_mtime, stat.st_size
+
+
+def file_fingerprint(path, chunk_size=2 ** 16):
+    """Identify a file without reading it all: its size and the hash of its
+    first and last `chunk_size` bytes. The fingerprint does not depend on the
+    file path so moving a file keeps its cache entries valid.
+
+    Changes in the middle of the file are not detected: give the frames to
+    :meth:`DetectionCache.key` too (see :func:`array_fingerprint`).
+    """
+    size = os.path.getsize(path)
+
+    sha = hashlib.sha1()
+    sha.update(str(size).encode('utf-8'))
+    with open(path, 'rb') as f:
+        sha.update(f.read(chunk_size))
+        if size > chunk_size:
+            f.seek(max(size - chunk_size, chunk_size))
+            sha.update(f.read(chunk_size))
+
+    return sha.hexdigest()
+
+
+def array_fingerprint(array):
+    """Hash of an array content, shape and dtype (and mask for masked
+    arrays).
+    """
+    data = np.ascontiguousarray(np.ma.getdata(array))
+
+    sha = hashlib.sha1()
+    sha.update(str((data.shape, data.dtype.str)).encode('utf-8'))
+    sha.update(data.view('uint8').ravel() if data.size else b'')
+    mask = np.ma.getmask(array)
+    if mask is not np.ma.nomask:
+        sha.update(np.packbits(np.ascontiguousarray(mask, dtype='bool')).tobytes())
+
+    return sha.hexdigest()
+
+
+def _normalize(value):
+    """Convert `value` to JSON serializable builtin types so equal parameters
+    always give the same key (`15`, `15.0` and `np.float64(15)` are equal).
+    """
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, float, np.number)):
+        return repr(float(value))
+    if value is None:
+        return None
+    return str(value)
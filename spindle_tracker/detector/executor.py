@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+
+import os
+import atexit
+import logging
+import tempfile
+import multiprocessing
+
+try:
+    import queue  # py3k
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+__all__ = ["DetectionExecutor", "get_executor"]
+
+
+class DetectionExecutor(object):
+    """Long-lived pool of detection workers.
+
+    Workers are started once and reused by every call to :meth:`imap` until
+    :meth:`close` is called. Frames are not pickled: they are written in a
+    memory mapped buffer of `buffer_size` slots and workers only receive the
+    slot offset. At most `buffer_size` frames are in flight at once.
+
+    Parameters
+    ----------
+    processes : int or None
+        Number of workers. Default to the number of CPUs.
+    buffer_size : int or None
+        Number of frames which can be in flight. Default to twice the number
+        of workers.
+
+    Examples
+    --------
+    >>> with DetectionExecutor(processes=4) as executor:
+    >>>     for tracker in trackers:
+    >>>         tracker.detect_peaks(parameters, executor=executor)
+    """
+
+    def __init__(self, processes=None, buffer_size=None):
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = max(int(processes), 1)
+
+        if buffer_size is None:
+            buffer_size = 2 * self.processes
+        self.buffer_size = max(int(buffer_size), 1)
+
+        self._pool = None
+        self._buffer = None
+        self._buffer_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def running(self):
+        return self._pool is not None
+
+    def start(self):
+        """Start workers if they are not already running.
+        """
+        if self.running:
+            return
+
+        # Allow workers to run on every core: numpy linked to some BLAS
+        # libraries resets the CPU affinity at import time.
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, range(multiprocessing.cpu_count()))
+
+        log.info('Starting {} detection workers'.format(self.processes))
+        self._pool = multiprocessing.Pool(processes=self.processes,
+                                          initializer=_init_worker)
+
+    def close(self):
+        """Stop workers and remove the frame buffer.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self._release_buffer()
+
+    def terminate(self):
+        """Kill workers immediately (for example on KeyboardInterrupt). They
+        will be started again on the next call to :meth:`imap`.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self._release_buffer()
+
+    def imap(self, func, frames, parameters):
+        """Apply `func(frame, **parameters)` on every frame.
+
+        Parameters
+        ----------
+        func : function
+            A module level (picklable) function.
+        frames : iterable of numpy.ndarray
+            Frames must share the same shape and dtype. Masked arrays are
+            given to `func` with their mask.
+        parameters : dict
+            Keyword arguments given to `func`.
+
+        Returns
+        -------
+        A generator of `(i, result)` tuples where `i` is the frame position in
+        `frames`. Results are yielded as soon as they are available (unordered).
+        """
+        self.start()
+        pool = self._pool
+
+        results = queue.Queue()
+        free_slots = list(range(self.buffer_size))
+        frames = iter(frames)
+        exhausted = False
+        n_pending = 0
+        i = 0
+
+        try:
+            while True:
+
+                # Keep the buffer full
+                while free_slots and not exhausted:
+                    try:
+                        frame = next(frames)
+                    except StopIteration:
+                        exhausted = True
+                        break
+
+                    # Masks are small compared to frames, send them with the task
+                    mask = np.ma.getmask(frame)
+                    mask = None if mask is np.ma.nomask else np.asarray(mask)
+                    frame = np.asarray(np.ma.getdata(frame))
+
+                    if i == 0:
+                        self._allocate_buffer(frame.shape, frame.dtype)
+                    elif frame.shape != self._buffer.shape[1:] or frame.dtype != self._buffer.dtype:
+                        raise ValueError("All frames should have the same shape and dtype.")
+
+                    slot = free_slots.pop()
+                    self._buffer[slot] = frame
+                    args = (self._buffer_path, slot * frame.nbytes, frame.shape,
+                            frame.dtype.str, mask, func, parameters, i, slot)
+                    pool.apply_async(_shared_frame_worker, (args,),
+                                     callback=results.put,
+                                     error_callback=results.put)
+                    n_pending += 1
+                    i += 1
+
+                if not n_pending:
+                    break
+
+                result = results.get()
+                n_pending -= 1
+                if isinstance(result, BaseException):
+                    self.terminate()
+                    n_pending = 0
+                    raise result
+
+                pos, slot, result = result
+                free_slots.append(slot)
+
+                yield pos, result
+
+        finally:
+            # The generator can be closed before the end: wait for the frames
+            # in flight so the next call can't overwrite their slots. Frames
+            # of a terminated (or closed) pool never come back.
+            if self._pool is pool:
+                for _ in range(n_pending):
+                    results.get()
+
+    def _allocate_buffer(self, shape, dtype):
+        """(Re)create the memory mapped buffer if frames shape or dtype changed.
+        """
+        if self._buffer is not None and self._buffer.shape[1:] == shape and \
+           self._buffer.dtype == dtype:
+            return
+
+        self._release_buffer()
+
+        # Prefer a RAM backed file system when available
+        tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        fd, self._buffer_path = tempfile.mkstemp(prefix='spindle_tracker_',
+                                                 suffix='.buffer',
+                                                 dir=tmp_dir)
+        os.close(fd)
+        self._buffer = np.memmap(self._buffer_path, dtype=dtype, mode='w+',
+                                 shape=(self.buffer_size,) + shape)
+
+    def _release_buffer(self):
+        """
+        """
+        self._buffer = None
+        if self._buffer_path is not None:
+            try:
+                os.remove(self._buffer_path)
+            except OSError:
+                pass
+            self._buffer_path = None
+
+
+_executor = None
+
+
+def get_executor(processes=None):
+    """Get the executor shared by every detection of the session. It is
+    started on the first call and replaced if `processes` changes.
+
+    Parameters
+    ----------
+    processes : int or None
+        Number of workers. Default to the number of CPUs.
+
+    Returns
+    -------
+    :class:`DetectionExecutor`
+    """
+    global _executor
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if _executor is not None and _executor.processes != processes:
+        _executor.close()
+        _executor = None
+
+    if _executor is None:
+        _executor = DetectionExecutor(processes=processes)
+
+    return _executor
+
+
+@atexit.register
+def _close_executor():  # pragma: no cover
+    if _executor is not None:
+        _executor.close()
+
+
+def _init_worker():  # pragma: no cover
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _shared_frame_worker(args):  # pragma: no cover
+    """Read a frame from the shared buffer and run the detection on it.
+    """
+    path, offset, shape, dtype, mask, func, parameters, i, slot = args
+    frame = np.array(np.memmap(path, dtype=np.dtype(dtype), mode='r',
+                               offset=offset, shape=shape))
+    if mask is not None:
+        frame = np.ma.masked_array(frame, mask=mask)
+    return i, slot, func(frame, **parameters)
@@ -2,23 +2,30 @@ import numpy as np
 import pandas as pd
 
 from scipy.ndimage import filters
+from scipy.signal import fftconvolve
+from scipy import fftpack
 from skimage.feature import peak_local_max
 
 from .utils import create_log_kernel
+from .utils import create_separable_log_kernel
 
 
-def log_detector(source, radius, ndims, calibration):
+def log_detector(source, radius, ndims, calibration, method='auto'):
     """
     Parameters
     ----------
     source : numpy.array
-        Source image
+        Source image (2D YX or 3D ZYX)
     radius : float
         Typical radius of a spot (in image unit)
     ndims : int
         Dimensions of the image (should be 2 or 3)
     calibration : list of float
-        Pixel sizes for each dimensions
+        Pixel sizes for each dimensions (same order as `source` axes)
+    method : str
+        Convolution method: 'fft', 'separable', 'direct' or 'auto'. 'auto'
+        chooses between 'fft' and 'separable' according to the kernel size
+        (see :func:`log_filter`).
 
     Examples
     --------
@@ -46,25 +53,183 @@ def log_detector(source, radius, ndims, calibration):
     ------
     pandas.DataFrame. Each line represents a detected spots.
     """
+    response = log_filter(source, radius, ndims, calibration, method=method)
+
+    peaks = peak_local_max(response, min_distance=1, threshold_rel=0, num_peaks=np.inf)
+    peaks = np.reshape(peaks, (-1, ndims))
+
+    return _build_spots(peaks, response[tuple(peaks.T)], radius, ndims)
+
+
+def multiscale_log_detector(source, radii, ndims, calibration, threshold=0):
+    """Scale-space LoG detector. Spots are the local maxima of the stack of
+    LoG responses computed over all `radii` (non-maximum suppression over
+    scale and space). Each spot gets the radius for which its response is
+    the highest.
+
+    The FFT of the source image is computed once and shared by all the
+    radii.
+
+    Parameters
+    ----------
+    source : numpy.array
+        Source image (2D YX or 3D ZYX)
+    radii : list of float
+        Radii of spots (in image unit) to test, in increasing order.
+    ndims : int
+        Dimensions of the image (should be 2 or 3)
+    calibration : list of float
+        Pixel sizes for each dimensions (same order as `source` axes)
+    threshold : float
+        Minimum quality of a spot.
+
+    Examples
+    --------
+    >>> # Detect spindle pole bodies and kinetochores in a single pass
+    >>> spots = multiscale_log_detector(source, np.linspace(0.1, 0.3, 5),
+    >>>                                 ndims=2, calibration=[0.0645, 0.0645])
+
+    Return
+    ------
+    pandas.DataFrame. Each line represents a detected spots.
+    """
+    radii = np.sort(np.atleast_1d(radii))
+    responses = log_filter_stack(source, radii, ndims, calibration)
+
+    # Non maximum suppression over scale and space
+    size = (3,) * (ndims + 1)
+    maxima = filters.maximum_filter(responses, size=size, mode='constant', cval=-np.inf)
+    peaks_map = (responses == maxima) & (responses > threshold)
+
+    # Exclude borders as peak_local_max does in log_detector
+    for axis in range(1, ndims + 1):
+        border = [slice(None)] * (ndims + 1)
+        border[axis] = [0, -1]
+        peaks_map[tuple(border)] = False
+
+    peaks = np.argwhere(peaks_map)
+    quality = responses[tuple(peaks.T)]
+
+    spots = _build_spots(peaks[:, 1:], quality, radii[peaks[:, 0]], ndims)
+    spots = spots.sort_values('quality', ascending=False)
+
+    return spots.reset_index(drop=True)
+
+
+def log_filter_stack(source, radii, ndims, calibration):
+    """Compute the LoG responses of `source` for several radii, sharing the
+    FFT of the (padded) source.
+
+    Returns
+    -------
+    responses : numpy.array
+        A `(len(radii),) + source.shape` array.
+    """
+    source = np.asarray(source, dtype='float')
+    kernels = [create_log_kernel(radius, ndims, calibration) for radius in radii]
+
+    max_shape = np.max([kernel.shape for kernel in kernels], axis=0)
+    padded = _pad_source(source, max_shape)
+    pad = max_shape // 2
+
+    fshape = [fftpack.next_fast_len(int(n)) for n in np.array(padded.shape) + max_shape - 1]
+    source_fft = np.fft.rfftn(padded, fshape)
+
+    responses = np.empty((len(kernels),) + source.shape)
+    for n, kernel in enumerate(kernels):
+        conv = np.fft.irfftn(source_fft * np.fft.rfftn(kernel, fshape), fshape)
+
+        # Keep the values centered on each source pixel
+        start = pad + np.array(kernel.shape) // 2
+        crop = tuple(slice(s, s + size) for s, size in zip(start, source.shape))
+        responses[n] = conv[crop]
+
+    return responses
+
+
+def log_filter(source, radius, ndims, calibration, method='auto'):
+    """Convolve `source` with the LoG kernel returned by
+    :func:`spindle_tracker.detector.utils.create_log_kernel` (reflected
+    boundaries).
+
+    Parameters
+    ----------
+    source : numpy.array
+    radius : float
+    ndims : int
+    calibration : list of float
+    method : str
+        'direct' uses :func:`scipy.ndimage.filters.convolve`. 'separable' sums
+        `ndims` separable convolutions (`ndims ** 2` 1D passes). 'fft' uses
+        :func:`scipy.signal.fftconvolve` on the padded source. 'auto' uses
+        'separable' for small kernels and 'fft' otherwise.
+
+    Returns
+    -------
+    response : numpy.array
+        Same shape as `source`.
+    """
+    source = np.asarray(source, dtype='float')
     kernel = create_log_kernel(radius, ndims, calibration)
 
-    fftconv = filters.convolve(source, kernel, mode='reflect', cval=0)
+    if method == 'auto':
+        method = _choose_convolution_method(source.shape, kernel.shape)
+
+    if method == 'direct':
+        return filters.convolve(source, kernel, mode='reflect', cval=0)
 
-    peaks = peak_local_max(fftconv, min_distance=1, threshold_rel=0, indices=True, num_peaks=np.inf)
+    elif method == 'separable':
+        response = np.zeros_like(source)
+        for kernels_1d in create_separable_log_kernel(radius, ndims, calibration):
+            conv = source
+            for axis, kernel_1d in enumerate(kernels_1d):
+                conv = filters.convolve1d(conv, kernel_1d, axis=axis, mode='reflect', cval=0)
+            response += conv
+        return response
 
-    spots = []
-    for peak in peaks:
-        x = peak[1]
-        y = peak[0]
-        if ndims < 3:
-            z = 0
-        else:
-            z = peaks[2]
+    elif method == 'fft':
+        return fftconvolve(_pad_source(source, kernel.shape), kernel, mode='valid')
 
-        quality = fftconv[y, x]
+    else:
+        raise ValueError("Unknown convolution method: {}".format(method))
+
+
+def _pad_source(source, kernel_shape):
+    """Pad source as 'reflect' mode of :mod:`scipy.ndimage` does so a 'valid'
+    convolution returns an array of the same shape as `source`.
+    """
+    pad_width = [(size // 2, size - 1 - size // 2) for size in kernel_shape]
+    return np.pad(source, pad_width, mode='symmetric')
 
-        spots.append([x, y, z, radius, quality])
 
-    spots = pd.DataFrame(spots, columns=['x', 'y', 'z', 'radius', 'quality'])
+def _choose_convolution_method(source_shape, kernel_shape):
+    """Compare the rough number of operations per pixel of a separable and a
+    FFT convolution.
+    """
+    ndims = len(kernel_shape)
+    separable_cost = ndims * np.sum(kernel_shape)
+
+    padded_size = np.prod(np.array(source_shape) + np.array(kernel_shape) - 1)
+    fft_cost = 10 * np.log2(padded_size)
+
+    if separable_cost <= fft_cost:
+        return 'separable'
+    else:
+        return 'fft'
+
+
+def _build_spots(peaks, quality, radius, ndims):
+    """Build the spots table from an array of peak coordinates (one line per
+    peak, in `source` axes order). `radius` is a float or an array (one
+    radius per peak).
+    """
+    n_spots = peaks.shape[0]
+
+    spots = pd.DataFrame({'x': peaks[:, -1],
+                          'y': peaks[:, -2],
+                          'z': peaks[:, -3] if ndims > 2 else np.zeros(n_spots, dtype='int'),
+                          'radius': np.ones(n_spots) * radius,
+                          'quality': quality},
+                         columns=['x', 'y', 'z', 'radius', 'quality'])
 
     return spots
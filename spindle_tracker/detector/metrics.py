@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+
+import time
+import logging
+import functools
+import contextlib
+from collections import OrderedDict
+from collections import defaultdict
+
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+__all__ = ["DetectionMetrics"]
+
+# Metrics of the frame being processed by this process (None when metrics
+# are not collected).
+_current = None
+
+
+class FrameMetrics(object):
+    """Time spent in each stage and counters of the detection of one frame.
+    """
+
+    def __init__(self):
+        self.timings = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def as_dict(self):
+        """Flat dict with `time_<stage>` (in seconds) and `n_<counter>` keys.
+        """
+        metrics = OrderedDict()
+        for stage, duration in sorted(self.timings.items()):
+            metrics['time_' + stage] = duration
+        for name, count in sorted(self.counts.items()):
+            metrics['n_' + name] = count
+        return metrics
+
+
+@contextlib.contextmanager
+def collect():
+    """Collect metrics of the code run in the context. Yields a
+    :class:`FrameMetrics`.
+    """
+    global _current
+
+    previous = _current
+    _current = FrameMetrics()
+    start = time.time()
+    try:
+        yield _current
+    finally:
+        _current.timings['total'] += time.time() - start
+        _current = previous
+
+
+@contextlib.contextmanager
+def timer(stage):
+    """Add the time spent in the context to `stage`.
+    """
+    if _current is None:
+        yield
+        return
+
+    frame_metrics = _current
+    start = time.time()
+    try:
+        yield
+    finally:
+        frame_metrics.timings[stage] += time.time() - start
+
+
+def timed(stage):
+    """Decorator adding the time spent in a function to `stage`.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current is None:
+                return func(*args, **kwargs)
+            with timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """Increment the `name` counter by `n`.
+    """
+    if _current is not None:
+        _current.counts[name] += n
+
+
+class DetectionMetrics(object):
+    """Metrics hook for :func:`spindle_tracker.detector.peak_detector`.
+    Stores metrics of every detected frame.
+
+    Examples
+    --------
+    >>> metrics = DetectionMetrics()
+    >>> peaks = peak_detector(im, metadata, metrics=metrics)
+    >>> metrics.to_frame().sort_values('time_total').tail()
+    >>> metrics.summary()
+    """
+
+    def __init__(self):
+        self.frames = []
+
+    def __call__(self, frame, frame_metrics):
+        row = OrderedDict(frame=frame)
+        row.update(frame_metrics)
+        self.frames.append(row)
+
+    def to_frame(self):
+        """One line per frame, indexed by frame position (`(frame, channel)`
+        with :func:`spindle_tracker.detector.multichannel_peak_detector`).
+        """
+        if not self.frames:
+            return pd.DataFrame([])
+        return pd.DataFrame(self.frames).fillna(0).set_index('frame').sort_index()
+
+    def summary(self):
+        """Metrics summed over all the frames.
+        """
+        return self.to_frame().sum()
+
+
+def format_summary(summary):
+    """Format summed metrics on one line.
+    """
+    timings = ['{} {:.2f}s'.format(key[5:], value) for key, value in summary.items()
+               if key.startswith('time_')]
+    counts = ['{} {:d}'.format(key[2:], int(value)) for key, value in summary.items()
+              if key.startswith('n_')]
+    return ', '.join(timings + counts)
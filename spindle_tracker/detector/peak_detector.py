@@ -8,24 +8,31 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 
-import os
 import logging
-import subprocess
-import multiprocessing
+import warnings
+import functools
 import itertools
 
-try:
-    from subprocess import DEVNULL  # py3k
-except ImportError:
-    DEVNULL = open(os.devnull, 'wb')
-
+from scipy import ndimage
 from scipy.optimize import leastsq
+from scipy.signal import fftconvolve
+from scipy.spatial.distance import cdist
+from scipy import stats
 from skimage import feature
 
 import numpy as np
 import pandas as pd
 
 from ..utils import print_progress
+from .executor import get_executor
+from . import metrics as detection_metrics
+
+try:
+    import numba
+except ImportError:
+    numba = None
+else:
+    from . import _numba_tools
 
 log = logging.getLogger(__name__)
 
@@ -34,21 +41,39 @@ __all__ = []
 DEFAULT_PARAMETERS = {'w_s': 0.7,
                       'peak_radius': 0.2,
                       'threshold': 27.,
-                      'max_peaks': 1e4
+                      'max_peaks': 1e4,
+                      'incremental': True,
+                      'backend': 'numpy'
                       }
 
+DEFAULT_PARAMETERS_3D = {'w_s_z': 1.5,
+                         'peak_radius_z': 0.5
+                         }
+
+# Fields of the record arrays returned by detection workers
+PEAK_FIELDS = ['y', 'x', 'w', 'I']
+PEAK_FIELDS_3D = ['y', 'x', 'w', 'I', 'z', 'w_z']
+
 
 def peak_detector(im,
                   metadata,
                   parallel=True,
                   show_progress=False,
-                  parameters={}):
+                  parameters={},
+                  processes=None,
+                  executor=None,
+                  volume=False,
+                  cache=None,
+                  source_key=None,
+                  guide=None,
+                  roi_radius=1.,
+                  metrics=None):
     """Gaussian peak detection described in Segré et al. Nature Methods, (2008).
 
     Parameters
     ----------
     im : numpy array
-        To iterate over data.
+        To iterate over data (planes, or Z stacks if `volume` is True).
     metadata : dict
         Metadata to scale detected peaks and parameters.
     parallel : bool
@@ -73,6 +98,55 @@ def peak_detector(im,
                 once for a given data set.
             - max_peaks : int, optional
                 Deflation loop will stop if detected peaks is higher than max_peaks.
+            - incremental : bool, optional
+                If True (default), the image is deflated in place and the
+                hypothesis map is only recomputed around the peaks removed at
+                each deflation loop. If False, the whole map is recomputed.
+            - backend : str, optional
+                'numpy' or 'numba'. With 'numba', the sliding window GLRT, the
+                gauss model and the deflation are run by compiled kernels
+                (2D detection only). Fall back to 'numpy' if numba is not
+                installed.
+            - w_s_z: float, optional
+                Axial width (in um) of the sliding window (only if `volume` is True).
+            - peak_radius_z: float, optional
+                Typical axial radius (in um) of the peaks to detect (only if
+                `volume` is True).
+    processes : int or None
+        Maximum number of workers used when `parallel` is True. Default to the
+        number of CPUs.
+    executor : :class:`spindle_tracker.detector.DetectionExecutor` or None
+        Executor used when `parallel` is True. If None, the executor shared by
+        all the detections of the session is used (its workers are started
+        only once).
+    volume : bool
+        If True, each item of `im` is a whole Z stack and peaks are detected
+        in 3D (see :func:`_find_gaussian_peaks_3d`): their z position is
+        fitted instead of being the plane index. Physical sizes along Z are
+        taken from `metadata`.
+    cache : :class:`spindle_tracker.detector.DetectionCache` or None
+        If given, results of frames already detected with the same
+        parameters and content are loaded from the cache instead of being
+        computed again. `source_key` is required.
+    source_key : dict or None
+        Identify `im` in the cache (see
+        :func:`spindle_tracker.detector.cache.file_fingerprint`).
+    guide : str, :class:`pd.DataFrame` or None
+        If not None, peaks are only searched in windows around expected
+        positions (see :func:`_guided_detection`). Use 'previous' to take
+        positions detected on the previous time point or give a
+        :class:`spindle_tracker.trajectories.Trajectories` (positions in
+        physical units). A full frame scan is done when a track is lost.
+        Frames are processed serially and `cache` is not used.
+    roi_radius : float
+        Half width (in um) of the windows used with `guide`.
+    metrics : callable or None
+        Called as `metrics(frame, frame_metrics)` for each detected frame (not
+        loaded from cache). `frame_metrics` is a dict of the time spent in
+        each stage (GLRT, local maximum search, fit and deflation) and of the
+        number of candidates, accepted peaks and deflation loops (see
+        :class:`spindle_tracker.detector.DetectionMetrics`). Metrics summed
+        over all frames are logged at the end of the detection.
 
     Returns
     -------
@@ -81,120 +155,512 @@ def peak_detector(im,
 
     log.info('Initializing peak detection')
 
-    _parameters = DEFAULT_PARAMETERS.copy()
-    _parameters.update(parameters.copy())
-    parameters = _parameters
+    parameters = _scale_parameters(parameters, metadata, volume)
 
-    # Scale parameters in pixels
-    parameters['w_s'] /= metadata['PhysicalSizeX']
-    parameters['w_s'] = np.round(parameters['w_s'])
-    parameters['peak_radius'] /= metadata['PhysicalSizeX']
+    if volume:
+        # Find number of stacks to process
+        n_stack = int(metadata['SizeT'])
+        find_peaks = _find_gaussian_peaks_3d
+        find_peaks_records = _find_gaussian_peaks_3d_records
+        find_peaks_buffer = find_gaussian_peaks_3d
+    else:
+        # Find number of stacks to process
+        # Only iteration over T and Z are assumed
+        n_stack = int(metadata['SizeT'] * metadata['SizeZ'])
+        find_peaks = _find_gaussian_peaks
+        find_peaks_records = _find_gaussian_peaks_records
+        find_peaks_buffer = find_gaussian_peaks
 
-    # Find number of stacks to process
-    # Only iteration over T and Z are assumed
-    n_stack = int(metadata['SizeT'] * metadata['SizeZ'])
+    if cache is not None and source_key is None:
+        raise ValueError("source_key is required to use a detection cache.")
+
+    if guide is not None:
+        if parallel:
+            log.info('Guided detection runs in a single process')
+        parallel = False
+        cache = None
+
+    if parallel and executor is None:
+        executor = get_executor(processes)
+
+    # Frames found in cache are not given to workers. `miss_index` maps
+    # positions of the frames given to workers to their position in `im`.
+    all_peaks = []
+    miss_index = []
+    cache_keys = {}
+    total_metrics = {}
+
+    def cache_filter(frames):
+        for n, frame in enumerate(frames):
+            if cache is not None:
+                key = cache.key(dict(source_key, volume=volume), n, parameters,
+                                data=frame)
+                peaks = cache.get(key)
+                if peaks is not None:
+                    all_peaks.append((n, peaks))
+                    continue
+                cache_keys[n] = key
+            miss_index.append(n)
+            yield frame
+
+    try:
+        # Launch peak_detection
+        if guide is not None:
+            results = _guided_detection(cache_filter(im), metadata, parameters,
+                                        find_peaks, guide, roi_radius, volume)
+        elif parallel:
+            results = executor.imap(find_peaks_records, cache_filter(im), parameters)
+        else:
+            # Build arguments list
+            arguments = zip(cache_filter(im),
+                            itertools.repeat(parameters),
+                            itertools.count())
+            results = map(find_peaks_buffer, arguments)
+
+        # Get unordered results and log progress
+        for pos, (peaks, frame_metrics) in results:
+
+            pos = miss_index[pos]
 
-    if parallel:
+            for key, value in frame_metrics.items():
+                total_metrics[key] = total_metrics.get(key, 0) + value
+            if metrics is not None:
+                metrics(pos, frame_metrics)
 
-        # Snippet to allow multiprocessing while importing
-        # module such as numpy (only needed on linux)
-        if os.name == 'posix':
-            subprocess.call("taskset -p 0xff %d" % os.getpid(),
-                            shell=True,
-                            stdout=DEVNULL,
-                            stderr=DEVNULL)
+            peaks['frame'] = pos
+            if pos in cache_keys:
+                cache.put(cache_keys[pos], peaks)
 
-        def init_worker():
-            import signal
-            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            all_peaks.append((pos, peaks))
+
+            # Frames loaded from cache are counted as done
+            n_done = len(all_peaks)
+            n_peaks = len(peaks)
+            percent_progression = n_done / n_stack * 100
+
+            if show_progress:
+                message = ("%i/%i - %i peaks detected on stack n°%i" %
+                           (n_done, n_stack, n_peaks, pos))
+                print_progress(percent_progression, message)
+
+        if show_progress:
+            print_progress(-1)
+
+    except KeyboardInterrupt:
+        if parallel:
+            executor.terminate()
+        raise Exception('Detection has been canceled by user')
+
+    if cache is not None:
+        log.info('Detection cache: {} hits, {} misses'.format(
+            len(all_peaks) - len(miss_index), len(miss_index)))
+
+    if total_metrics:
+        log.info('Detection metrics on {} frames: {}'.format(
+            len(miss_index), detection_metrics.format_summary(total_metrics)))
+
+    if not all_peaks:
+        return pd.DataFrame([])
+
+    # Concatenate peaks once, sorted by frame
+    all_peaks.sort(key=lambda x: x[0])
+    peaks = np.concatenate([x[1] for x in all_peaks])
+
+    if not len(peaks):
+        return pd.DataFrame([])
+
+    log.info('Terminating peak detection')
 
-        ncore = multiprocessing.cpu_count() + 1
-        pool = multiprocessing.Pool(processes=ncore, initializer=init_worker)
+    return _build_peaks_frame(peaks, metadata, volume)
 
-    # Build arguments list
-    arguments = zip(im,
-                    itertools.repeat(parameters),
-                    range(n_stack))
+
+def multichannel_peak_detector(im,
+                               metadata,
+                               channel_parameters,
+                               parallel=True,
+                               show_progress=False,
+                               processes=None,
+                               executor=None,
+                               metrics=None):
+    """Detect peaks of several channels reading data only once (see
+    :func:`peak_detector`). Each channel has its own detection parameters.
+
+    Parameters
+    ----------
+    im : iterable of numpy array
+        Each item is a `(n_channels, Y, X)` array of the planes of every
+        channel at the same T and Z position (see
+        :meth:`spindle_tracker.io.StackIO.plane_iterator` with a list of
+        channels).
+    metadata : dict
+        Metadata to scale detected peaks and parameters.
+    channel_parameters : OrderedDict
+        Keys are channels (in the same order than in `im` items) and values
+        detection parameters (see :func:`peak_detector`).
+    parallel, show_progress, processes, executor : see :func:`peak_detector`.
+    metrics : callable or None
+        Called as `metrics((frame, channel), frame_metrics)` for each frame
+        and channel (same hook as :func:`peak_detector`, for example a
+        :class:`spindle_tracker.detector.metrics.DetectionMetrics`).
+
+    Returns
+    -------
+    peaks : dict
+        Keys are channels and values :class:`pd.DataFrame` as returned by
+        :func:`peak_detector`.
+
+    Examples
+    --------
+    >>> channel_parameters = OrderedDict([('GFP', gfp_parameters),
+    >>>                                   ('RFP', rfp_parameters)])
+    >>> planes = st.plane_iterator(channel_index=list(channel_parameters.keys()))
+    >>> peaks = multichannel_peak_detector(planes(), metadata, channel_parameters)
+    """
+
+    log.info('Initializing multichannel peak detection')
+
+    channels = list(channel_parameters.keys())
+    parameters = {'channel_parameters': [_scale_parameters(channel_parameters[c], metadata)
+                                         for c in channels]}
+
+    n_stack = int(metadata['SizeT'] * metadata['SizeZ'])
+
+    if parallel and executor is None:
+        executor = get_executor(processes)
+
+    all_peaks = {c: [] for c in channels}
+    total_metrics = {}
 
     try:
-        # Launch peak_detection
         if parallel:
-            results = pool.imap_unordered(find_gaussian_peaks, arguments)
+            results = executor.imap(_find_gaussian_peaks_channels, im, parameters)
         else:
-            results = map(find_gaussian_peaks, arguments)
+            results = ((pos, _find_gaussian_peaks_channels(frame, **parameters))
+                       for pos, frame in enumerate(im))
 
-        all_peaks = []
+        for i, (pos, channel_results) in enumerate(results):
 
-        # Get unordered results and log progress
-        for i, (pos, peaks) in enumerate(results):
+            for c, (peaks, frame_metrics) in zip(channels, channel_results):
+                peaks['frame'] = pos
+                all_peaks[c].append((pos, peaks))
 
-            n_peaks = len(peaks)
-            percent_progression = (i + 1) / n_stack * 100
+                for key, value in frame_metrics.items():
+                    total_metrics[key] = total_metrics.get(key, 0) + value
+                if metrics is not None:
+                    metrics((pos, c), frame_metrics)
 
             if show_progress:
+                n_peaks = sum(len(peaks) for peaks, _ in channel_results)
                 message = ("%i/%i - %i peaks detected on stack n°%i" %
                            ((i + 1), n_stack, n_peaks, pos))
-                print_progress(percent_progression, message)
-
-            all_peaks.append((pos, peaks))
+                print_progress((i + 1) / n_stack * 100, message)
 
         if show_progress:
             print_progress(-1)
 
     except KeyboardInterrupt:
         if parallel:
-            pool.terminate()
-            pool.join()
+            executor.terminate()
         raise Exception('Detection has been canceled by user')
 
-    if parallel:
-        pool.close()
-        pool.terminate()
+    if total_metrics:
+        log.info('Detection metrics on {} frames and {} channels: {}'.format(
+            n_stack, len(channels), detection_metrics.format_summary(total_metrics)))
 
-    # Sort peaks and remove index used to sort
-    all_peaks.sort(key=lambda x: x[0])
-    all_peaks = [x[1] for x in all_peaks]
+    peaks_dfs = {}
+    for c in channels:
+        all_peaks[c].sort(key=lambda x: x[0])
+        peaks = np.concatenate([x[1] for x in all_peaks[c]]) if all_peaks[c] else []
+        if len(peaks):
+            peaks_dfs[c] = _build_peaks_frame(peaks, metadata)
+        else:
+            peaks_dfs[c] = pd.DataFrame([])
 
-    # Store peaks in pd.DataFrame
-    index = []
-    peaks_df = []
+    log.info('Terminating multichannel peak detection')
 
-    for n, peaks in enumerate(all_peaks):
-        if peaks.any():
-            for peak in peaks:
-                peaks_df.append(peak)
-                index.append((n,))
+    return peaks_dfs
 
-    if not peaks_df:
-        return pd.DataFrame([])
 
-    log.info('Terminating peak detection')
+def calibrate_threshold(im, metadata, false_alarm_rate=1e-5, n_frames=10,
+                        parameters={}, volume=False):
+    """Compute the `threshold` parameter of :func:`peak_detector` giving a
+    constant false alarm rate (CFAR).
+
+    Under the null hypothesis (background only), the GLRT statistic follows a
+    chi-square distribution with one degree of freedom. Camera noise and
+    background structures inflate it so its scale is estimated from the
+    median of the hypothesis maps of `n_frames` frames evenly sampled from
+    `im`. The median is not sensitive to the few positions covered by peaks.
+
+    Parameters
+    ----------
+    im : iterable of numpy array
+        Same as :func:`peak_detector`.
+    metadata : dict
+        Same as :func:`peak_detector`.
+    false_alarm_rate : float
+        Probability for a background position to be detected as a peak.
+    n_frames : int
+        Number of frames used to compute the background distribution.
+    parameters : dict
+        Same as :func:`peak_detector` (`threshold` is not used).
+    volume : bool
+        Same as :func:`peak_detector`.
+
+    Returns
+    -------
+    threshold : float
+
+    Examples
+    --------
+    >>> threshold = calibrate_threshold(st.plane_iterator()(), metadata,
+    >>>                                 false_alarm_rate=1e-6)
+    >>> parameters['threshold'] = threshold
+    >>> peaks = peak_detector(st.plane_iterator()(), metadata, parameters=parameters)
+    """
+    parameters = _scale_parameters(parameters, metadata, volume)
+
+    if volume:
+        n_stack = int(metadata['SizeT'])
+    else:
+        n_stack = int(metadata['SizeT'] * metadata['SizeZ'])
 
-    peaks_df = pd.DataFrame(peaks_df, columns=['y', 'x', 'w', 'I'], dtype='float')
-    peaks_df.index = pd.MultiIndex.from_tuples(index, names=['t_stamp'])
+    sampled = set(np.linspace(0, n_stack - 1, min(n_frames, n_stack)).astype('int'))
 
-    t_stamp = peaks_df.index.get_level_values('t_stamp').values
-    peaks_df['t'] = t_stamp // metadata['SizeZ']
-    peaks_df['z'] = t_stamp % metadata['SizeZ']
+    h_values = []
+    for n, frame in enumerate(im):
+        if n not in sampled:
+            continue
+
+        frame = np.asarray(frame, dtype='float')
+        if volume:
+            w_s_z = int(min(parameters['w_s_z'], frame.shape[0] - 1))
+            g_patch = gauss_patch_3d(parameters['peak_radius'], parameters['peak_radius_z'],
+                                     int(parameters['w_s']), w_s_z)
+            hmap = template_glrt_map(frame, g_patch)
+        else:
+            hmap = glrt_map(frame, parameters['peak_radius'], parameters['w_s'],
+                            backend=_check_backend(parameters['backend']))
 
-    peaks_df['label'] = np.arange(len(peaks_df))
+        h_values.append(hmap[np.isfinite(hmap)].ravel())
 
-    peaks_df = peaks_df.reset_index(level=['t_stamp', 'label'])
-    peaks_df['t_stamp'] = peaks_df['t'].copy()
-    peaks_df.set_index(['t_stamp', 'label'], inplace=True)
+        if n == max(sampled):
+            break
+
+    h_values = np.concatenate(h_values)
+    scale = np.median(h_values) / stats.chi2.median(1)
+    threshold = scale * stats.chi2.isf(false_alarm_rate, 1)
 
-    if "PhysicalSizeX" in metadata.keys():
-        peaks_df['x'] *= metadata["PhysicalSizeX"]
-    if "PhysicalSizeY" in metadata.keys():
-        peaks_df['y'] *= metadata["PhysicalSizeY"]
-    if "PhysicalSizeZ" in metadata.keys():
-        peaks_df['z'] *= metadata["PhysicalSizeZ"]
-    if "PhysicalSizeX" in metadata.keys():
-        peaks_df['w'] *= metadata["PhysicalSizeX"]
-    if "TimeIncrement" in metadata.keys():
-        peaks_df['t'] *= metadata["TimeIncrement"]
+    log.info('Calibrated threshold: {:.2f} for a false alarm rate of {} '
+             '(chi2 scale: {:.3f}, {} positions sampled)'.format(threshold, false_alarm_rate,
+                                                                 scale, len(h_values)))
 
-    return peaks_df
+    return threshold
+
+
+def _scale_parameters(parameters, metadata, volume=False):
+    """Complete `parameters` with default values and scale them in pixels.
+    """
+    _parameters = DEFAULT_PARAMETERS.copy()
+    if volume:
+        _parameters.update(DEFAULT_PARAMETERS_3D)
+    _parameters.update(parameters.copy())
+    parameters = _parameters
+
+    if volume:
+        # Only used by the 2D detection
+        parameters.pop('incremental', None)
+        parameters.pop('backend', None)
+
+    parameters['w_s'] /= metadata['PhysicalSizeX']
+    parameters['w_s'] = np.round(parameters['w_s'])
+    parameters['peak_radius'] /= metadata['PhysicalSizeX']
+
+    if volume:
+        parameters['w_s_z'] /= metadata['PhysicalSizeZ']
+        parameters['w_s_z'] = np.round(parameters['w_s_z'])
+        parameters['peak_radius_z'] /= metadata['PhysicalSizeZ']
+
+    return parameters
+
+
+def _build_peaks_frame(peaks, metadata, volume=False):
+    """Build the `t_stamp`/`label` indexed DataFrame from the record array of
+    all the peaks (see :func:`peaks_to_records`) and scale it with physical
+    sizes found in `metadata`.
+    """
+    frame = peaks['frame']
+    data = {field: peaks[field] for field in PEAK_FIELDS}
+
+    if volume:
+        columns = PEAK_FIELDS_3D + ['t']
+        data['z'] = peaks['z']
+        data['w_z'] = peaks['w_z']
+        t_stamp = frame
+    else:
+        columns = PEAK_FIELDS + ['t', 'z']
+        t_stamp = frame // metadata['SizeZ']
+        data['z'] = (frame % metadata['SizeZ']).astype('float')
+
+    data['t'] = t_stamp.astype('float')
+
+    scales = [('x', 'PhysicalSizeX'), ('y', 'PhysicalSizeY'), ('z', 'PhysicalSizeZ'),
+              ('w', 'PhysicalSizeX'), ('t', 'TimeIncrement')]
+    if volume:
+        scales.append(('w_z', 'PhysicalSizeZ'))
+
+    for column, key in scales:
+        if key in metadata.keys():
+            data[column] = data[column] * metadata[key]
+
+    index = pd.MultiIndex.from_arrays([t_stamp, np.arange(len(peaks))],
+                                      names=['t_stamp', 'label'])
+
+    return pd.DataFrame(data, index=index, columns=columns)
+
+
+def peaks_to_records(peaks, frame=-1, volume=False):
+    """Convert a Nx4 (Nx6 if `volume` is True) peaks array to a record array
+    with fields `PEAK_FIELDS` (or `PEAK_FIELDS_3D`) and 'frame'.
+    """
+    fields = PEAK_FIELDS_3D if volume else PEAK_FIELDS
+    dtype = [(field, 'f8') for field in fields] + [('frame', 'i8')]
+
+    peaks = np.asarray(peaks, dtype='float').reshape(-1, len(fields))
+    records = np.empty(len(peaks), dtype=dtype)
+    for n, field in enumerate(fields):
+        records[field] = peaks[:, n]
+    records['frame'] = frame
+
+    return records
+
+
+def _guided_detection(frames, metadata, parameters, find_peaks,
+                      guide, roi_radius, volume):  # pragma: no cover
+    """Detect peaks frame by frame, only in windows around expected positions.
+
+    Expected positions are the peaks detected on the previous time point (at
+    the same z plane) if `guide` is 'previous', or positions of `guide` (a
+    DataFrame indexed by 't_stamp' with 'x' and 'y' columns in physical
+    units) at the same time point. When there is no expected position or
+    when a window does not contain any peak (lost track), the whole frame is
+    scanned.
+
+    Returns
+    -------
+    A generator of `(i, (peaks, metrics))` tuples.
+    """
+    size_z = 1 if volume else int(metadata['SizeZ'])
+    roi_radius = roi_radius / metadata['PhysicalSizeX']
+    previous = {}
+    n_full = 0
+    n_frames = 0
+
+    for pos, frame in enumerate(frames):
+        t, z = pos // size_z, pos % size_z
+
+        with detection_metrics.collect() as frame_metrics:
+            peaks, full_scan = _guided_frame_detection(frame, t, previous.get(z), metadata,
+                                                       parameters, find_peaks, guide,
+                                                       roi_radius)
+        n_full += full_scan
+
+        previous[z] = peaks[:, :2] if len(peaks) else None
+        n_frames += 1
+
+        yield pos, (peaks_to_records(peaks, pos, volume), frame_metrics.as_dict())
+
+    log.info('Guided detection: {} full frame scans on {} frames'.format(n_full, n_frames))
+
+
+def _guided_frame_detection(frame, t, previous, metadata, parameters,
+                            find_peaks, guide, roi_radius):  # pragma: no cover
+    """Detect peaks of one frame for :func:`_guided_detection`. `previous`
+    are the peaks positions of the previous time point.
+
+    Returns
+    -------
+    peaks : ndarray
+    full_scan : bool
+        True if the whole frame has been scanned.
+    """
+    if isinstance(guide, str) and guide == 'previous':
+        centers = previous
+    else:
+        try:
+            positions = guide.xs(t, level='t_stamp')
+        except KeyError:
+            centers = None
+        else:
+            centers = np.array([positions['y'] / metadata['PhysicalSizeY'],
+                                positions['x'] / metadata['PhysicalSizeX']]).T
+
+    peaks = None
+    if centers is not None and len(centers):
+        peaks, lost = _find_gaussian_peaks_roi(frame, centers, roi_radius,
+                                               find_peaks, parameters)
+        if lost:
+            peaks = None
+
+    if peaks is None:
+        return np.array(find_peaks(frame, **parameters)), True
+
+    return peaks, False
+
+
+def _find_gaussian_peaks_roi(image, centers, roi_radius,
+                             find_peaks, parameters):  # pragma: no cover
+    """Run `find_peaks` only on windows of `roi_radius` pixels around
+    `centers` (row, column). Overlapping windows are merged. Each window is
+    extended by `w_s` pixels so the hypothesis map is computed with some
+    background around it but only peaks inside the window are kept.
+
+    Returns
+    -------
+    peaks : ndarray
+        Same as `find_peaks`, in `image` coordinates.
+    lost : bool
+        True if a window does not contain any peak.
+    """
+    shape = np.array(image.shape[-2:])
+    centers = np.round(centers).astype('int')
+    inside = np.all((centers >= 0) & (centers < shape), axis=1)
+    if not np.all(inside):
+        return np.array([]), True
+
+    r = int(np.ceil(roi_radius))
+    roi = np.zeros(shape, dtype='bool')
+    for y, x in centers:
+        roi[max(y - r, 0):y + r + 1, max(x - r, 0):x + r + 1] = True
+
+    labels, _ = ndimage.label(roi)
+    margin = int(parameters['w_s'])
+
+    peaks = []
+    for n, (sl_y, sl_x) in enumerate(ndimage.find_objects(labels)):
+        sl_y = slice(max(sl_y.start - margin, 0), min(sl_y.stop + margin, shape[0]))
+        sl_x = slice(max(sl_x.start - margin, 0), min(sl_x.stop + margin, shape[1]))
+
+        crop_peaks = np.array(find_peaks(image[..., sl_y, sl_x], **parameters), dtype='float')
+        if not len(crop_peaks):
+            continue
+
+        crop_peaks[:, 0] += sl_y.start
+        crop_peaks[:, 1] += sl_x.start
+
+        rows = np.clip(np.round(crop_peaks[:, :2]).astype('int'), 0, shape - 1)
+        peaks.append(crop_peaks[labels[rows[:, 0], rows[:, 1]] == n + 1])
+
+    peaks = [p for p in peaks if len(p)]
+    if not peaks:
+        return np.array([]), True
+    peaks = np.concatenate(peaks)
+
+    # A track is lost when its window is empty
+    distances = cdist(centers, peaks[:, :2], metric='chebyshev')
+    lost = np.any(distances.min(axis=1) > r)
+
+    return peaks, lost
 
 
 def find_gaussian_peaks(args):  # pragma: no cover
@@ -202,12 +668,31 @@ def find_gaussian_peaks(args):  # pragma: no cover
     Buffer function for _find_gaussian_peaks
     """
     frame, detection_parameters, i = args
-    print(detection_parameters)
-    return (i, _find_gaussian_peaks(frame, **detection_parameters))
+    return (i, _find_gaussian_peaks_records(frame, **detection_parameters))
+
+
+def _find_gaussian_peaks_records(image, **parameters):  # pragma: no cover
+    """
+    Same as :func:`_find_gaussian_peaks` but returns a record array (see
+    :func:`peaks_to_records`) and the detection metrics of the frame.
+    """
+    with detection_metrics.collect() as frame_metrics:
+        peaks = _find_gaussian_peaks(image, **parameters)
+    return peaks_to_records(peaks), frame_metrics.as_dict()
+
+
+def _find_gaussian_peaks_channels(frame, channel_parameters):  # pragma: no cover
+    """
+    Run :func:`_find_gaussian_peaks_records` on each channel of `frame` (a
+    `(n_channels, Y, X)` array) with its own parameters.
+    """
+    return [_find_gaussian_peaks_records(plane, **parameters)
+            for plane, parameters in zip(frame, channel_parameters)]
 
 
 def _find_gaussian_peaks(image, w_s=15, peak_radius=1.5,
-                         threshold=27., max_peaks=1e4):  # pragma: no cover
+                         threshold=27., max_peaks=1e4, incremental=True,
+                         backend='numpy'):  # pragma: no cover
     """
     This function implements the Gaussian peak detection described
     in Segré et al. Nature Methods **5**, 8 (2008). It is based on a
@@ -237,6 +722,12 @@ def _find_gaussian_peaks(image, w_s=15, peak_radius=1.5,
         A higher `threshold` corresponds to a more stringent test.
         According to the authors, this parameters needs to be adjusted
         once for a given data set.
+    max_peaks: int, optional
+        Deflation loop will stop if detected peaks is higher than max_peaks.
+    incremental: bool, optional
+        If True (default), see :func:`_find_gaussian_peaks_incremental`.
+    backend: str, optional
+        'numpy' or 'numba' (see :func:`_check_backend`).
 
     Returns
     -------
@@ -247,34 +738,184 @@ def _find_gaussian_peaks(image, w_s=15, peak_radius=1.5,
         and (background corrected) intensity of a detected peak (in that order).
 
     """
+    backend = _check_backend(backend)
+
+    if incremental:
+        return _find_gaussian_peaks_incremental(image, w_s, peak_radius,
+                                                threshold, max_peaks, backend)
+
     peaks_coords = glrt_detection(image, peak_radius,
-                                  w_s, threshold)
-    peaks = gauss_estimation(image, peaks_coords, w_s)
-    d_image = image_deflation(image, peaks, w_s)
+                                  w_s, threshold, backend)
+    peaks = gauss_estimation(image, peaks_coords, w_s, backend)
+    found = set(tuple(peak[:2]) for peak in peaks)
+    d_image = image_deflation(image, peaks, w_s, backend=backend)
     peaks_coords = glrt_detection(d_image, peak_radius,
-                                  w_s, threshold)
-    i  = 1
+                                  w_s, threshold, backend)
+    detection_metrics.count('deflation_loops')
     while len(peaks_coords) > 0 and len(peaks) < max_peaks:
-        new_peaks = gauss_estimation(d_image, peaks_coords, w_s)
+        new_peaks = gauss_estimation(d_image, peaks_coords, w_s, backend)
+        # A peak that deflation can't remove would be fitted again
+        new_peaks = [peak for peak in new_peaks if tuple(peak[:2]) not in found]
         # in case the 2D gauss fit fails
         if len(new_peaks) < 1:
             break
+        found.update(tuple(peak[:2]) for peak in new_peaks)
         peaks.extend(new_peaks[:])
-        d_image = image_deflation(d_image, new_peaks, w_s)
+        d_image = image_deflation(d_image, new_peaks, w_s, backend=backend)
         peaks_coords = glrt_detection(d_image, peak_radius,
-                                      w_s, threshold)
-        i += 1
+                                      w_s, threshold, backend)
+        detection_metrics.count('deflation_loops')
     peaks = np.array(peaks)
-    print("Number of deflation loop : {}".format(i))
+    detection_metrics.count('peaks', len(peaks))
     return peaks
 
 
-def image_deflation(image, peaks, w_s):  # pragma: no cover
+def _find_gaussian_peaks_incremental(image, w_s, peak_radius,
+                                     threshold, max_peaks, backend='numpy'):  # pragma: no cover
+    """
+    Same detection as :func:`_find_gaussian_peaks` but each deflation loop
+    only costs O(peaks * w_s^2) instead of O(image).
+
+    The image is deflated in place and the hypothesis map is only recomputed
+    on the positions whose window overlaps a removed peak. The local maximum
+    search is restricted to these dirty positions since the map is unchanged
+    everywhere else. Candidates rejected by the fit are therefore not fitted
+    again at each loop.
+    """
+    w_s = int(w_s)
+
+    if isinstance(image, np.ma.core.MaskedArray):
+        mask = image.mask
+        d_image = np.array(image.data, dtype='float')
+    else:
+        mask = None
+        d_image = np.array(image, dtype='float')
+
+    hmap = glrt_map(d_image, peak_radius, w_s, backend)
+    dirty = np.ones(hmap.shape, dtype='bool')
+    peaks_coords = local_max_detection(hmap, dirty, w_s, threshold, mask)
+
+    peaks = []
+    found = set()
+    while len(peaks_coords) > 0 and len(peaks) < max_peaks:
+        new_peaks = gauss_estimation(d_image, peaks_coords, w_s, backend)
+        # A peak that deflation can't remove (e.g. a width close to zero)
+        # would be fitted again at every loop
+        new_peaks = [peak for peak in new_peaks if tuple(peak[:2]) not in found]
+        # in case the 2D gauss fit fails
+        if len(new_peaks) < 1:
+            break
+        found.update(tuple(peak[:2]) for peak in new_peaks)
+        peaks.extend(new_peaks)
+        image_deflation(d_image, new_peaks, w_s, inplace=True, backend=backend)
+
+        dirty = deflation_footprint(hmap.shape, new_peaks, w_s)
+        labels, _ = ndimage.label(dirty)
+        for sl_x, sl_y in ndimage.find_objects(labels):
+            sub_image = d_image[sl_x.start:sl_x.stop + w_s,
+                                sl_y.start:sl_y.stop + w_s]
+            hmap[sl_x, sl_y] = glrt_map(sub_image, peak_radius, w_s, backend)
+
+        peaks_coords = local_max_detection(hmap, dirty, w_s, threshold, mask)
+        detection_metrics.count('deflation_loops')
+
+    peaks = np.array(peaks)
+    detection_metrics.count('peaks', len(peaks))
+    return peaks
+
+
+def _check_backend(backend):  # pragma: no cover
+    """
+    Check the detection backend and fall back to 'numpy' if numba is not
+    installed.
+    """
+    if backend not in ('numpy', 'numba'):
+        raise ValueError("Unknown detection backend: {}".format(backend))
+    if backend == 'numba' and numba is None:
+        warnings.warn('numba is not installed. Using slower version.')
+        backend = 'numpy'
+    return backend
+
+
+@detection_metrics.timed('deflation')
+def deflation_footprint(shape, peaks, w_s):  # pragma: no cover
+    """
+    Boolean map of shape `shape` (the hypothesis map shape) which is True for
+    every window position overlapping a peak removed by
+    :func:`image_deflation`.
+    """
+    footprint = np.zeros(shape, dtype='bool')
+    for xc, yc, width, I in peaks:
+        low_x = int(xc - w_s // 2)
+        low_y = int(yc - w_s // 2)
+        footprint[max(low_x - w_s + 1, 0):max(low_x + w_s, 0),
+                  max(low_y - w_s + 1, 0):max(low_y + w_s, 0)] = True
+    return footprint
+
+
+@detection_metrics.timed('local_max')
+def local_max_detection(hmap, region, w_s, threshold, mask=None,
+                        min_distance=3):  # pragma: no cover
+    """
+    Finds the local maxima of `hmap` above `threshold` only within the
+    positions where `region` is True. Each connected part of `region` is
+    searched with a margin of `min_distance` so results match a search over
+    the whole map.
+
+    Returns
+    -------
+    peaks_coords: array
+        An Nx2 array containing (x, y) pairs of the detected peaks
+        in integer pixel coordinates of the image.
+    """
+    peaks_coords = []
+
+    labels, _ = ndimage.label(region)
+    for n, (sl_x, sl_y) in enumerate(ndimage.find_objects(labels)):
+        low_x = max(sl_x.start - min_distance, 0)
+        low_y = max(sl_y.start - min_distance, 0)
+        sub_hmap = hmap[low_x:sl_x.stop + min_distance,
+                        low_y:sl_y.stop + min_distance]
+
+        try:
+            coords = feature.peak_local_max(sub_hmap, min_distance,
+                                            threshold_abs=threshold)
+        except ValueError:
+            continue
+
+        coords = np.reshape(coords, (-1, 2)) + [low_x, low_y]
+        # Bounding boxes can overlap: only keep maxima of this part
+        coords = coords[labels[coords[:, 0], coords[:, 1]] == n + 1]
+        peaks_coords.append(coords)
+
+    if not peaks_coords:
+        return np.array([])
+
+    peaks_coords = np.vstack(peaks_coords) + w_s // 2
+    if isinstance(mask, np.ndarray):
+        peaks_coords = peaks_coords[~mask[peaks_coords[:, 0], peaks_coords[:, 1]]]
+
+    return peaks_coords
+
+
+@detection_metrics.timed('deflation')
+def image_deflation(image, peaks, w_s, inplace=False, backend='numpy'):  # pragma: no cover
     """
     Substracts the detected Gaussian peaks from the input image and
-    returns the deflated image.
+    returns the deflated image. If `inplace` is True, `image` is modified
+    (it has to be a float array).
     """
-    d_image = image.copy()
+    if inplace:
+        d_image = image
+    else:
+        d_image = image.copy()
+    w_s = int(w_s)
+
+    if backend == 'numba' and len(peaks) and d_image.dtype == np.float64:
+        _numba_tools.deflation_kernel(np.ma.getdata(d_image),
+                                      np.asarray(peaks, dtype='float').reshape(-1, 4), w_s)
+        return d_image
+
     for peak in peaks:
         xc, yc, width, I = peak
         xc_rel = w_s // 2 + xc - np.floor(xc)
@@ -282,7 +923,8 @@ def image_deflation(image, peaks, w_s):  # pragma: no cover
         low_x = int(xc - w_s // 2)
         low_y = int(yc - w_s // 2)
 
-        if low_x > 0 and low_y > 0:
+        if (low_x > 0 and low_y > 0 and low_x + w_s <= d_image.shape[0] and
+           low_y + w_s <= d_image.shape[1]):
             params = xc_rel, yc_rel, width, I, 0
             deflated_peak = gauss_continuous(params, w_s)
             d_image[low_x:low_x + w_s,
@@ -291,7 +933,8 @@ def image_deflation(image, peaks, w_s):  # pragma: no cover
     return d_image
 
 
-def gauss_estimation(image, peaks_coords, w_s):  # pragma: no cover
+@detection_metrics.timed('fit')
+def gauss_estimation(image, peaks_coords, w_s, backend='numpy'):  # pragma: no cover
     """
     Least square fit of a 2D Gauss peaks (with radial symmetry)
     on regions of width `w_s` centered on each element
@@ -306,25 +949,43 @@ def gauss_estimation(image, peaks_coords, w_s):  # pragma: no cover
        corresponding to the approximate peak center,
        in pixels.
     """
-    peaks = []
-    for coords in peaks_coords:
-        low_x, low_y = coords - w_s // 2
-        try:
-            patch = image[low_x: low_x + w_s,
-                          low_y: low_y + w_s]
-            params, success = gauss_estimate(patch, w_s)
-            xc, yc, width, I, bg = params
-            if success and I > 0 and width < w_s:
-                peaks.append([xc + low_x, yc + low_y, width, I])
-        except IndexError:
-            log.error('peak too close from the edge\n'
-                      'use a smaller window\n'
-                      'peak @ (%i, %i) discarded' % (coords[0], coords[1]))
-            continue
-    return peaks
+    w_s = int(w_s)
+    image = np.ma.getdata(image)
+    peaks_coords = np.asarray(peaks_coords, dtype='int').reshape(-1, 2)
+
+    lows = peaks_coords - w_s // 2
+    inside = np.all((lows >= 0) & (lows + w_s <= image.shape), axis=1)
+
+    for coords in peaks_coords[~inside]:
+        log.error('peak too close from the edge\n'
+                  'use a smaller window\n'
+                  'peak @ (%i, %i) discarded' % (coords[0], coords[1]))
+
+    lows = lows[inside]
+    if not len(lows):
+        return []
+
+    # Stack all the patches of the frame in a (n_peaks, w_s, w_s) array
+    window = np.arange(w_s)
+    rows = lows[:, 0, np.newaxis] + window
+    cols = lows[:, 1, np.newaxis] + window
+    patches = image[rows[:, :, np.newaxis], cols[:, np.newaxis, :]]
+
+    params, success = gauss_estimate_batch(patches, w_s, backend=backend)
+    xc, yc, width, I, bg = params.T
 
+    # Diverged fits can have a negative width or a center far from the patch
+    accepted = (success & (I > 0) & (width > 0) & (width < w_s) &
+                (xc >= 0) & (xc < w_s) & (yc >= 0) & (yc < w_s))
+    peaks = np.column_stack([xc + lows[:, 0], yc + lows[:, 1], width, I])
 
-def glrt_detection(image, r0, w_s, threshold):  # pragma: no cover
+    detection_metrics.count('candidates', len(lows))
+    detection_metrics.count('accepted', np.sum(accepted))
+
+    return peaks[accepted].tolist()
+
+
+def glrt_detection(image, r0, w_s, threshold, backend='numpy'):  # pragma: no cover
     """
     Implements the Generalized Likelyhood Ratio Test, by
     computing equation 4 in Segré et al. Supplementary Note (p. 12)
@@ -363,32 +1024,108 @@ def glrt_detection(image, r0, w_s, threshold):  # pragma: no cover
     else:
         raise Exception("Image has to be np.ndarray or np.ma.core.MaskedArray")
 
-    w, h = image.shape
-    g_patch = gauss_patch(r0, w_s)
-    g_patch -= g_patch.mean()
+    hmap = glrt_map(image, r0, w_s, backend)
+    region = np.ones(hmap.shape, dtype='bool')
+
+    return local_max_detection(hmap, region, int(w_s), threshold, mask)
+
+
+@detection_metrics.timed('glrt')
+def glrt_map(image, r0, w_s, backend='numpy'):  # pragma: no cover
+    """
+    Computes the GLRT statistic (equation 4 in Segré et al. Supplementary
+    Note) for every position of the sliding window at once.
+
+    Windowed sums and sums of squares are computed with box filters and the
+    correlation with the Gaussian template with an FFT convolution. The
+    result is equal (up to float tolerance) to `-2` times the map obtained by
+    calling :func:`hypothesis_map` on every patch.
+
+    Parameters:
+    ----------
+    image: 2D array
+        the input image
+    r0: float
+        the detected Gaussian peak 1/e radius
+    w_s: int
+        Size of the sliding window.
+    backend: str
+        With 'numba', the statistic is computed window by window by a
+        compiled kernel instead.
+
+    Returns:
+    --------
+    hmap: 2D array
+        A `(w - w_s, h - w_s)` array where `hmap[i, j]` is the statistic of
+        the patch `image[i:i + w_s, j:j + w_s]`.
+    """
+    g_patch = gauss_patch(r0, int(w_s))
+
+    if backend == 'numba':
+        image = np.asarray(image, dtype='float')
+        out_shape = np.maximum(np.array(image.shape) - g_patch.shape, 0)
+        hmap = np.empty(out_shape)
+        _numba_tools.glrt_map_kernel(image, g_patch, hmap)
+        return hmap
+
+    return template_glrt_map(image, g_patch)
+
+
+def template_glrt_map(image, g_patch):  # pragma: no cover
+    """
+    N-dimensional version of :func:`glrt_map`: the sliding window has the
+    shape of the template `g_patch`.
+
+    Returns:
+    --------
+    hmap: array
+        An array of shape `image.shape - g_patch.shape` where `hmap[i]` is
+        the statistic of the window starting at `i`.
+    """
+    image = np.asarray(image, dtype='float')
+    window = np.array(g_patch.shape)
+    out_shape = np.array(image.shape) - window
+
+    if np.any(out_shape <= 0):
+        return np.empty(np.maximum(out_shape, 0))
+
+    # Both the variance and the correlation with a zero mean template are
+    # invariant to an offset: centering the image limits rounding errors.
+    image = image - image.mean()
+
+    g_patch = g_patch - g_patch.mean()
     g_squaresum = np.sum(g_patch ** 2)
 
-    hmap = []
-    for i, j in np.ndindex((w - w_s, h - w_s)):
-        tmp = image[int(i): int(i + w_s), int(j): int(j + w_s)]
-        h = hypothesis_map(tmp,
-                           g_patch,
-                           g_squaresum)
-        hmap.append(h)
-    hmap = np.array(hmap)
+    n = np.prod(window)
+    mean = window_sum(image, window) / n
+    variance = window_sum(image ** 2, window) / n - mean ** 2
+    variance[variance < 0] = 0
 
-    try:
-        hmap = -2 * hmap.reshape((w - w_s, h - w_s))
-        peaks_coords = feature.peak_local_max(hmap, 3,
-                                              threshold_abs=threshold)
-        peaks_coords += w_s / 2
-        if isinstance(mask, np.ndarray):
-            peaks_coords = list(filter(lambda x: not mask[x[0], x[1]], peaks_coords))
+    flip = tuple(slice(None, None, -1) for _ in window)
+    intensity = fftconvolve(image, g_patch[flip], mode='valid')
+    normalisation = np.sqrt(n * variance)
 
-        return peaks_coords
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = (n / 2.) * np.log(1 - (intensity / normalisation) ** 2
+                                  / g_squaresum)
 
-    except ValueError:
-        return np.array([])
+    crop = tuple(slice(0, size) for size in out_shape)
+    return -2 * ratio[crop]
+
+
+def window_sum(image, w_s):  # pragma: no cover
+    """
+    Sum of `image` over every window fully contained in the image (box
+    filter computed with cumulative sums along each axis). `w_s` is the
+    window width, or a sequence of widths (one per axis).
+    """
+    w_s = np.ones(image.ndim, dtype='int') * w_s
+    s = image
+    for axis, width in enumerate(w_s):
+        s = np.cumsum(np.insert(s, 0, 0, axis=axis), axis=axis)
+        s = (np.take(s, np.arange(width, s.shape[axis]), axis=axis) -
+             np.take(s, np.arange(0, s.shape[axis] - width), axis=axis))
+    return s
 
 
 def hypothesis_map(patch, g_patch, g_squaresum):  # pragma: no cover
@@ -412,16 +1149,225 @@ def gauss_estimate(patch, w_s):  # pragma: no cover
     Least square 2D gauss fit
     """
     params0 = [w_s / 2., w_s / 2., 3.,
-               np.float(patch.max() - patch.min()), np.float(patch.min())]
+               float(patch.max() - patch.min()), float(patch.min())]
     errfunc = lambda p: patch.flatten() - gauss_continuous(p, w_s)
     return leastsq(errfunc, params0, xtol=0.01)
 
 
+def gauss_estimate_batch(patches, w_s, xtol=0.01, max_iter=100,
+                         backend='numpy'):  # pragma: no cover
+    """
+    Least square 2D gauss fit of a stack of patches at once.
+
+    A Levenberg-Marquardt is run simultaneously on every patch with the
+    same model and initial guess as :func:`gauss_estimate`. Patches stop
+    iterating independently when the relative change of each of their
+    parameters is lower than `xtol`.
+
+    Parameters
+    ----------
+    patches : 3D array
+        A `(n, w_s, w_s)` stack of patches.
+    w_s : int
+        Patch width.
+    xtol : float
+        Relative tolerance on the parameters.
+    max_iter : int
+        Maximum number of iterations.
+    backend : str
+        With 'numba', the model and its jacobian are evaluated by compiled
+        kernels.
+
+    Returns
+    -------
+    params : 2D array
+        A `(n, 5)` array of the fitted `(xc, yc, width, I, bg)`.
+    success : 1D bool array
+        True when the fit converged.
+    """
+    patches = np.asarray(patches, dtype='float').reshape(-1, w_s * w_s)
+    n_patches = patches.shape[0]
+
+    params = np.empty((n_patches, 5))
+    params[:, 0] = w_s / 2.
+    params[:, 1] = w_s / 2.
+    params[:, 2] = 3.
+    params[:, 3] = patches.max(axis=1) - patches.min(axis=1)
+    params[:, 4] = patches.min(axis=1)
+
+    if backend == 'numba':
+        model = functools.partial(_gauss_continuous_batch_numba, w_s=w_s)
+        jacobian = functools.partial(_gauss_jacobian_batch_numba, w_s=w_s)
+    else:
+        model = functools.partial(gauss_continuous_batch, w_s=w_s)
+        jacobian = functools.partial(gauss_jacobian_batch, w_s=w_s)
+
+    return levenberg_marquardt_batch(patches, params, model, jacobian,
+                                     xtol=xtol, max_iter=max_iter)
+
+
+def levenberg_marquardt_batch(data, params, model, jacobian,
+                              xtol=0.01, max_iter=100):  # pragma: no cover
+    """
+    Runs a Levenberg-Marquardt least square fit on a stack of problems
+    at once.
+
+    Parameters
+    ----------
+    data : 2D array
+        A `(n, m)` array, one line per problem.
+    params : 2D array
+        A `(n, p)` array of initial parameters.
+    model : function
+        `model(params)` returns the `(n, m)` model values.
+    jacobian : function
+        `jacobian(params)` returns the `(n, m, p)` model jacobian.
+    xtol : float
+        Relative tolerance on the parameters.
+    max_iter : int
+        Maximum number of iterations.
+
+    Returns
+    -------
+    params : 2D array
+        The `(n, p)` fitted parameters.
+    success : 1D bool array
+        True when the fit converged.
+    """
+    params = np.array(params, dtype='float')
+    n_problems, n_params = params.shape
+
+    residuals = data - model(params)
+    costs = np.sum(residuals ** 2, axis=1)
+    damping = np.ones(n_problems) * 1e-3
+
+    active = np.ones(n_problems, dtype='bool')
+    success = np.zeros(n_problems, dtype='bool')
+    diag = np.arange(n_params)
+
+    for _ in range(max_iter):
+        idxs = np.where(active)[0]
+        if not idxs.size:
+            break
+
+        p = params[idxs]
+        jac = jacobian(p)
+        jtj = np.einsum('kni,knj->kij', jac, jac)
+        jtr = np.einsum('kni,kn->ki', jac, residuals[idxs])
+
+        # Levenberg-Marquardt damping (the small constant keeps degenerate
+        # systems, e.g. with a null intensity, invertible)
+        jtj[:, diag, diag] += damping[idxs, np.newaxis] * (jtj[:, diag, diag] + 1e-12)
+
+        steps, solved = _solve_batch(jtj, jtr)
+
+        new_p = p + steps
+        new_residuals = data[idxs] - model(new_p)
+        new_costs = np.sum(new_residuals ** 2, axis=1)
+
+        with np.errstate(invalid='ignore'):
+            improved = solved & (new_costs < costs[idxs])
+        improved_idxs = idxs[improved]
+        params[improved_idxs] = new_p[improved]
+        residuals[improved_idxs] = new_residuals[improved]
+        costs[improved_idxs] = new_costs[improved]
+        damping[idxs[improved]] /= 10.
+        damping[idxs[~improved]] *= 10.
+
+        converged = improved & np.all(np.abs(steps) <= xtol * np.abs(p), axis=1)
+        # No step can decrease the cost anymore: local minimum
+        stalled = ~improved & (damping[idxs] > 1e10)
+
+        success[idxs[converged | stalled]] = True
+        active[idxs[converged | stalled | ~solved]] = False
+
+    success &= np.all(np.isfinite(params), axis=1)
+
+    return params, success
+
+
+def _solve_batch(a, b):  # pragma: no cover
+    """
+    Solves a stack of linear systems. Returns solutions and a boolean array
+    which is False for singular systems.
+    """
+    solved = np.ones(a.shape[0], dtype='bool')
+    try:
+        return np.linalg.solve(a, b[..., np.newaxis])[..., 0], solved
+    except np.linalg.LinAlgError:
+        x = np.zeros_like(b)
+        for k in range(a.shape[0]):
+            try:
+                x[k] = np.linalg.solve(a[k], b[k])
+            except np.linalg.LinAlgError:
+                solved[k] = False
+        return x, solved
+
+
+def gauss_continuous_batch(params, w_s):  # pragma: no cover
+    """
+    Vectorized :func:`gauss_continuous` over a `(n, 5)` array of parameters.
+    Returns a `(n, w_s * w_s)` array.
+    """
+    xc, yc, width, I, bg = [params[:, i, np.newaxis] for i in range(5)]
+    grid = np.arange(0, w_s)
+    x = np.exp(- (grid - xc) ** 2 / width ** 2)
+    y = np.exp(- (grid - yc) ** 2 / width ** 2)
+    g_patch = I[:, :, np.newaxis] * x[:, :, np.newaxis] * y[:, np.newaxis, :]
+    g_patch += bg[:, :, np.newaxis]
+    return g_patch.reshape(-1, w_s * w_s)
+
+
+def gauss_jacobian_batch(params, w_s):  # pragma: no cover
+    """
+    Jacobian of :func:`gauss_continuous_batch` with respect to
+    `(xc, yc, width, I, bg)`. Returns a `(n, w_s * w_s, 5)` array.
+    """
+    xc, yc, width, I, bg = [params[:, i, np.newaxis] for i in range(5)]
+    grid = np.arange(0, w_s)
+    dx = grid - xc
+    dy = grid - yc
+    x = np.exp(- dx ** 2 / width ** 2)
+    y = np.exp(- dy ** 2 / width ** 2)
+
+    gauss = x[:, :, np.newaxis] * y[:, np.newaxis, :]
+    dx = dx[:, :, np.newaxis]
+    dy = dy[:, np.newaxis, :]
+    width = width[:, :, np.newaxis]
+    I = I[:, :, np.newaxis]
+
+    jac = np.empty((params.shape[0], w_s, w_s, 5))
+    jac[..., 0] = I * gauss * 2 * dx / width ** 2
+    jac[..., 1] = I * gauss * 2 * dy / width ** 2
+    jac[..., 2] = I * gauss * 2 * (dx ** 2 + dy ** 2) / width ** 3
+    jac[..., 3] = gauss
+    jac[..., 4] = 1.
+    return jac.reshape(-1, w_s * w_s, 5)
+
+
+def _gauss_continuous_batch_numba(params, w_s):  # pragma: no cover
+    """
+    Same as :func:`gauss_continuous_batch` with a compiled kernel.
+    """
+    out = np.empty((params.shape[0], w_s * w_s))
+    _numba_tools.gauss_continuous_kernel(np.ascontiguousarray(params), w_s, out)
+    return out
+
+
+def _gauss_jacobian_batch_numba(params, w_s):  # pragma: no cover
+    """
+    Same as :func:`gauss_jacobian_batch` with a compiled kernel.
+    """
+    out = np.empty((params.shape[0], w_s * w_s, 5))
+    _numba_tools.gauss_jacobian_kernel(np.ascontiguousarray(params), w_s, out)
+    return out
+
+
 def gauss_continuous(params, w_s):  # pragma: no cover
     """2D gauss function with a float center position"""
     xc, yc, width, I, bg = params
-    xc = np.float(xc)
-    yc = np.float(yc)
+    xc = float(xc)
+    yc = float(yc)
     x = np.exp(- (np.arange(0, w_s) - xc) ** 2 / width ** 2)
     y = np.exp(- (np.arange(0, w_s) - yc) ** 2 / width ** 2)
     g_patch = I * np.outer(x, y) + bg
@@ -448,3 +1394,265 @@ def gauss_discrete(r0, i, j, w_s):  # pragma: no cover
     j -= w_s // 2
     A = 1. / (np.sqrt(np.pi) * r0)
     return A * np.exp(-(i ** 2 + j ** 2) / r0 ** 2)
+
+
+def find_gaussian_peaks_3d(args):  # pragma: no cover
+    """
+    Buffer function for _find_gaussian_peaks_3d
+    """
+    stack, detection_parameters, i = args
+    return (i, _find_gaussian_peaks_3d_records(stack, **detection_parameters))
+
+
+def _find_gaussian_peaks_3d_records(stack, **parameters):  # pragma: no cover
+    """
+    Same as :func:`_find_gaussian_peaks_3d` but returns a record array (see
+    :func:`peaks_to_records`) and the detection metrics of the stack.
+    """
+    with detection_metrics.collect() as frame_metrics:
+        peaks = _find_gaussian_peaks_3d(stack, **parameters)
+    return peaks_to_records(peaks, volume=True), frame_metrics.as_dict()
+
+
+def _find_gaussian_peaks_3d(stack, w_s=15, w_s_z=5, peak_radius=1.5,
+                            peak_radius_z=2., threshold=27.,
+                            max_peaks=1e4):  # pragma: no cover
+    """
+    Volumetric version of :func:`_find_gaussian_peaks`. The likelyhood ratio
+    test is computed with an anisotropic 3D Gaussian template over a
+    `(w_s_z, w_s, w_s)` window sliding through the whole Z stack, and peaks
+    are localized in x, y and z by a least square fit of an anisotropic 3D
+    Gaussian. Each peak is therefore detected once instead of once per
+    plane.
+
+    Parameters
+    ----------
+
+    stack: a 3D array
+        the input Z stack with (z, x, y) axes.
+    w_s: int, optional
+        the lateral width (in pixels) of the sliding window.
+    w_s_z: int, optional
+        the axial width (in planes) of the sliding window.
+    peak_radius: float, optional
+        typical lateral radius (in pixels) of the peaks to detect.
+    peak_radius_z: float, optional
+        typical axial radius (in planes) of the peaks to detect.
+    threshold: float, optional
+        Criterium for a positive detection (see :func:`_find_gaussian_peaks`).
+    max_peaks: int, optional
+        Deflation loop will stop if detected peaks is higher than max_peaks.
+
+    Returns
+    -------
+
+    peaks: ndarray
+        peaks is a Nx6 array, where N is the number of detected peaks in the
+        stack. Each line gives the x position, y position, width,
+        (background corrected) intensity, z position and axial width of a
+        detected peak (in that order).
+    """
+    if np.ndim(stack) != 3:
+        raise ValueError("Volumetric detection needs (z, x, y) stacks, got an "
+                         "array of shape {}".format(np.shape(stack)))
+
+    w_s = int(w_s)
+    w_s_z = int(w_s_z)
+    if w_s_z > stack.shape[0] - 1:
+        warnings.warn("Axial window (w_s_z = {}) is larger than the stack, "
+                      "using {} planes instead.".format(w_s_z, stack.shape[0] - 1))
+        w_s_z = stack.shape[0] - 1
+    d_stack = np.array(stack, dtype='float')
+    # Narrower axial widths are fits of a single plane of a peak, which would
+    # then be detected again in the next planes
+    min_width_z = peak_radius_z / 2.
+
+    g_patch = gauss_patch_3d(peak_radius, peak_radius_z, w_s, w_s_z)
+
+    peaks = []
+    found = set()
+    peaks_coords = glrt_detection_3d(d_stack, g_patch, threshold)
+    while len(peaks_coords) > 0 and len(peaks) < max_peaks:
+        new_peaks = gauss_estimation_3d(d_stack, peaks_coords, w_s, w_s_z,
+                                        min_width_z=min_width_z)
+        # A peak that deflation can't remove would be fitted again
+        new_peaks = [peak for peak in new_peaks if tuple(peak[:2]) + (peak[4],) not in found]
+        if len(new_peaks) < 1:
+            break
+        found.update(tuple(peak[:2]) + (peak[4],) for peak in new_peaks)
+        peaks.extend(new_peaks)
+        stack_deflation(d_stack, new_peaks, w_s, w_s_z)
+        peaks_coords = glrt_detection_3d(d_stack, g_patch, threshold)
+        detection_metrics.count('deflation_loops')
+
+    detection_metrics.count('peaks', len(peaks))
+    return np.array(peaks)
+
+
+def glrt_detection_3d(stack, g_patch, threshold, min_distance=3,
+                      min_distance_z=1):  # pragma: no cover
+    """
+    Generalized Likelyhood Ratio Test over a 3D window sliding through
+    the stack.
+
+    Returns
+    -------
+    peaks_coords: array
+        An Nx3 array containing (z, x, y) voxel coordinates of the local
+        maxima of the GLRT map above `threshold`.
+    """
+    with detection_metrics.timer('glrt'):
+        hmap = template_glrt_map(stack, g_patch)
+    if not hmap.size:
+        return np.array([])
+
+    with detection_metrics.timer('local_max'):
+        hmap[~np.isfinite(hmap)] = -np.inf
+        size = (2 * min_distance_z + 1, 2 * min_distance + 1, 2 * min_distance + 1)
+        maxima = ndimage.maximum_filter(hmap, size=size, mode='constant', cval=-np.inf)
+        peaks_map = (hmap == maxima) & (hmap > threshold)
+
+        # Exclude lateral borders as peak_local_max does in 2D
+        peaks_map[:, :min_distance, :] = False
+        peaks_map[:, -min_distance:, :] = False
+        peaks_map[:, :, :min_distance] = False
+        peaks_map[:, :, -min_distance:] = False
+
+    return np.argwhere(peaks_map) + np.array(g_patch.shape) // 2
+
+
+@detection_metrics.timed('fit')
+def gauss_estimation_3d(stack, peaks_coords, w_s, w_s_z, min_width_z=0.):  # pragma: no cover
+    """
+    Least square fit of anisotropic 3D Gauss peaks on `(w_s_z, w_s, w_s)`
+    regions centered on each `(z, x, y)` element of `peaks_coords`. Fits
+    with an axial width lower than `min_width_z` are rejected.
+
+    Returns
+    -------
+    peaks : list
+        One `[x, y, width, I, z, width_z]` list per accepted peak.
+    """
+    peaks_coords = np.asarray(peaks_coords, dtype='int').reshape(-1, 3)
+    window = np.array([w_s_z, w_s, w_s])
+
+    lows = peaks_coords - window // 2
+    inside = np.all((lows >= 0) & (lows + window <= stack.shape), axis=1)
+    lows = lows[inside]
+    if not len(lows):
+        return []
+
+    z = lows[:, 0, np.newaxis] + np.arange(w_s_z)
+    x = lows[:, 1, np.newaxis] + np.arange(w_s)
+    y = lows[:, 2, np.newaxis] + np.arange(w_s)
+    patches = stack[z[:, :, np.newaxis, np.newaxis],
+                    x[:, np.newaxis, :, np.newaxis],
+                    y[:, np.newaxis, np.newaxis, :]]
+    patches = patches.reshape(len(lows), -1)
+
+    params = np.empty((len(lows), 7))
+    params[:, 0] = w_s / 2.
+    params[:, 1] = w_s / 2.
+    params[:, 2] = w_s_z / 2.
+    params[:, 3] = 3.
+    params[:, 4] = max(w_s_z / 3., 1.)
+    params[:, 5] = patches.max(axis=1) - patches.min(axis=1)
+    params[:, 6] = patches.min(axis=1)
+
+    params, success = levenberg_marquardt_batch(
+        patches, params,
+        lambda p: gauss_continuous_batch_3d(p, w_s, w_s_z),
+        lambda p: gauss_jacobian_batch_3d(p, w_s, w_s_z))
+    xc, yc, zc, width, width_z, I, bg = params.T
+
+    accepted = (success & (I > 0) & (width > 0) & (width < w_s) &
+                (width_z > max(min_width_z, 0)) & (width_z < w_s_z) &
+                (xc >= 0) & (xc < w_s) & (yc >= 0) & (yc < w_s) &
+                (zc >= 0) & (zc < w_s_z))
+    peaks = np.column_stack([xc + lows[:, 1], yc + lows[:, 2], width, I,
+                             zc + lows[:, 0], width_z])
+
+    detection_metrics.count('candidates', len(lows))
+    detection_metrics.count('accepted', np.sum(accepted))
+
+    return peaks[accepted].tolist()
+
+
+@detection_metrics.timed('deflation')
+def stack_deflation(stack, peaks, w_s, w_s_z):  # pragma: no cover
+    """
+    Substracts in place the detected 3D Gaussian peaks from the stack.
+    """
+    window = np.array([w_s_z, w_s, w_s])
+    for xc, yc, width, I, zc, width_z in peaks:
+        center = np.array([zc, xc, yc])
+        low = np.floor(center - window // 2).astype('int')
+
+        if np.all(low >= 0) and np.all(low + window <= stack.shape):
+            rel = window // 2 + center - np.floor(center)
+            params = np.array([[rel[1], rel[2], rel[0], width, width_z, I, 0]])
+            deflated_peak = gauss_continuous_batch_3d(params, w_s, w_s_z)
+            stack[low[0]:low[0] + w_s_z,
+                  low[1]:low[1] + w_s,
+                  low[2]:low[2] + w_s] -= deflated_peak.reshape(window)
+
+
+def gauss_continuous_batch_3d(params, w_s, w_s_z):  # pragma: no cover
+    """
+    Anisotropic 3D gauss function over `(w_s_z, w_s, w_s)` patches for a
+    `(n, 7)` array of `(xc, yc, zc, width, width_z, I, bg)` parameters.
+    Returns a `(n, w_s_z * w_s * w_s)` array.
+    """
+    xc, yc, zc, width, width_z, I, bg = [params[:, i, np.newaxis] for i in range(7)]
+    grid = np.arange(0, w_s)
+    x = np.exp(- (grid - xc) ** 2 / width ** 2)
+    y = np.exp(- (grid - yc) ** 2 / width ** 2)
+    z = np.exp(- (np.arange(0, w_s_z) - zc) ** 2 / width_z ** 2)
+    g_patch = (z[:, :, np.newaxis, np.newaxis] *
+               x[:, np.newaxis, :, np.newaxis] *
+               y[:, np.newaxis, np.newaxis, :])
+    g_patch = I[:, :, np.newaxis, np.newaxis] * g_patch + bg[:, :, np.newaxis, np.newaxis]
+    return g_patch.reshape(params.shape[0], -1)
+
+
+def gauss_jacobian_batch_3d(params, w_s, w_s_z):  # pragma: no cover
+    """
+    Jacobian of :func:`gauss_continuous_batch_3d` with respect to
+    `(xc, yc, zc, width, width_z, I, bg)`. Returns a `(n, m, 7)` array.
+    """
+    n = params.shape[0]
+    xc, yc, zc, width, width_z, I, bg = [params[:, i] for i in range(7)]
+    dx = np.arange(0, w_s) - xc[:, np.newaxis]
+    dy = np.arange(0, w_s) - yc[:, np.newaxis]
+    dz = np.arange(0, w_s_z) - zc[:, np.newaxis]
+
+    dx = dx[:, np.newaxis, :, np.newaxis]
+    dy = dy[:, np.newaxis, np.newaxis, :]
+    dz = dz[:, :, np.newaxis, np.newaxis]
+    width = width[:, np.newaxis, np.newaxis, np.newaxis]
+    width_z = width_z[:, np.newaxis, np.newaxis, np.newaxis]
+    I = I[:, np.newaxis, np.newaxis, np.newaxis]
+
+    gauss = (np.exp(- dx ** 2 / width ** 2) * np.exp(- dy ** 2 / width ** 2) *
+             np.exp(- dz ** 2 / width_z ** 2))
+
+    jac = np.empty((n, w_s_z, w_s, w_s, 7))
+    jac[..., 0] = I * gauss * 2 * dx / width ** 2
+    jac[..., 1] = I * gauss * 2 * dy / width ** 2
+    jac[..., 2] = I * gauss * 2 * dz / width_z ** 2
+    jac[..., 3] = I * gauss * 2 * (dx ** 2 + dy ** 2) / width ** 3
+    jac[..., 4] = I * gauss * 2 * dz ** 2 / width_z ** 3
+    jac[..., 5] = gauss
+    jac[..., 6] = 1.
+    return jac.reshape(n, -1, 7)
+
+
+def gauss_patch_3d(r0, r0_z, w_s, w_s_z):  # pragma: no cover
+    """
+    Computes a `(w_s_z, w_s, w_s)` patch with a power normalized
+    anisotropic Gaussian peak at its center.
+    """
+    x = y = np.exp(- (np.arange(w_s) - w_s // 2) ** 2 / r0 ** 2)
+    z = np.exp(- (np.arange(w_s_z) - w_s_z // 2) ** 2 / r0_z ** 2)
+    A = 1. / (np.pi ** 1.5 * r0 ** 2 * r0_z) ** 0.5
+    return A * z[:, np.newaxis, np.newaxis] * np.outer(x, y)[np.newaxis]
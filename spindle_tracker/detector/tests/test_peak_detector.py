@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+
+from collections import OrderedDict
+
+import numpy as np
+from numpy.testing import assert_allclose
+from scipy.optimize import leastsq
+
+from spindle_tracker.detector.peak_detector import glrt_map
+from spindle_tracker.detector.peak_detector import gauss_patch
+from spindle_tracker.detector.peak_detector import hypothesis_map
+from spindle_tracker.detector.peak_detector import gauss_continuous
+from spindle_tracker.detector.peak_detector import gauss_estimate_batch
+from spindle_tracker.detector.peak_detector import multichannel_peak_detector
+from spindle_tracker.detector.peak_detector import _find_gaussian_peaks
+from spindle_tracker.detector.metrics import DetectionMetrics
+from spindle_tracker.data import synthetic_movie
+
+
+def spots_image(shape=(40, 50), n_spots=6, r0=1.5, seed=0):
+    """Gaussian spots over a Poisson background.
+    """
+    rng = np.random.RandomState(seed)
+    x, y = np.mgrid[:shape[0], :shape[1]]
+    image = rng.poisson(100, shape).astype('float')
+    for xc, yc in rng.uniform(5, np.array(shape) - 5, (n_spots, 2)):
+        image += 80 * np.exp(- ((x - xc) ** 2 + (y - yc) ** 2) / r0 ** 2)
+    return image
+
+
+def reference_glrt_map(image, r0, w_s):
+    """GLRT map computed patch by patch with hypothesis_map.
+    """
+    w, h = image.shape
+    g_patch = gauss_patch(r0, w_s)
+    g_patch -= g_patch.mean()
+    g_squaresum = np.sum(g_patch ** 2)
+
+    hmap = np.empty((w - w_s, h - w_s))
+    for i, j in np.ndindex(hmap.shape):
+        hmap[i, j] = hypothesis_map(image[i:i + w_s, j:j + w_s], g_patch, g_squaresum)
+    return -2 * hmap
+
+
+def test_glrt_map():
+    image = spots_image()
+    assert_allclose(glrt_map(image, 1.5, 7), reference_glrt_map(image, 1.5, 7),
+                    rtol=1e-6, atol=1e-6)
+
+
+def test_glrt_map_numba():
+    try:
+        import numba  # noqa
+    except ImportError:
+        return
+
+    image = spots_image()
+    assert_allclose(glrt_map(image, 1.5, 7, backend='numba'),
+                    reference_glrt_map(image, 1.5, 7), rtol=1e-6, atol=1e-6)
+
+
+def test_gauss_estimate_batch():
+    rng = np.random.RandomState(0)
+    w_s = 7
+
+    patches = []
+    for n in range(20):
+        params = [rng.uniform(2.5, 4.5), rng.uniform(2.5, 4.5), rng.uniform(1.2, 2.5),
+                  rng.uniform(50, 200), rng.uniform(80, 120)]
+        patch = gauss_continuous(params, w_s) + rng.normal(0, 3, w_s * w_s)
+        patches.append(patch.reshape(w_s, w_s))
+    patches = np.array(patches)
+
+    params, success = gauss_estimate_batch(patches, w_s, xtol=1e-10, max_iter=200)
+    assert np.all(success)
+
+    # Same initial guess as gauss_estimate, solved with leastsq
+    for patch, fitted in zip(patches, params):
+        params0 = [w_s / 2., w_s / 2., 3., patch.max() - patch.min(), patch.min()]
+        expected, _ = leastsq(lambda p: patch.ravel() - gauss_continuous(p, w_s),
+                              params0, xtol=1e-10)
+        assert_allclose(fitted, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_find_gaussian_peaks_crowded():
+    # Some fits diverge on crowded frames, they must be rejected
+    movie, _, _ = synthetic_movie(shape=(1, 1, 256, 256), n_spots=300, seed=0)
+    image = movie[0, 0].astype('float')
+
+    for incremental in [True, False]:
+        peaks = _find_gaussian_peaks(image, w_s=7, incremental=incremental)
+        assert 0 < len(peaks) <= 300
+        assert np.all((peaks[:, :2] >= 0) & (peaks[:, :2] < 256))
+        assert np.all((peaks[:, 2] > 0) & (peaks[:, 2] < 7))
+
+
+def test_find_gaussian_peaks_incremental():
+    # Pairs of close spots: the second spot of a pair is found after the
+    # deflation of the first one
+    rng = np.random.RandomState(0)
+    x, y = np.mgrid[:80, :80]
+    image = rng.poisson(100, x.shape).astype('float')
+    for xc, yc, angle in rng.uniform([10, 10, 0], [70, 70, np.pi], (8, 3)):
+        for d in [-2.25, 2.25]:
+            dx, dy = x - xc - d * np.cos(angle), y - yc - d * np.sin(angle)
+            image += rng.uniform(150, 250) * np.exp(- (dx ** 2 + dy ** 2) / 1.5 ** 2)
+
+    peaks = _find_gaussian_peaks(image, w_s=7, incremental=False)
+    incremental_peaks = _find_gaussian_peaks(image, w_s=7, incremental=True)
+
+    assert len(peaks) > 8
+    assert_allclose(incremental_peaks[np.lexsort(incremental_peaks[:, :2].T)],
+                    peaks[np.lexsort(peaks[:, :2].T)], rtol=1e-3, atol=1e-3)
+
+
+def test_multichannel_metrics():
+    gfp, _, metadata = synthetic_movie(shape=(3, 1, 64, 64), n_spots=5, seed=0)
+    rfp, _, _ = synthetic_movie(shape=(3, 1, 64, 64), n_spots=5, seed=1)
+    planes = np.stack([gfp[:, 0], rfp[:, 0]], axis=1)
+
+    channel_parameters = OrderedDict([('GFP', {}), ('RFP', {})])
+    metrics = DetectionMetrics()
+    peaks = multichannel_peak_detector(iter(planes), metadata, channel_parameters,
+                                       parallel=False, metrics=metrics)
+
+    assert set(peaks.keys()) == {'GFP', 'RFP'}
+    frames = metrics.to_frame()
+    assert sorted(frames.index) == [(t, c) for t in range(3) for c in ['GFP', 'RFP']]
+    assert frames['n_peaks'].sum() == len(peaks['GFP']) + len(peaks['RFP'])
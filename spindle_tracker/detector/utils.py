@@ -7,47 +7,64 @@ def create_log_kernel(radius, ndims, calibration):
     https://github.com/fiji/TrackMate/blob/master/src/main/java/fiji/plugin/trackmate/detection/DetectionUtils.java#L53
     """
 
-    # Compute sigma
-    sigma = radius / np.sqrt(ndims)
-    sigma_pixels = [sigma / calibration[i] for i in range(ndims)]
+    sigma, C, axes = _log_kernel_axes(radius, ndims, calibration)
 
-    # Compute kernel size
-    sizes = []
-    middle = []
-    for d in range(len(sigma_pixels)):
-        hksizes = np.max([2, int((3 * sigma_pixels[d] + 0.5) + 1)])
-        sizes.append(3 + 2 * hksizes)
-        middle.append(1 + hksizes)
+    # Squared physical distance to the kernel center
+    grids = np.meshgrid(*axes, indexing='ij')
+    x2 = np.sum([x * x for x in grids], axis=0)
+
+    mantissa = -C * (x2 / sigma / sigma - ndims)
+    exponent = -x2 / 2 / sigma / sigma
+
+    kernel = mantissa * np.exp(exponent)
+
+    return kernel
+
+
+def create_separable_log_kernel(radius, ndims, calibration):
+    """Decompose the kernel returned by :func:`create_log_kernel` as a sum of
+    `ndims` separable kernels. The LoG kernel is equal to:
+
+        sum(outer(kernels[d][0], ..., kernels[d][ndims - 1]) for d in range(ndims))
+
+    Returns
+    -------
+    kernels : list of list of 1D :class:`numpy.ndarray`
+    """
+
+    sigma, C, axes = _log_kernel_axes(radius, ndims, calibration)
+
+    gaussians = [np.exp(-x * x / 2 / sigma / sigma) for x in axes]
+
+    kernels = []
+    for d, x in enumerate(axes):
+        kernel_d = list(gaussians)
+        kernel_d[d] = -C * (x * x / sigma / sigma - 1) * gaussians[d]
+        kernels.append(kernel_d)
 
-    middle = np.array(middle)
+    return kernels
 
-    # Init kernel
-    kernel = np.zeros(sizes, dtype='float')
+
+def _log_kernel_axes(radius, ndims, calibration):
+    """Compute sigma, the normalization factor and the physical coordinates
+    of the kernel along each axis.
+    """
+
+    # Compute sigma
+    sigma = radius / np.sqrt(ndims)
+    sigma_pixels = [sigma / calibration[i] for i in range(ndims)]
 
     # The gaussian normalization factor, divided by a constant value.
     # This is a fudge factor, that more or less put the quality values
     # close to the maximal value of a blob of optimal radius.
     C = 1 / 20 * (1 / sigma / np.sqrt(2 * np.pi)) ** ndims
 
-    for i in range(sizes[0]):
-        for j in range(sizes[1]):
-            mantissa = 0
-            exponent = 0
-            coords = [i, j]
-            for d in range(len(sigma_pixels)):
-                x = calibration[d] * (coords[d] - middle[d])
-                mantissa += -C * (x * x / sigma / sigma - 1)
-                exponent += -x * x / 2 / sigma / sigma
-
-            kernel[i, j] = mantissa * np.exp(exponent)
-
-    # Vectorized version (10 time slower)
-    # Investigate to use numba or cython
-    # for coords in np.ndindex(kernel.shape):
-    #    x = calibration * coords * middle
-    #    mantissa = np.sum(-C * (x * x / sigma / sigma - 1))
-    #    exponent = np.sum(-x * x / 2 / sigma / sigma)
-    #
-    #    kernel[coords] = mantissa * np.exp(exponent)
+    # Compute kernel size
+    axes = []
+    for d in range(ndims):
+        hksizes = np.max([2, int((3 * sigma_pixels[d] + 0.5) + 1)])
+        size = 3 + 2 * hksizes
+        middle = 1 + hksizes
+        axes.append(calibration[d] * (np.arange(size) - middle))
 
-    return kernel
+    return sigma, C, axes
@@ -1,4 +1,3 @@
-import sys
 import os
 import logging
 
@@ -133,11 +132,6 @@ class StackIO(object):
         A Python iterator over the image array.
         """
 
-        if not sys.version_info[0] == 2:
-            string_types = (str,)
-        else:
-            string_types = (str, unicode)
-
         try:
             tf = self.get_tif(multifile=True)
             arr = tf.asarray(memmap=memmap)
@@ -146,12 +140,7 @@ class StackIO(object):
             tf = self.get_tif(multifile=False)
             arr = tf.asarray(memmap=memmap).reshape(self.metadata['Shape'])
 
-        if isinstance(channel_index, string_types):
-            if 'Channels' in self.metadata.keys():
-                channel_index = self.metadata['Channels'].index(channel_index)
-            else:
-                raise TypeError("'Channels' key is missing in metadata."
-                                "Can't find '{}' index".format(channel_index))
+        channel_index = self._get_channel_index(channel_index)
 
         current_dimension_order = list(self.metadata['DimensionOrder'])
 
@@ -176,6 +165,168 @@ class StackIO(object):
 
         return it
 
+    def plane_iterator(self, channel_index=0, z_projection=False, volume=False):
+        """Iterate over image T and Z dimensions reading the TIFF file page by
+        page. Contrary to :meth:`image_iterator`, only the planes being yielded
+        are kept in memory (one plane, or one Z stack when `z_projection` is
+        True).
+
+        If the pages layout does not match metadata ('Shape' and
+        'DimensionOrder' ending by 'YX'), :meth:`image_iterator` is used instead.
+
+        Parameters
+        ----------
+        channel_index : int, str or list
+            Channel position to remove. If str, Channels metadata will be used.
+            If a list, every plane position yields an array with the planes
+            of these channels stacked along the first axis: each plane of the
+            file is only read once for all the channels.
+        z_projection : bool
+            If True, yield the maximum projection along Z.
+        volume : bool
+            If True, yield whole Z stacks (ZYX arrays) instead of planes.
+            Raise a ValueError if the file has no Z dimension.
+
+        Returns
+        -------
+        A Python iterator over the image planes.
+        """
+
+        dimension_order = list(self.metadata['DimensionOrder'])
+        plane_shape = tuple(self.metadata['Shape'][:-2])
+
+        if volume and 'Z' not in dimension_order:
+            raise ValueError("Can't iterate over Z stacks: no Z dimension in "
+                             "dimension order {}".format(self.metadata['DimensionOrder']))
+
+        tf = self.get_tif(multifile=True)
+        pages = tf.series[0].pages
+
+        multichannel = isinstance(channel_index, (list, tuple))
+        if multichannel:
+            channel_index = [self._get_channel_index(c) for c in channel_index]
+        else:
+            channel_index = self._get_channel_index(channel_index)
+
+        if dimension_order[-2:] != ['Y', 'X'] or len(pages) != int(np.prod(plane_shape)):
+            log.warning("Can't read TIFF file page by page. Use image_iterator() instead.")
+            tf.close()
+            if multichannel:
+                return self._channels_iterator(channel_index, z_projection, volume)
+            if volume:
+                dims = [d for d in dimension_order if d != 'C']
+                if dims[-3:] != ['Z', 'Y', 'X']:
+                    raise ValueError("Can't iterate over Z stacks with dimension "
+                                     "order {}".format(self.metadata['DimensionOrder']))
+                return self.image_iterator(position=-3, channel_index=channel_index)
+            return self.image_iterator(channel_index=channel_index,
+                                       z_projection=z_projection)
+
+        dimension_order = dimension_order[:-2]
+
+        if z_projection and 'Z' not in dimension_order:
+            log.warning("No Z detected. Can't perform Z projection")
+            z_projection = False
+
+        # Dimensions to iterate over
+        iter_dims = [d for d in dimension_order if d != 'C']
+        if z_projection or volume:
+            iter_dims.remove('Z')
+        iter_shape = [plane_shape[dimension_order.index(d)] for d in iter_dims]
+
+        def read_plane(full_idx):
+            page = pages[np.ravel_multi_index(full_idx, plane_shape)]
+            if page is None:
+                # Missing page in OME-TIFF
+                return np.zeros(self.metadata['Shape'][-2:], dtype=tf.series[0].dtype)
+            return page.asarray()
+
+        def get_full_idx(idx, c, z=None):
+            full_idx = []
+            for d in dimension_order:
+                if d == 'C':
+                    full_idx.append(c)
+                elif d == 'Z' and z is not None:
+                    full_idx.append(z)
+                else:
+                    full_idx.append(idx[iter_dims.index(d)])
+            return tuple(full_idx)
+
+        def read(idx, c):
+            if volume:
+                size_z = plane_shape[dimension_order.index('Z')]
+                plane = np.array([read_plane(get_full_idx(idx, c, z=z))
+                                  for z in range(size_z)])
+            elif z_projection:
+                size_z = plane_shape[dimension_order.index('Z')]
+                plane = read_plane(get_full_idx(idx, c, z=0))
+                for z in range(1, size_z):
+                    plane = np.maximum(plane, read_plane(get_full_idx(idx, c, z=z)))
+            else:
+                plane = read_plane(get_full_idx(idx, c))
+            return plane
+
+        # Define data iterator
+        def it():
+            try:
+                for idx in np.ndindex(*iter_shape):
+                    if multichannel:
+                        yield np.array([read(idx, c) for c in channel_index])
+                    else:
+                        yield read(idx, channel_index)
+            finally:
+                tf.close()
+
+        return it
+
+    def _channels_iterator(self, channel_indexes, z_projection=False, volume=False):
+        """Fallback of :meth:`plane_iterator` for several channels when the
+        file can't be read page by page. The whole file is loaded once.
+        """
+        dimension_order = list(self.metadata['DimensionOrder'])
+
+        def it():
+            tf = self.get_tif(multifile=True)
+            try:
+                arr = tf.asarray()
+            finally:
+                tf.close()
+            arr = arr.reshape(self.metadata['Shape'])
+            dims = list(dimension_order)
+
+            if 'C' in dims:
+                arr = np.moveaxis(arr, dims.index('C'), 0).take(channel_indexes, axis=0)
+                dims.remove('C')
+            else:
+                arr = np.array([arr] * len(channel_indexes))
+
+            n_kept = 2
+            if (z_projection or volume) and 'Z' in dims:
+                if volume:
+                    if dims[-3:] != ['Z', 'Y', 'X']:
+                        raise ValueError("Can't iterate over Z stacks with dimension "
+                                         "order {}".format(self.metadata['DimensionOrder']))
+                    n_kept = 3
+                else:
+                    arr = arr.max(axis=1 + dims.index('Z'))
+                    dims.remove('Z')
+
+            for idx in np.ndindex(*arr.shape[1:-n_kept]):
+                yield arr[(slice(None),) + idx]
+
+        return it
+
+    def _get_channel_index(self, channel_index):
+        """Get the index of a channel from its name (in Channels metadata).
+        """
+        if isinstance(channel_index, str):
+            if 'Channels' in self.metadata.keys():
+                channel_index = self.metadata['Channels'].index(channel_index)
+            else:
+                raise TypeError("'Channels' key is missing in metadata."
+                                "Can't find '{}' index".format(channel_index))
+        return channel_index
+
     def list_iterator(self, memmap=True):
         """Returns an iterator over each image from
         `self.image_path_list` as an array
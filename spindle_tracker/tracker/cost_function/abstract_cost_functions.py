@@ -19,6 +19,9 @@ class AbstractCostFunction(object):
     parameters : dict
     """
 
+    # Whether positions in context can be 2D arrays instead of DataFrames
+    array_context = False
+
     def __init__(self, context, parameters):
         self.context = context
         self.parameters = parameters
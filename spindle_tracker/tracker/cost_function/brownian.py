@@ -10,6 +10,8 @@ from __future__ import print_function
 
 import numpy as np
 import pandas as pd
+from scipy import sparse
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 
 from . import AbstractCostFunction
@@ -43,24 +45,34 @@ class BrownianLinkCostFunction(AbstractCostFunction):
            for which the distance *divided by the time difference* is higher than
            this parameter's value are set to np.nan
 
+        - 'sparse': a bool, default False. If True, only the pairs closer
+           than `max_speed * dt` are found with a KD-tree and the block is a
+           :class:`scipy.sparse.coo_matrix` holding their costs (see
+           :class:`spindle_tracker.tracker.matrix.SparseCostMatrix`). Only
+           the 'euclidean' distance is supported.
+
     context: dict
         Context is used to store vectors.
 
-        - pos_in: :class:`pandas.DataFrame`
-            The object coordinates to link from
+        - pos_in: :class:`pandas.DataFrame` or 2D :class:`numpy.ndarray`
+            The object coordinates to link from. Arrays columns are `coords`
+            then `t`.
 
-        - pos_out: :class:`pandas.DataFrame`
+        - pos_out: :class:`pandas.DataFrame` or 2D :class:`numpy.ndarray`
             The object coordinates to link to
 
     """
 
+    array_context = True
+
     def __init__(self, parameters):
         """
         """
 
         _parameters = {'distance_metric': 'euclidean',
                        'max_speed': 1.,
-                       'coords': ['x', 'y', 'z']}
+                       'coords': ['x', 'y', 'z'],
+                       'sparse': False}
         _parameters.update(parameters)
 
         super(BrownianLinkCostFunction, self).__init__(context={}, parameters=_parameters)
@@ -75,21 +87,25 @@ class BrownianLinkCostFunction(AbstractCostFunction):
         max_speed = self.parameters['max_speed']
 
         # Check context
-        pos_in = self.check_context('pos_in', pd.DataFrame)
-        pos_out = self.check_context('pos_out', pd.DataFrame)
+        pos_in = self.check_context('pos_in', (pd.DataFrame, np.ndarray))
+        pos_out = self.check_context('pos_out', (pd.DataFrame, np.ndarray))
 
-        # Chech vectors
-        self.check_columns([pos_in, pos_out], list(coords) + ['t'])
+        if isinstance(pos_in, pd.DataFrame):
+            # Chech vectors
+            self.check_columns([pos_in, pos_out], list(coords) + ['t'])
+            pos_in = pos_in[list(coords) + ['t']].values.astype('float')
+            pos_out = pos_out[list(coords) + ['t']].values.astype('float')
 
-        if pos_out.empty or pos_in.empty:
+        if not len(pos_out) or not len(pos_in):
             return pd.DataFrame([])
 
-        dt = pos_out['t'].iloc[0] - pos_in['t'].iloc[0]
+        dt = pos_out[0, -1] - pos_in[0, -1]
+
+        if self.parameters['sparse']:
+            return self._build_sparse(pos_in[:, :-1], pos_out[:, :-1], dt)
 
         # Build matrix block
-        distances = cdist(pos_in[coords].astype(np.float),
-                          pos_out[coords].astype(np.float),
-                          metric=distance_metric)
+        distances = cdist(pos_in[:, :-1], pos_out[:, :-1], metric=distance_metric)
 
         distances /= np.abs(dt)
         distances[distances > max_speed] = np.nan
@@ -97,6 +113,30 @@ class BrownianLinkCostFunction(AbstractCostFunction):
 
         return distances
 
+    def _build_sparse(self, pos_in, pos_out, dt):
+        """Build a sparse block with the costs of the pairs closer than
+        `max_speed * dt` only (`pos_in` and `pos_out` are 2D arrays of
+        coordinates).
+        """
+
+        max_speed = self.parameters['max_speed']
+
+        if self.parameters['distance_metric'] != 'euclidean':
+            raise ValueError("Only 'euclidean' distance is supported"
+                             " with sparse blocks.")
+
+        tree_in = cKDTree(pos_in)
+        tree_out = cKDTree(pos_out)
+
+        # Structured array with all the pairs (including zero distances)
+        pairs = tree_in.sparse_distance_matrix(tree_out, max_speed * np.abs(dt),
+                                               output_type='ndarray')
+
+        speeds = pairs['v'] / np.abs(dt)
+        shape = (len(pos_in), len(pos_out))
+
+        return sparse.coo_matrix((speeds ** 2, (pairs['i'], pairs['j'])), shape=shape)
+
 
 class BrownianGapCloseCostFunction(AbstractGapCloseCostFunction):
     """
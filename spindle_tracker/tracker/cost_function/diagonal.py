@@ -9,6 +9,8 @@ from __future__ import print_function
 
 
 import numpy as np
+from scipy import sparse
+
 from . import AbstractCostFunction
 
 __all__ = ["DiagonalCostFunction"]
@@ -22,6 +24,9 @@ class DiagonalCostFunction(AbstractCostFunction):
     context: `dict`
        this dictionnary must contain at least a `"cost"` key
     parameters: `dict`
+        If `parameters['sparse']` is True, blocks are
+        :class:`scipy.sparse.coo_matrix` (see
+        :class:`spindle_tracker.tracker.matrix.SparseCostMatrix`).
 
     Attributes
     ----------
@@ -51,6 +56,10 @@ class DiagonalCostFunction(AbstractCostFunction):
         cost = self.check_context('cost', float)
 
         vect = np.ones(len(objects)) * cost
+        if self.parameters.get('sparse', False):
+            idxs = np.arange(len(vect))
+            return sparse.coo_matrix((vect, (idxs, idxs)), shape=(len(vect), len(vect)))
+
         mat = self._vector_to_matrix(vect)
 
         return mat
@@ -116,7 +116,7 @@ class BasicDirectedLinkCostFunction(AbstractCostFunction):
 
             vecs_speed_in[label] = vec_speed_in
 
-        vecs_speed_in = pd.DataFrame.from_dict(vecs_speed_in).T.astype(np.float)
+        vecs_speed_in = pd.DataFrame.from_dict(vecs_speed_in).T.astype(float)
 
         # Compute the matrix according to euclidean distance and angle between vectors
         distances = np.empty((pos_in.shape[0], pos_out.shape[0]))
@@ -95,7 +95,8 @@ def reduction_transfer(
         int j_at_min
         double inf = np.inf
         int *p_i = <int *>(ii.data)
-        int *p_j = <int *>(j.data)
+        int *p_j_base = <int *>(j.data)
+        int *p_j
         int *p_idx = <int *>(idx.data)
         int *p_count = <int *>(count.data)
         int *p_x = <int *>(x.data)
@@ -110,6 +111,7 @@ def reduction_transfer(
             min_u = inf
             j1 = p_x[i]
             j_count = p_count[i]
+            p_j = p_j_base + p_idx[i]
             p_c = c_base + p_idx[i]
             j_at_min = -1
             for j_idx from 0 <= j_idx < j_count:
@@ -234,6 +236,11 @@ def augmenting_row_reduction(
                 elif temp < u2:
                     u2 = temp
                     j2 = j
+            if u2 == inf:
+                # A single reachable j: no reduction, only reassignment (the
+                # reduction would set v[j1] to -inf)
+                u2 = u1
+                j2 = j1
             # perform the reduction
             i1 = p_y_base[j1]
             if u1 + eps < u2:
@@ -340,7 +347,9 @@ def augment(
         int *p_ready      = <int *>(PyArray_DATA(ready))
         int *p_done       = <int *>(PyArray_DATA(done))
         int *p_on_to_do   = <int *>(PyArray_DATA(on_to_do))
-        double inf = np.sum(c) + 1 # This is larger than any path through.
+        # Not a bound such as np.sum(c) since a warm started v can give
+        # reduced costs above any bound of the costs
+        double inf = np.inf
         double umin, temp, h, u1
 
     ##################################################
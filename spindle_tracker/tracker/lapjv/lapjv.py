@@ -27,24 +27,43 @@ All rights reserved.
 
 import numpy as np
 
-try:  # pragma: no cover
-    from ._lapjv import reduction_transfer
-    from ._lapjv import augmenting_row_reduction
-    from ._lapjv import augment
-except ImportError:
-    # Try on the fly Cython compilation
-    import pyximport
-    pyximport.install(setup_args={'include_dirs': [np.get_include()]})
-
-    from ._lapjv import reduction_transfer
-    from ._lapjv import augmenting_row_reduction
-    from ._lapjv import augment
+# Cython functions, imported by load_extension()
+reduction_transfer = None
+augmenting_row_reduction = None
+augment = None
 
 __all__ = []
 
 
+def load_extension():  # pragma: no cover
+    '''Import the Cython extension, compiled on the fly with pyximport if
+    it has not been built. Called by lapjv() so importing this module
+    doesn't need a compiler.
+
+    Raises ImportError if the extension can't be imported nor compiled.
+    '''
+    global reduction_transfer, augmenting_row_reduction, augment
+
+    if augment is not None:
+        return
+
+    try:
+        from . import _lapjv
+    except ImportError:
+        # Try on the fly Cython compilation
+        import pyximport
+        pyximport.install(setup_args={'include_dirs': [np.get_include()]})
+
+        from . import _lapjv
+
+    reduction_transfer = _lapjv.reduction_transfer
+    augmenting_row_reduction = _lapjv.augmenting_row_reduction
+    augment = _lapjv.augment
+
+
 def lapjv(i, j, costs, wants_dual_variables=False,
-          augmenting_row_reductions=2, use_slow=False):  # pragma: no cover
+          augmenting_row_reductions=2, use_slow=False,
+          v_init=None, x_init=None):  # pragma: no cover
     '''Sparse linear assignment solution using Jonker-Volgenant algorithm
 
     i,j - similarly-sized vectors that pair the object at index i[n] with
@@ -67,6 +86,16 @@ def lapjv(i, j, costs, wants_dual_variables=False,
     use_slow: Bool, default False:
             use the pure python implementation, useful for debugging purpose
 
+    v_init - initial dual variables v (one per j), for example from the
+            solution of a similar problem. Column reduction and reduction
+            transfer are skipped.
+
+    x_init - guessed assignment of j for each i (-1 when unknown), used with
+            v_init. Only pairs where j has the lowest reduced cost of i are
+            kept, so the solution is still optimal.
+
+    A v_init with non-finite values is ignored (cold start).
+
     All costs not appearing in i,j are taken as infinite. Each i in the range,
     0 to max(i) must appear at least once and similarly for j.
 
@@ -77,6 +106,10 @@ def lapjv(i, j, costs, wants_dual_variables=False,
     j = np.atleast_1d(j).astype(int)
     costs = np.atleast_1d(costs)
 
+    if v_init is not None and not np.all(np.isfinite(v_init)):
+        v_init = None
+        x_init = None
+
     assert len(i) == len(j), "i and j must be the same length"
     assert len(i) == len(costs), "costs must be the same length as i"
 
@@ -116,38 +149,39 @@ def lapjv(i, j, costs, wants_dual_variables=False,
     u = np.ascontiguousarray(np.zeros(n, np.float64))
 
     # # # # # # # #
-    #
-    # Column reduction
-    #
-    # # # # # # # #
-    #
-    # For a given j, find the i with the minimum cost.
-    #
-    order = np.lexsort((-i, costs, j))
-    min_idx = order[j_index]
-    min_i = i[min_idx]
-    #
-    # v[j] is assigned to the minimum cost over all i
-    #
-    v = np.ascontiguousarray(costs[min_idx], np.float64)
-    #
-    # Find the last j for which i was min_i.
-    #
-    x[min_i] = np.arange(n).astype(np.uint32)
-    y[x[x != n]] = np.arange(n).astype(np.uint32)[x != n]
-    #
-    # Three cases for i:
-    #
-    # i is not the minimum of any j - i goes on free list
-    # i is the minimum of one j - v[j] remains the same and y[x[j]] = i
-    # i is the minimum of more than one j, perform reduction transfer
-    #
-    assignment_count = np.bincount(min_i[min_i != n])
-    # print assignment_count
-    assignment_count = np.hstack(
-        (assignment_count, np.zeros(n - len(assignment_count), int)))
-    free_i = assignment_count == 0
-    one_i = assignment_count == 1
+    if v_init is None:
+        #
+        # Column reduction
+        #
+        # # # # # # # #
+        #
+        # For a given j, find the i with the minimum cost.
+        #
+        order = np.lexsort((-i, costs, j))
+        min_idx = order[j_index]
+        min_i = i[min_idx]
+        #
+        # v[j] is assigned to the minimum cost over all i
+        #
+        v = np.ascontiguousarray(costs[min_idx], np.float64)
+        #
+        # Find the last j for which i was min_i.
+        #
+        x[min_i] = np.arange(n).astype(np.uint32)
+        y[x[x != n]] = np.arange(n).astype(np.uint32)[x != n]
+        #
+        # Three cases for i:
+        #
+        # i is not the minimum of any j - i goes on free list
+        # i is the minimum of one j - v[j] remains the same and y[x[j]] = i
+        # i is the minimum of more than one j, perform reduction transfer
+        #
+        assignment_count = np.bincount(min_i[min_i != n])
+        # print assignment_count
+        assignment_count = np.hstack(
+            (assignment_count, np.zeros(n - len(assignment_count), int)))
+        free_i = assignment_count == 0
+        one_i = assignment_count == 1
     # print one_i
     # order = np.lexsort((costs, i)) Replace with this after all is done
     order = np.lexsort((j, i))
@@ -155,6 +189,14 @@ def lapjv(i, j, costs, wants_dual_variables=False,
     costs = np.ascontiguousarray(costs[order], np.float64)
     i_index = np.ascontiguousarray(i_index, np.uint32)
     i_count = np.ascontiguousarray(i_count, np.uint32)
+    if v_init is not None:
+        #
+        # Warm start: keep the guessed pairs which satisfy complementary
+        # slackness with v_init, other i are free.
+        #
+        v, free_i = warm_start(n, i[order], j, costs, i_index, x, y,
+                               v_init, x_init)
+        one_i = np.zeros(n, bool)
     if use_slow:
         if np.any(one_i):
             print(np.ascontiguousarray(np.argwhere(one_i).flatten(), np.uint32))
@@ -171,6 +213,7 @@ def lapjv(i, j, costs, wants_dual_variables=False,
                     n, ii, j, i_index, i_count, x, y, u, v, costs)
         slow_augment(n, ii, j, i_index, i_count, x, y, u, v, costs)
     else:
+        load_extension()
         if np.any(one_i):
             reduction_transfer(
                 np.ascontiguousarray(np.argwhere(one_i).flatten(), np.uint32),
@@ -190,6 +233,43 @@ def lapjv(i, j, costs, wants_dual_variables=False,
         return x, y
 
 
+def warm_start(n, i, j, costs, idx, x, y, v_init, x_init):
+    '''Initialize the assignment from dual variables and a guessed assignment
+
+    n - the number of i and j in the linear assignment problem
+    i, j, costs - the entries, sorted by i
+    idx - the index of the first entry for each i
+    x, y - the assignments, updated in place
+    v_init - initial dual variables v
+    x_init - guessed assignment of j for each i (-1 when unknown) or None
+
+    A guessed pair (i, j) is kept if c[i,j] - v[j] is the minimum over all
+    the j of i and if j is not already taken: u[i] = c[i,j] - v[j] then
+    satisfies the dual constraints and the augmentation still finds an
+    optimal solution.
+
+    returns v and the mask of free i.
+    '''
+    v = np.ascontiguousarray(np.array(v_init, np.float64))
+    assert len(v) == n, "v_init must have one value per j"
+
+    if x_init is not None:
+        x_init = np.asarray(x_init).astype(int)
+        assert len(x_init) == n, "x_init must have one value per i"
+
+        reduced = costs - v[j]
+        row_min = np.minimum.reduceat(reduced, idx)
+        kept = (x_init[i] == j) & (reduced <= row_min[i])
+
+        # A j can be guessed for several i
+        kept_j, first = np.unique(j[kept], return_index=True)
+        kept_i = i[kept][first]
+        x[kept_i] = kept_j
+        y[kept_j] = kept_i
+
+    return v, x == n
+
+
 def slow_reduction_transfer(ii, j, idx, count, x, u, v, c):  # pragma: no cover
     '''Perform the reduction transfer step from the Jonker-Volgenant algorithm
 
@@ -280,6 +360,9 @@ def slow_augmenting_row_reduction(n, ii, jj, idx, count, x, y, u, v, c):  # prag
         j = jj[idx[i]:(idx[i] + count[i])]
         uu = c[idx[i]:(idx[i] + count[i])] - v[j]
         order = np.lexsort([uu])
+        if len(order) == 1:
+            # A single possible j: no reduction, only reassignment
+            order = np.repeat(order, 2)
         u1, u2 = uu[order[:2]]
         j1, j2 = j[order[:2]]
         i1 = y[j1]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+
+import numpy as np
+from numpy.testing import assert_allclose
+from scipy.optimize import linear_sum_assignment
+
+from spindle_tracker.tracker.lapjv import lapjv
+
+
+def sparse_problem(n=60, density=0.2, seed=0):
+    """Random sparse assignment problem with a complete assignment (the
+    diagonal is always kept).
+    """
+    rng = np.random.RandomState(seed)
+    keep = rng.uniform(size=(n, n)) < density
+    keep[np.diag_indices(n)] = True
+    i, j = np.nonzero(keep)
+    return i, j, rng.uniform(0, 10, len(i)), n
+
+
+def optimal_cost(i, j, costs, n):
+    mat = np.empty((n, n))
+    mat.fill(np.inf)
+    mat[i, j] = costs
+    rows, cols = linear_sum_assignment(mat)
+    return mat[rows, cols].sum()
+
+
+def assigned_cost(i, j, costs, n, x):
+    mat = np.empty((n, n))
+    mat.fill(np.inf)
+    mat[i, j] = costs
+    return mat[np.arange(n), x].sum()
+
+
+def test_lapjv():
+    for seed in range(5):
+        i, j, costs, n = sparse_problem(seed=seed)
+        x, y = lapjv(i, j, costs)
+        assert_allclose(assigned_cost(i, j, costs, n, x), optimal_cost(i, j, costs, n))
+        assert np.all(y[x] == np.arange(n))
+
+
+def test_lapjv_warm_start():
+    rng = np.random.RandomState(42)
+    for seed in range(5):
+        i, j, costs, n = sparse_problem(seed=seed)
+        x, _, _, v = lapjv(i, j, costs, wants_dual_variables=True)
+
+        # Duals and assignment of a similar problem
+        perturbed = costs + rng.normal(0, 0.5, len(costs))
+        expected = optimal_cost(i, j, perturbed, n)
+        x_warm, y_warm = lapjv(i, j, perturbed, v_init=v, x_init=x)
+        assert_allclose(assigned_cost(i, j, perturbed, n, x_warm), expected)
+        assert np.all(y_warm[x_warm] == np.arange(n))
+
+        # Any warm start must still give an optimal solution
+        x_warm, _ = lapjv(i, j, perturbed, v_init=rng.uniform(-10, 10, n),
+                          x_init=rng.permutation(n))
+        assert_allclose(assigned_cost(i, j, perturbed, n, x_warm), expected)
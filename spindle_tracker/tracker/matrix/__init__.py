@@ -9,5 +9,10 @@ from __future__ import print_function
 
 
 from .matrix import CostMatrix
+from .matrix import SparseCostMatrix
+from .matrix import DecomposedCostMatrix
+from .backends import get_solve_stats
+from .backends import reset_solve_stats
 
-__all__ = ["CostMatrix"]
+__all__ = ["CostMatrix", "SparseCostMatrix", "DecomposedCostMatrix",
+           "get_solve_stats", "reset_solve_stats"]
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+
+import numpy as np
+
+__all__ = []
+
+
+def auction_phase(idx, count, j, costs, prices, x, y, eps, big, max_bids):  # pragma: no cover
+    """One phase of the (minimization) forward auction algorithm, run until
+    every i is assigned. Compiled with numba when it is available.
+
+    idx - the index of the first entry for each i (entries sorted by i)
+    count - the number of entries for each i
+    j - the j-index of every entry
+    costs - the cost of every entry
+    prices - the price of each j, updated in place
+    x - the assignment of j to i (-1 if free), updated in place
+    y - the assignment of i to j (-1 if free), updated in place
+    eps - the minimal bid increment
+    big - the bid increment of an i with a single possible j
+    max_bids - maximum number of bids
+
+    returns the number of bids or -1 if `max_bids` was reached.
+    """
+    n = len(idx)
+
+    # Circular queue of the free i
+    queue = np.empty(n, np.int64)
+    n_free = 0
+    for i in range(n):
+        if x[i] == -1:
+            queue[n_free] = i
+            n_free += 1
+    start = 0
+
+    n_bids = 0
+    while n_free > 0:
+        if n_bids >= max_bids:
+            return -1
+        n_bids += 1
+
+        i = queue[start]
+        start = (start + 1) % n
+        n_free -= 1
+
+        # Find the best and the second best j for i
+        best = np.inf
+        second = np.inf
+        best_j = -1
+        for k in range(idx[i], idx[i] + count[i]):
+            value = costs[k] + prices[j[k]]
+            if value < best:
+                second = best
+                best = value
+                best_j = j[k]
+            elif value < second:
+                second = value
+        if second == np.inf:
+            second = best + big
+
+        # Bid
+        prices[best_j] += second - best + eps
+        previous = y[best_j]
+        y[best_j] = i
+        x[i] = best_j
+        if previous != -1:
+            x[previous] = -1
+            queue[(start + n_free) % n] = previous
+            n_free += 1
+
+    return n_bids
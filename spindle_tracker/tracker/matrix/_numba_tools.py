@@ -0,0 +1,7 @@
+from __future__ import division, print_function
+import numba
+
+from ._auction import auction_phase
+
+# nogil so components solved in threads run in parallel
+auction_phase_numba = numba.jit(nopython=True, nogil=True)(auction_phase)
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+
+import time
+import logging
+import threading
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from scipy.optimize import linear_sum_assignment
+
+from ._auction import auction_phase
+
+try:
+    import numba
+except ImportError:
+    numba = None
+else:
+    from ._numba_tools import auction_phase_numba
+
+log = logging.getLogger(__name__)
+
+__all__ = ["get_backend", "choose_backend", "get_solve_stats", "reset_solve_stats",
+           "AUTO_POLICY"]
+
+BACKENDS = OrderedDict()
+
+# Thresholds of choose_backend(), measured on frame to frame tracking
+# matrices:
+# - max_dense_size: matrices up to this size are solved with 'scipy'.
+# - min_density, max_density_size: matrices up to `max_density_size` with a
+#   higher fraction of finite costs than `min_density` are solved with
+#   'scipy'.
+AUTO_POLICY = {'max_dense_size': 300,
+               'min_density': 0.02,
+               'max_density_size': 3000
+               }
+
+# Solve time of each backend, see get_solve_stats()
+_stats = OrderedDict()
+_stats_lock = threading.Lock()
+
+
+def register_backend(cls):
+    """Class decorator adding a backend to `BACKENDS`.
+    """
+    BACKENDS[cls.name] = cls
+    return cls
+
+
+def get_backend(name):
+    """Get a backend instance from its name.
+    """
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend '{}'. Available backends are: "
+                         "{}".format(name, ', '.join(BACKENDS.keys())))
+    return BACKENDS[name]()
+
+
+class AbstractBackend(object):
+    """Linear assignment solver of a square cost matrix given as
+    `(idxs_in, idxs_out, costs)` triplets (missing pairs have an infinite
+    cost).
+    """
+
+    name = None
+    warm_start = False
+
+    def is_available(self):
+        """Whether the backend can be used in this environment.
+        """
+        return True
+
+    def solve(self, idxs_in, idxs_out, costs, n, v_init=None, x_init=None):
+        """Solve the linear assignment problem and record the solve time.
+
+        Parameters
+        ----------
+        idxs_in, idxs_out : 1D :class:`numpy.ndarray`
+            Row and column of each cost.
+        costs : 1D :class:`numpy.ndarray`
+        n : int
+            Size of the cost matrix.
+        v_init, x_init : 1D :class:`numpy.ndarray` or None
+            Warm start (see :func:`spindle_tracker.tracker.lapjv.lapjv`),
+            ignored if the backend doesn't support it.
+
+        Returns
+        -------
+        in_links : 1D :class:`numpy.ndarray`
+            Column assigned to each row.
+        out_links : 1D :class:`numpy.ndarray`
+            Row assigned to each column.
+        u, v : 1D :class:`numpy.ndarray` or None
+            Rows and columns dual variables (None if the backend doesn't
+            compute them).
+        duration : float
+            Solve time in seconds.
+        """
+        start = time.time()
+        in_links, out_links, u, v = self._solve(idxs_in, idxs_out, costs, n,
+                                                v_init=v_init, x_init=x_init)
+        duration = time.time() - start
+
+        record_solve_time(self.name, n, len(costs), duration)
+        log.debug("{} solved a {} x {} matrix ({} costs) in {:.4f}s".format(
+            self.name, n, n, len(costs), duration))
+
+        return in_links, out_links, u, v, duration
+
+    def _solve(self, idxs_in, idxs_out, costs, n, v_init=None, x_init=None):
+        """
+        """
+        raise NotImplementedError()
+
+
+@register_backend
+class LAPJVBackend(AbstractBackend):
+    """Sparse Jonker-Volgenant solver from CellProfiler (see
+    :func:`spindle_tracker.tracker.lapjv.lapjv`). The Cython extension is
+    imported, and compiled if needed, the first time the backend is used.
+    """
+
+    name = 'lapjv'
+    warm_start = True
+
+    def is_available(self):
+        """
+        """
+        from ..lapjv.lapjv import load_extension
+        try:
+            load_extension()
+        except ImportError:  # pragma: no cover
+            return False
+        return True
+
+    def _solve(self, idxs_in, idxs_out, costs, n, v_init=None, x_init=None):
+        """
+        """
+        from ..lapjv import lapjv
+        return lapjv(idxs_in, idxs_out, costs, wants_dual_variables=True,
+                     v_init=v_init, x_init=x_init)
+
+
+@register_backend
+class ScipyBackend(AbstractBackend):
+    """Dense solver (:func:`scipy.optimize.linear_sum_assignment`). Memory is
+    quadratic with the matrix size so it is meant for small blocks.
+    """
+
+    name = 'scipy'
+
+    def _solve(self, idxs_in, idxs_out, costs, n, v_init=None, x_init=None):
+        """
+        """
+        mat = np.empty((n, n))
+        mat.fill(np.inf)
+        mat[idxs_in, idxs_out] = costs
+
+        rows, in_links = linear_sum_assignment(mat)
+        out_links = np.empty(n, dtype='int')
+        out_links[in_links] = rows
+
+        return in_links, out_links, None, None
+
+
+@register_backend
+class AuctionBackend(AbstractBackend):
+    """Epsilon-scaling forward auction solver (Bertsekas) working on the
+    sparse costs only. Used with numba if installed.
+
+    The solution is approximate: its total cost is within `tolerance` times
+    the range of the costs of the optimal one. Solutions can then differ
+    from the other backends when several assignments have almost the same
+    cost. It is never chosen by :func:`choose_backend`.
+
+    Parameters
+    ----------
+    tolerance : float
+        Relative optimality tolerance.
+    scaling : float
+        Epsilon reduction factor between auction phases.
+    max_bids : int
+        Bids limit of one phase, reached when the matrix has no complete
+        assignment.
+    """
+
+    name = 'auction'
+
+    def __init__(self, tolerance=1e-6, scaling=7., max_bids=int(1e9)):
+        """
+        """
+        self.tolerance = tolerance
+        self.scaling = scaling
+        self.max_bids = max_bids
+
+    def _solve(self, idxs_in, idxs_out, costs, n, v_init=None, x_init=None):
+        """
+        """
+        if numba is None:
+            warnings.warn('numba is not installed. Using slower version.')
+            phase = auction_phase
+        else:
+            phase = auction_phase_numba
+
+        idxs_in = np.asarray(idxs_in, dtype='int64')
+        idxs_out = np.asarray(idxs_out, dtype='int64')
+        costs = np.asarray(costs, dtype='float')
+
+        # Costs sorted by row
+        order = np.argsort(idxs_in, kind='mergesort')
+        j = idxs_out[order]
+        sorted_costs = costs[order]
+        count = np.bincount(idxs_in, minlength=n)
+        if np.any(count == 0):
+            raise ValueError("All rows must have at least one cost.")
+        idx = np.cumsum(count) - count
+
+        span = costs.max() - costs.min()
+        if span == 0:
+            span = 1.
+        final_eps = self.tolerance * span / n
+        eps = span / 2
+
+        prices = np.zeros(n)
+        x = np.empty(n, dtype='int64')
+        y = np.empty(n, dtype='int64')
+
+        while True:
+            eps = max(eps, final_eps)
+            x.fill(-1)
+            y.fill(-1)
+            n_bids = phase(idx, count, j, sorted_costs, prices, x, y,
+                           eps, span + eps, self.max_bids)
+            if n_bids < 0:
+                raise ValueError("Auction didn't converge, the cost matrix "
+                                 "may have no complete assignment.")
+            if eps == final_eps:
+                break
+            eps /= self.scaling
+
+        # Prices are the opposite of the columns dual variables
+        v = -prices
+        assigned_costs = _get_assigned_costs(idx, count, j, sorted_costs, x)
+        u = assigned_costs - v[x]
+
+        return x, y, u, v
+
+
+def choose_backend(n, n_costs, warm_start=False, policy=None):
+    """Choose an exact backend ('scipy' or 'lapjv') from the cost matrix
+    size and density. 'auction' is approximate and never chosen: it is only
+    used when asked for explicitly.
+
+    - 'lapjv' when a warm start is given, since only it uses it.
+    - 'scipy' for small matrices or dense enough medium ones.
+    - 'lapjv' otherwise.
+
+    Both solvers give an optimal assignment, but not always the same one
+    when several assignments have the same total cost.
+
+    Parameters
+    ----------
+    n : int
+        Size of the square cost matrix.
+    n_costs : int
+        Number of finite costs.
+    warm_start : bool
+        Whether the solver will be given a warm start.
+    policy : dict or None
+        Thresholds updating `AUTO_POLICY`.
+    """
+    thresholds = AUTO_POLICY.copy()
+    thresholds.update(policy or {})
+    density = n_costs / n ** 2 if n else 1.
+
+    if not _is_available('lapjv'):  # pragma: no cover
+        return 'scipy'
+    if warm_start:
+        return 'lapjv'
+    if n <= thresholds['max_dense_size'] or (density >= thresholds['min_density'] and
+                                             n <= thresholds['max_density_size']):
+        return 'scipy'
+    return 'lapjv'
+
+
+_available = {}
+
+
+def _is_available(name):
+    """Cached :meth:`AbstractBackend.is_available`.
+    """
+    if name not in _available:
+        _available[name] = get_backend(name).is_available()
+    return _available[name]
+
+
+def _get_assigned_costs(idx, count, j, costs, x):
+    """Cost of the assigned column of each row, costs being sorted by row.
+    """
+    rows = np.repeat(np.arange(len(idx)), count)
+    assigned = j == x[rows]
+    assigned_costs = np.empty(len(idx))
+    assigned_costs[rows[assigned]] = costs[assigned]
+    return assigned_costs
+
+
+def record_solve_time(name, n, n_costs, duration):
+    """Add a solve to the stats of the `name` backend.
+    """
+    with _stats_lock:
+        stats = _stats.setdefault(name, [0, 0., 0, 0])
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] += n
+        stats[3] += n_costs
+
+
+def get_solve_stats():
+    """Solve time of each backend since the last :func:`reset_solve_stats`.
+
+    Returns
+    -------
+    stats : :class:`pandas.DataFrame`
+        One line per backend with the number of solved matrices, total and
+        mean solve time (in seconds) and the mean size and number of costs
+        of the matrices.
+    """
+    with _stats_lock:
+        rows = [OrderedDict([('backend', name),
+                             ('n_solves', count),
+                             ('total_time', total_time),
+                             ('mean_time', total_time / count),
+                             ('mean_size', total_n / count),
+                             ('mean_costs', total_costs / count)])
+                for name, (count, total_time, total_n, total_costs) in _stats.items()]
+
+    if not rows:
+        return pd.DataFrame([])
+    return pd.DataFrame(rows).set_index('backend')
+
+
+def reset_solve_stats():
+    """Clear solve times recorded by :func:`get_solve_stats`.
+    """
+    with _stats_lock:
+        _stats.clear()
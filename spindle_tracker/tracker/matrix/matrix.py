@@ -8,9 +8,14 @@ from __future__ import print_function
 
 
 import logging
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
 
-from ..lapjv import lapjv
+from .backends import get_backend
+from .backends import choose_backend
 
 log = logging.getLogger(__name__)
 
@@ -18,21 +23,37 @@ __all__ = []
 
 
 class CostMatrix(object):
-    """This class represents the cost matrix which will be given to LAPJV solver.
+    """This class represents the cost matrix which will be given to a linear assignment solver.
     Cost matrix is built from matrices blocks.
 
     Parameters
     ----------
     blocks : 2D list of :class:`numpy.ndarray` or None
         Each array value is a block or None (filled with np.nan).
+    lrb_cost : float or None
+        Cost of the lower right block. Default to 1.1 times the highest cost.
+    backend : str
+        Linear assignment solver (see
+        :mod:`spindle_tracker.tracker.matrix.backends`): 'lapjv', 'scipy',
+        'auction' (approximate) or 'auto' to choose an exact one from the
+        matrix size and density (see
+        :func:`spindle_tracker.tracker.matrix.backends.choose_backend`).
     """
 
-    def __init__(self, blocks):
+    def __init__(self, blocks, lrb_cost=None, backend='auto'):
         """
         """
 
+        self.lrb_cost = lrb_cost
+        self.backend = backend
+        self._flat = None
+
         if isinstance(blocks, list):
-            self.blocks = np.atleast_2d(blocks)
+            # Blocks don't have the same shape, store them as objects
+            self.blocks = np.empty((len(blocks), len(blocks[0])), dtype='object')
+            for n, row in enumerate(blocks):
+                for m, block in enumerate(row):
+                    self.blocks[n, m] = block
         else:
             self.blocks = blocks
 
@@ -42,13 +63,51 @@ class CostMatrix(object):
         self.in_links = None
         self.out_links = None
         self.assigned_costs = None
+        self.u = None
+        self.v = None
+        self.backend_name = None
+        self.solve_time = None
+
+    def solve(self, v_init=None, x_init=None):
+        """Solves the linear assignement problem on `self.mat`. Dual variables
+        of the solution are stored in `self.u` (rows) and `self.v` (columns),
+        or are None if the backend doesn't compute them. The backend used and
+        its solve time (in seconds) are stored in `self.backend_name` and
+        `self.solve_time`.
 
-    def solve(self):
-        """Solves the linear assignement problem on `self.mat`.
+        Parameters
+        ----------
+        v_init : 1D :class:`numpy.ndarray` or None
+            Initial columns dual variables to warm start the solver (see
+            :func:`spindle_tracker.tracker.lapjv.lapjv`). Only used by the
+            'lapjv' backend.
+        x_init : 1D :class:`numpy.ndarray` or None
+            Guessed column of each row (-1 if unknown), used with `v_init`.
         """
 
         idxs_in, idxs_out, self.costs = self.get_flat()
-        self.in_links, self.out_links = lapjv(idxs_in, idxs_out, self.costs)
+        n = int(self.get_shapes()[0].sum())
+        self.backend_name = self.choose_backend(warm_start=v_init is not None)
+        backend = get_backend(self.backend_name)
+
+        solution = backend.solve(idxs_in, idxs_out, self.costs, n,
+                                 v_init=v_init, x_init=x_init)
+        self.in_links, self.out_links, self.u, self.v, self.solve_time = solution
+
+    def choose_backend(self, warm_start=False):
+        """Name of the backend used by :meth:`solve` (with a warm start if
+        `warm_start` is True).
+        """
+        if self.backend != 'auto':
+            return self.backend
+        idxs_in, idxs_out, costs = self.get_flat()
+        return choose_backend(int(self.get_shapes()[0].sum()), len(costs),
+                              warm_start=warm_start)
+
+    def get_costs(self, idxs_in, idxs_out):
+        """Get the costs of the `(idxs_in, idxs_out)` pairs.
+        """
+        return self.mat[idxs_in, idxs_out]
 
     def get_masked(self):
         """Get masked array.
@@ -72,11 +131,13 @@ class CostMatrix(object):
         costs : 1D `numpy.ndarray`
             Associated costs (matrix value).
         """
-        masked = self.get_masked()
-        costs = masked.compressed()
-        idxs_in, idxs_out = np.where(
-            np.logical_not(np.ma.getmask(masked)))
-        return idxs_in, idxs_out, costs
+        if self._flat is None:
+            masked = self.get_masked()
+            costs = masked.compressed()
+            idxs_in, idxs_out = np.where(
+                np.logical_not(np.ma.getmask(masked)))
+            self._flat = (idxs_in, idxs_out, costs)
+        return self._flat
 
     def _fill_lrb(self):
         """Fill the lower contiguous block of NaN values with the transposed
@@ -85,14 +146,17 @@ class CostMatrix(object):
 
         # Find the lower contiguous block
         x, y = self.get_shapes()
-        i = np.sum(x[:len(x) / 2])
-        j = np.sum(y[:len(y) / 2])
+        i = np.sum(x[:len(x) // 2])
+        j = np.sum(y[:len(y) // 2])
 
         # Copy the upper left block and transpose
         lrb = self.mat[:i, :j].T.copy()
 
         # Give a value higher than the max value
-        lrb[np.isfinite(lrb)] = self.get_masked().max() * 1.1
+        if self.lrb_cost is None:
+            lrb[np.isfinite(lrb)] = self.get_masked().max() * 1.1
+        else:
+            lrb[np.isfinite(lrb)] = self.lrb_cost
 
         self.mat[i:, j:] = lrb
 
@@ -131,7 +195,7 @@ class CostMatrix(object):
         for n, row in enumerate(self.blocks):
             shapes = []
             for block in row:
-                if isinstance(block, np.ndarray):
+                if isinstance(block, np.ndarray) or sparse.issparse(block):
                     shapes.append(block.shape[0])
             if np.unique(shapes).size != 1:
                 raise ValueError("Blocks don't fit horizontally")
@@ -140,13 +204,13 @@ class CostMatrix(object):
         for n, col in enumerate(self.blocks.T):
             shapes = []
             for block in col:
-                if isinstance(block, np.ndarray):
+                if isinstance(block, np.ndarray) or sparse.issparse(block):
                     shapes.append(block.shape[1])
             if np.unique(shapes).size != 1:
                 raise ValueError("Blocks don't fit vertically")
             col_shapes[n] = shapes[0]
 
-        return row_shapes.astype(np.int), col_shapes.astype(np.int)
+        return row_shapes.astype(int), col_shapes.astype(int)
 
     def view(self, ax=None, colormap="gray", **kwargs):  # pragma: no cover
         """Display cost matrice on a plot.
@@ -188,9 +252,9 @@ class CostMatrix(object):
         ax.set_yticks(np.arange(0.5, size + 0.5))
 
         col_labels = np.hstack(np.array([list(range(s))
-                                         for s in col_shapes.astype(np.int)]))
+                                         for s in col_shapes.astype(int)]))
         row_labels = np.hstack(np.array([list(reversed(range(s)))
-                                         for s in row_shapes[::-1].astype(np.int)]))
+                                         for s in row_shapes[::-1].astype(int)]))
 
         ax.set_xticklabels(col_labels)
         ax.set_yticklabels(row_labels)
@@ -218,3 +282,359 @@ class CostMatrix(object):
         ax.set_ylim(0, size)
 
         return ax
+
+
+class SparseCostMatrix(CostMatrix):
+    """Cost matrix stored as `(idxs_in, idxs_out, costs)` triplets. The dense
+    matrix is never built so memory only depends on the number of finite
+    costs.
+
+    Parameters
+    ----------
+    blocks : 2D list of :class:`numpy.ndarray`, :mod:`scipy.sparse` matrix or None
+        Each array value is a block or None (no finite cost). Only the finite
+        values of dense blocks are kept. All the stored values of sparse
+        blocks (including explicit zeros) are kept.
+    lrb_cost : float or None
+        Cost of the lower right block. Default to 1.1 times the highest cost.
+    """
+
+    @property
+    def mat(self):
+        """Dense cost matrix (with np.nan for missing costs), for display only.
+        """
+        mat = np.empty(self.shape)
+        mat.fill(np.nan)
+        mat[self.idxs_in, self.idxs_out] = self.values
+        return mat
+
+    def get_flat(self):
+        """Get flat vectors of the finite costs.
+
+        Returns
+        -------
+        idxs_in : 1D `numpy.ndarray`
+            Y axis indexes.
+        idxs_out : 1D `numpy.ndarray`
+            X axis indexes.
+        costs : 1D `numpy.ndarray`
+            Associated costs.
+        """
+        return self.idxs_in, self.idxs_out, self.values
+
+    def get_costs(self, idxs_in, idxs_out):
+        """Get the costs of the `(idxs_in, idxs_out)` pairs (np.nan if the
+        pair has no finite cost).
+        """
+        return _get_triplet_costs(self.idxs_in, self.idxs_out, self.values,
+                                  idxs_in, idxs_out)
+
+    def _fill_lrb(self):
+        """Fill the lower right quadrant with the transposed pattern of the
+        upper left quadrant (see :meth:`CostMatrix._fill_lrb`).
+        """
+
+        x, y = self.get_shapes()
+        i = np.sum(x[:len(x) // 2])
+        j = np.sum(y[:len(y) // 2])
+
+        if self.lrb_cost is None:
+            lrb_cost = self.values.max() * 1.1 if len(self.values) else 0
+        else:
+            lrb_cost = self.lrb_cost
+
+        upper = (self.idxs_in < i) & (self.idxs_out < j)
+        lower = (self.idxs_in >= i) & (self.idxs_out >= j)
+
+        lrb_in = self.idxs_out[upper] + i
+        lrb_out = self.idxs_in[upper] + j
+        lrb_values = np.ones(len(lrb_in)) * lrb_cost
+
+        self.idxs_in = np.concatenate([self.idxs_in[~lower], lrb_in])
+        self.idxs_out = np.concatenate([self.idxs_out[~lower], lrb_out])
+        self.values = np.concatenate([self.values[~lower], lrb_values])
+
+    def _concatenate_blocks(self):
+        """Concatenate the finite costs of the blocks with their offset in the
+        cost matrix.
+        """
+
+        row_shapes, col_shapes = self.get_shapes()
+        self.shape = (row_shapes.sum(), col_shapes.sum())
+
+        row_corners = row_shapes.cumsum() - row_shapes
+        col_corners = col_shapes.cumsum() - col_shapes
+
+        idxs_in = [np.array([], dtype='int')]
+        idxs_out = [np.array([], dtype='int')]
+        values = [np.array([])]
+        for i, start_i in enumerate(row_corners):
+            for j, start_j in enumerate(col_corners):
+                block = self.blocks[i, j]
+                if block is None:
+                    continue
+                rows, cols, costs = _block_to_triplets(block)
+                idxs_in.append(rows + start_i)
+                idxs_out.append(cols + start_j)
+                values.append(costs)
+
+        self.idxs_in = np.concatenate(idxs_in).astype('int')
+        self.idxs_out = np.concatenate(idxs_out).astype('int')
+        self.values = np.concatenate(values).astype('float')
+
+
+class DecomposedCostMatrix(object):
+    """Frame to frame cost matrix solved as one linear assignment problem per
+    connected component of the link graph.
+
+    Objects which can't be linked together never compete, so each group of
+    objects connected by finite link costs is solved independently with its
+    own birth and death alternatives. Objects without any possible link are
+    directly assigned to birth or death. Solutions are the same as the ones
+    of :class:`CostMatrix` on the whole matrix.
+
+    Parameters
+    ----------
+    blocks : 2D list
+        `[[link, death], [birth, None]]` where blocks are dense arrays or
+        :mod:`scipy.sparse` matrices (see :class:`SparseCostMatrix`). Death
+        and birth blocks must be diagonal.
+    threads : int
+        Number of threads used to solve the components.
+    batch_size : int
+        Small components are solved together in problems of at least
+        `batch_size` objects.
+    backend : str
+        Linear assignment solver of the components (see
+        :class:`CostMatrix`).
+    """
+
+    def __init__(self, blocks, threads=1, batch_size=256, backend='auto'):
+        """
+        """
+
+        link, death = blocks[0][:2]
+        birth = blocks[1][0]
+
+        self.idxs_in, self.idxs_out, self.values = _block_to_triplets(link)
+        self.n_in, self.n_out = link.shape
+        self.death_costs = _block_diagonal(death)
+        self.birth_costs = _block_diagonal(birth)
+
+        self.threads = threads
+        self.batch_size = batch_size
+        self.backend = backend
+
+        # Same lower right block cost as the whole cost matrix
+        all_costs = np.concatenate([self.values, self.death_costs, self.birth_costs])
+        all_costs = all_costs[np.isfinite(all_costs)]
+        self.lrb_cost = all_costs.max() * 1.1 if len(all_costs) else 0
+
+        self.in_links = None
+        self.out_links = None
+        self.n_components = None
+        self.solve_time = None
+
+    def get_shapes(self):
+        """Get whole matrix blocks shape (see :meth:`CostMatrix.get_shapes`).
+        """
+        return (np.array([self.n_in, self.n_out]),
+                np.array([self.n_out, self.n_in]))
+
+    def get_costs(self, idxs_in, idxs_out):
+        """Get the link costs of the `(idxs_in, idxs_out)` pairs (np.nan if
+        the pair has no finite cost).
+        """
+        return _get_triplet_costs(self.idxs_in, self.idxs_out, self.values,
+                                  idxs_in, idxs_out)
+
+    def solve(self):
+        """Solve the linear assignment problem of every component and stitch
+        solutions in the whole matrix indexes.
+        """
+
+        n_in, n_out = self.n_in, self.n_out
+
+        # By default objects are assigned to death and birth
+        self.in_links = np.zeros(n_in + n_out, dtype='int')
+        self.out_links = np.zeros(n_in + n_out, dtype='int')
+        self.in_links[:n_in] = n_out + np.arange(n_in)
+        self.out_links[n_out:] = np.arange(n_in)
+        self.out_links[:n_out] = n_in + np.arange(n_out)
+        self.in_links[n_in:] = np.arange(n_out)
+
+        n_nodes = n_in + n_out
+        graph = sparse.coo_matrix((np.ones(len(self.idxs_in)),
+                                   (self.idxs_in, self.idxs_out + n_in)),
+                                  shape=(n_nodes, n_nodes))
+        self.n_components, labels = connected_components(graph, directed=False)
+
+        edge_labels = labels[self.idxs_in]
+        n_edges = np.bincount(edge_labels, minlength=self.n_components)
+        n_rows = np.bincount(labels[:n_in], minlength=self.n_components)
+        n_cols = np.bincount(labels[n_in:], minlength=self.n_components)
+
+        # Components with a single possible link don't need a solver
+        single = (n_edges == 1) & (n_rows == 1) & (n_cols == 1)
+        self._solve_single(np.nonzero(single[edge_labels])[0])
+
+        batches = self.get_batches(labels, edge_labels,
+                                   (n_edges > 0) & ~single, n_rows + n_cols)
+
+        if self.threads > 1 and len(batches) > 1:
+            pool = ThreadPool(self.threads)
+            try:
+                solutions = pool.map(self._solve_component, batches)
+            finally:
+                pool.close()
+        else:
+            solutions = [self._solve_component(batch) for batch in batches]
+
+        self.solve_time = sum(solve_time for _, _, solve_time in solutions)
+        for (rows, cols, _), (in_links, out_links, _) in zip(batches, solutions):
+            # Local indexes of the component matrix to whole matrix indexes
+            rows_map = np.concatenate([rows, n_in + cols])
+            cols_map = np.concatenate([cols, n_out + rows])
+            self.in_links[rows_map] = cols_map[in_links]
+            self.out_links[cols_map] = rows_map[out_links]
+
+    def get_batches(self, labels, edge_labels, to_solve, sizes):
+        """Group components to solve in batches of at least `batch_size`
+        objects. Components of a batch are independent so solving them in a
+        single problem gives the same solution with less overhead.
+
+        Parameters
+        ----------
+        labels : 1D :class:`numpy.ndarray`
+            Component of each object (objects in then objects out).
+        edge_labels : 1D :class:`numpy.ndarray`
+            Component of each link.
+        to_solve : 1D :class:`numpy.ndarray`
+            Mask of the components to solve.
+        sizes : 1D :class:`numpy.ndarray`
+            Number of objects in each component.
+
+        Returns
+        -------
+        batches : list of tuple
+            `(rows, cols, edges)` for each batch, where `rows` and `cols` are
+            the indexes of the objects and `edges` the indexes of their link
+            costs.
+        """
+
+        if not np.any(to_solve):
+            return []
+
+        batch_ids = np.ones(self.n_components, dtype='int') * -1
+        starts = np.cumsum(sizes[to_solve]) - sizes[to_solve]
+        # Components are added to a batch until it is full
+        _, batch_ids[to_solve] = np.unique(starts // self.batch_size, return_inverse=True)
+        n_batches = batch_ids.max() + 1
+
+        # Group objects and links by batch
+        node_batches = batch_ids[labels]
+        node_order = np.argsort(node_batches, kind='mergesort')
+        node_bounds = np.searchsorted(node_batches[node_order], np.arange(n_batches + 1))
+        edge_batches = batch_ids[edge_labels]
+        edge_order = np.argsort(edge_batches, kind='mergesort')
+        edge_bounds = np.searchsorted(edge_batches[edge_order], np.arange(n_batches + 1))
+
+        batches = []
+        for n in range(n_batches):
+            nodes = node_order[node_bounds[n]:node_bounds[n + 1]]
+            rows = nodes[nodes < self.n_in]
+            cols = nodes[nodes >= self.n_in] - self.n_in
+            edges = edge_order[edge_bounds[n]:edge_bounds[n + 1]]
+            batches.append((rows, cols, edges))
+
+        return batches
+
+    def _solve_single(self, edges):
+        """Solve components made of a single possible link: the link is kept
+        if it is cheaper than the death and birth alternatives.
+        """
+
+        idxs_in = self.idxs_in[edges]
+        idxs_out = self.idxs_out[edges]
+        linked = (self.values[edges] + self.lrb_cost <
+                  self.death_costs[idxs_in] + self.birth_costs[idxs_out])
+        idxs_in = idxs_in[linked]
+        idxs_out = idxs_out[linked]
+
+        self.in_links[idxs_in] = idxs_out
+        self.out_links[idxs_out] = idxs_in
+        # The lower right block is assigned too
+        self.in_links[self.n_in + idxs_out] = self.n_out + idxs_in
+        self.out_links[self.n_out + idxs_in] = self.n_in + idxs_out
+
+    def _solve_component(self, component):
+        """
+        """
+
+        rows, cols, edges = component
+
+        local_in = np.zeros(self.n_in, dtype='int')
+        local_in[rows] = np.arange(len(rows))
+        local_out = np.zeros(self.n_out, dtype='int')
+        local_out[cols] = np.arange(len(cols))
+
+        link = sparse.coo_matrix((self.values[edges],
+                                  (local_in[self.idxs_in[edges]],
+                                   local_out[self.idxs_out[edges]])),
+                                 shape=(len(rows), len(cols)))
+        death = _diagonal_block(self.death_costs[rows])
+        birth = _diagonal_block(self.birth_costs[cols])
+
+        cm = SparseCostMatrix([[link, death], [birth, None]], lrb_cost=self.lrb_cost,
+                              backend=self.backend)
+        cm.solve()
+        return cm.in_links.astype('int'), cm.out_links.astype('int'), cm.solve_time
+
+
+def _get_triplet_costs(all_in, all_out, values, idxs_in, idxs_out):
+    """Find the values of the `(idxs_in, idxs_out)` pairs in triplets (np.nan
+    for missing pairs).
+    """
+    idxs_in = np.asarray(idxs_in)
+    idxs_out = np.asarray(idxs_out)
+    if not len(values):
+        return np.ones(idxs_in.shape) * np.nan
+
+    n_cols = max(all_out.max(), np.max(idxs_out)) + 1
+    keys = idxs_in * n_cols + idxs_out
+    all_keys = all_in * n_cols + all_out
+    order = np.argsort(all_keys)
+    sorted_keys = all_keys[order]
+
+    pos = np.clip(np.searchsorted(sorted_keys, keys), 0, len(sorted_keys) - 1)
+    return np.where(sorted_keys[pos] == keys, values[order][pos], np.nan)
+
+
+def _block_diagonal(block):
+    """Get the diagonal of a dense or sparse block.
+    """
+    if sparse.issparse(block):
+        return block.diagonal()
+    return np.diag(block)
+
+
+def _diagonal_block(values):
+    """Sparse diagonal block.
+    """
+    idxs = np.arange(len(values))
+    return sparse.coo_matrix((values, (idxs, idxs)), shape=(len(values), len(values)))
+
+
+def _block_to_triplets(block):
+    """Get the rows, columns and values of the finite costs of a dense or
+    sparse block.
+    """
+    if sparse.issparse(block):
+        block = block.tocoo()
+        rows, cols, values = block.row, block.col, block.data
+        finite = np.isfinite(values)
+        return rows[finite], cols[finite], values[finite]
+
+    block = np.asarray(block, dtype='float')
+    rows, cols = np.nonzero(np.isfinite(block))
+    return rows, cols, block[rows, cols]
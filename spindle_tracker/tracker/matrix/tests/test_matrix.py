@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+
+import numpy as np
+from numpy.testing import assert_allclose
+from numpy.testing import assert_array_equal
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial.distance import cdist
+
+from spindle_tracker.tracker.matrix import CostMatrix
+from spindle_tracker.tracker.matrix import SparseCostMatrix
+from spindle_tracker.tracker.matrix import DecomposedCostMatrix
+from spindle_tracker.tracker.matrix.backends import choose_backend
+from spindle_tracker.tracker.matrix.backends import get_backend
+
+
+def tracking_blocks(n_in=30, n_out=25, max_cost=9., seed=0):
+    """Frame to frame blocks: squared distances closer than `max_cost`
+    (np.nan otherwise) and diagonal birth and death blocks.
+    """
+    rng = np.random.RandomState(seed)
+    link = cdist(rng.uniform(0, 20, (n_in, 2)), rng.uniform(0, 20, (n_out, 2))) ** 2
+    link[link > max_cost] = np.nan
+
+    death = np.empty((n_in, n_in))
+    death.fill(np.nan)
+    death[np.diag_indices(n_in)] = max_cost * 0.5
+    birth = np.empty((n_out, n_out))
+    birth.fill(np.nan)
+    birth[np.diag_indices(n_out)] = max_cost * 0.5
+
+    return [[link, death], [birth, None]]
+
+
+def optimal_cost(mat):
+    mat = np.where(np.isfinite(mat), mat, np.inf)
+    rows, cols = linear_sum_assignment(mat)
+    return mat[rows, cols].sum()
+
+
+def assigned_cost(mat, in_links):
+    return mat[np.arange(mat.shape[0]), in_links].sum()
+
+
+def test_sparse_cost_matrix():
+    for seed in range(5):
+        blocks = tracking_blocks(seed=seed)
+        dense = CostMatrix(blocks, backend='lapjv')
+        sparse = SparseCostMatrix(blocks, backend='lapjv')
+
+        assert_array_equal(np.isnan(sparse.mat), np.isnan(dense.mat))
+        assert_allclose(sparse.mat[np.isfinite(sparse.mat)], dense.mat[np.isfinite(dense.mat)])
+
+        dense.solve()
+        sparse.solve()
+        assert_allclose(assigned_cost(dense.mat, dense.in_links), optimal_cost(dense.mat))
+        assert_array_equal(sparse.in_links, dense.in_links)
+        assert_array_equal(sparse.out_links, dense.out_links)
+
+
+def test_decomposed_cost_matrix():
+    for seed in range(5):
+        blocks = tracking_blocks(n_in=80, n_out=70, max_cost=4., seed=seed)
+        dense = CostMatrix(blocks, backend='scipy')
+        dense.solve()
+        n_in, n_out = blocks[0][0].shape
+
+        for threads, batch_size in [(1, 256), (1, 4), (2, 4)]:
+            decomposed = DecomposedCostMatrix(blocks, threads=threads,
+                                              batch_size=batch_size)
+            decomposed.solve()
+
+            assert decomposed.n_components > 1
+            assert_allclose(assigned_cost(dense.mat, decomposed.in_links),
+                            optimal_cost(dense.mat))
+            assert_array_equal(decomposed.in_links[:n_in], dense.in_links[:n_in])
+            assert_array_equal(decomposed.out_links[:n_out], dense.out_links[:n_out])
+
+
+def test_backends():
+    for seed in range(5):
+        blocks = tracking_blocks(seed=seed)
+        expected = optimal_cost(CostMatrix(blocks).mat)
+
+        for backend in ['scipy', 'lapjv', 'auction']:
+            cm = SparseCostMatrix(blocks, backend=backend)
+            cm.solve()
+            cost = assigned_cost(cm.mat, cm.in_links)
+            if backend == 'auction':
+                # Approximate solver, see AuctionBackend
+                tolerance = get_backend('auction').tolerance
+                span = np.nanmax(cm.mat) - np.nanmin(cm.mat)
+                assert expected - 1e-9 <= cost <= expected + tolerance * span
+            else:
+                assert_allclose(cost, expected)
+
+    assert choose_backend(1000, 2000) == 'lapjv'
+    assert choose_backend(100, 2000) == 'scipy'
+    assert choose_backend(100, 2000, warm_start=True) == 'lapjv'
+    assert choose_backend(100, 2000, policy={'max_dense_size': 50}) == 'scipy'
+    assert choose_backend(100, 100, policy={'max_dense_size': 50}) == 'lapjv'
@@ -5,7 +5,11 @@ from __future__ import division
 from __future__ import absolute_import
 from __future__ import print_function
 
+import copy
 import logging
+import itertools
+from collections import deque
+from multiprocessing.pool import ThreadPool
 log = logging.getLogger(__name__)
 
 import numpy as np
@@ -13,6 +17,9 @@ import numpy as np
 from ...utils import print_progress
 
 from ..matrix import CostMatrix
+from ..matrix import SparseCostMatrix
+from ..matrix import DecomposedCostMatrix
+from ..matrix.backends import BACKENDS
 from ..cost_function import AbstractCostFunction
 from ..cost_function.brownian import BrownianLinkCostFunction
 from ..cost_function.diagonal import DiagonalCostFunction
@@ -30,8 +37,29 @@ class ByFrameSolver(AbstractSolver):
     ----------
     trajs : :class:`pandas.DataFrame`
     cost_functions : list of list
+    coords : list
+    sparse : bool
+        Use a :class:`spindle_tracker.tracker.matrix.SparseCostMatrix` for
+        each frame instead of a dense one.
+    decompose : bool
+        Solve each connected component of the link graph independently (see
+        :class:`spindle_tracker.tracker.matrix.DecomposedCostMatrix`).
+    threads : int
+        Number of threads used to solve components when `decompose` is True
+        and to compute link blocks ahead (see :meth:`track`).
+    warm_start : bool
+        Start the solver of each frame pair from the solution of the
+        previous one (ignored when `decompose` is True or when the backend
+        doesn't support it).
+    backend : str
+        Linear assignment solver (see
+        :mod:`spindle_tracker.tracker.matrix.backends`). With 'auto', frames
+        are solved with 'lapjv' when `warm_start` is True (the only backend
+        using it) and an exact solver is chosen for each frame pair
+        otherwise. 'auction' is approximate and only used if given.
     """
-    def __init__(self, trajs, cost_functions, coords=['x', 'y', 'z']):
+    def __init__(self, trajs, cost_functions, coords=['x', 'y', 'z'], sparse=False,
+                 decompose=False, threads=1, warm_start=True, backend='auto'):
 
         super(self.__class__, self).__init__(trajs)
 
@@ -39,6 +67,12 @@ class ByFrameSolver(AbstractSolver):
         self.t_out = 0
 
         self.coords = coords
+        self.sparse = sparse
+        self.decompose = decompose
+        self.threads = threads
+        self.warm_start = warm_start
+        self.backend = backend
+        self._previous_solution = None
 
         self.trajs.check_trajs_df_structure(index=['t_stamp', 'label'],
                                             columns=['t'] + coords)
@@ -58,7 +92,12 @@ class ByFrameSolver(AbstractSolver):
     def for_brownian_motion(cls, trajs,
                             max_speed,
                             penalty=1.05,
-                            coords=['x', 'y', 'z']):
+                            coords=['x', 'y', 'z'],
+                            sparse=False,
+                            decompose=False,
+                            threads=1,
+                            warm_start=True,
+                            backend='auto'):
         """
 
         Parameters
@@ -69,6 +108,19 @@ class ByFrameSolver(AbstractSolver):
         penalty : float
         coords : list
             Which columns to choose in trajs when computing distances.
+        sparse : bool
+            Build sparse cost matrices. Link costs are only computed for the
+            pairs closer than `max_speed * dt`.
+        decompose : bool
+            Solve each group of objects which can be linked together
+            independently.
+        threads : int
+            Number of threads used to solve groups.
+        warm_start : bool
+            Start the solver of each frame from the previous solution.
+        backend : str
+            Linear assignment solver ('auto', 'lapjv', 'scipy' or 'auction',
+            see :class:`ByFrameSolver`).
 
         Examples
         --------
@@ -82,12 +134,13 @@ class ByFrameSolver(AbstractSolver):
         2014:INFO:by_frame_solver: Initiating frame by frame tracking.
         2014:INFO:by_frame_solver: Frame by frame tracking done. 5 segments found (500 before).
         """
-        guessed_cost = np.float(max_speed ** 2) * penalty
+        guessed_cost = float(max_speed ** 2) * penalty
         diag_context = {'cost': guessed_cost}
-        diag_params = {'penalty': penalty, 'coords': coords}
+        diag_params = {'penalty': penalty, 'coords': coords, 'sparse': sparse}
 
         link_cost_func = BrownianLinkCostFunction(parameters={'max_speed': max_speed,
-                                                              'coords': coords})
+                                                              'coords': coords,
+                                                              'sparse': sparse})
         birth_cost_func = DiagonalCostFunction(context=diag_context,
                                                parameters=diag_params)
         death_cost_func = DiagonalCostFunction(context=diag_context,
@@ -97,7 +150,9 @@ class ByFrameSolver(AbstractSolver):
                           'birth': birth_cost_func,
                           'death': death_cost_func}
 
-        return cls(trajs, cost_functions, coords=coords)
+        return cls(trajs, cost_functions, coords=coords, sparse=sparse,
+                   decompose=decompose, threads=threads, warm_start=warm_start,
+                   backend=backend)
 
     @classmethod
     def for_directed_motion(cls, trajs,
@@ -106,7 +161,12 @@ class ByFrameSolver(AbstractSolver):
                             past_traj_time=10,
                             smooth_factor=0,
                             interpolation_order=1,
-                            coords=['x', 'y', 'z']):
+                            coords=['x', 'y', 'z'],
+                            sparse=False,
+                            decompose=False,
+                            threads=1,
+                            warm_start=True,
+                            backend='auto'):
         """Link objects according to their distance found in trajectories frame by frame.
 
         Parameters
@@ -124,6 +184,18 @@ class ByFrameSolver(AbstractSolver):
             The order of the spline fit. See :func:`scipy.interpolate.splrep`
         coords : list
             Which columns to choose in trajs when computing distances.
+        sparse : bool
+            Build sparse cost matrices.
+        decompose : bool
+            Solve each group of objects which can be linked together
+            independently.
+        threads : int
+            Number of threads used to solve groups.
+        warm_start : bool
+            Start the solver of each frame from the previous solution.
+        backend : str
+            Linear assignment solver ('auto', 'lapjv', 'scipy' or 'auction',
+            see :class:`ByFrameSolver`).
         """
 
         parameters = {'max_speed': max_speed,
@@ -134,7 +206,7 @@ class ByFrameSolver(AbstractSolver):
 
         guessed_cost = 20 * penalty
         diag_context = {'cost': guessed_cost}
-        diag_params = {'penalty': penalty}
+        diag_params = {'penalty': penalty, 'sparse': sparse}
         link_context = {'trajs': trajs}
 
         link_cost_func = BasicDirectedLinkCostFunction(parameters=parameters,
@@ -149,7 +221,9 @@ class ByFrameSolver(AbstractSolver):
                           'birth': birth_cost_func,
                           'death': death_cost_func}
 
-        return cls(trajs, cost_functions, coords=coords)
+        return cls(trajs, cost_functions, coords=coords, sparse=sparse,
+                   decompose=decompose, threads=threads, warm_start=warm_start,
+                   backend=backend)
 
     @property
     def blocks_structure(self):
@@ -164,7 +238,7 @@ class ByFrameSolver(AbstractSolver):
     def pos_out(self):
         return self.trajs.loc[self.t_out]
 
-    def track(self, progress_bar=False, progress_bar_out=None):
+    def track(self, progress_bar=False, progress_bar_out=None, prefetch=0):
         """
 
         Returns
@@ -174,29 +248,43 @@ class ByFrameSolver(AbstractSolver):
             Display progress bar
         progress_bar_out : OutStream
             For testing purpose only
+        prefetch : int
+            Number of frame pairs whose link block is computed ahead by
+            `threads` workers while frames are solved in order. Only used
+            when the link cost function accepts array context (its block
+            only depends on positions). 0 to disable.
         """
 
         log.info('Initiating frame by frame tracking.')
 
-        old_labels = self.trajs.index.get_level_values('label').values
-        self.trajs['new_label'] = old_labels.astype(np.float)
+        self._init_frames()
         ts_in = self.trajs.t_stamps[:-1]
         ts_out = self.trajs.t_stamps[1:]
 
         n_labels_before = len(self.trajs.labels)
 
-        n = len(ts_in)
-        for i, (t_in, t_out) in enumerate(zip(ts_in, ts_out)):
-            if progress_bar:
-                progress = i / n * 100
-                message = "t_in : {} | t_out {}".format(t_in, t_out)
-                print_progress(progress, message=message, out=progress_bar_out)
+        if prefetch > 0 and self.link_cf.array_context:
+            link_blocks = self._iter_link_blocks(ts_in, ts_out, prefetch)
+        else:
+            link_blocks = itertools.repeat(None)
 
-            self.one_frame(t_in, t_out)
+        n = len(ts_in)
+        try:
+            for i, (t_in, t_out) in enumerate(zip(ts_in, ts_out)):
+                if progress_bar:
+                    progress = i / n * 100
+                    message = "t_in : {} | t_out {}".format(t_in, t_out)
+                    print_progress(progress, message=message, out=progress_bar_out)
+
+                self.one_frame(t_in, t_out, link_block=next(link_blocks))
+        finally:
+            if hasattr(link_blocks, 'close'):
+                link_blocks.close()
 
         if progress_bar:
             print_progress(-1)
 
+        self.trajs['new_label'] = self.new_labels
         self.relabel_trajs()
 
         n_labels_after = len(self.trajs.labels)
@@ -204,24 +292,33 @@ class ByFrameSolver(AbstractSolver):
         log.info(mess.format(n_labels_after, n_labels_before))
         return self.trajs
 
-    def one_frame(self, t_in, t_out):
+    def one_frame(self, t_in, t_out, link_block=None):
         """
 
         Parameters
         ----------
         t_in : int
         t_out : int
+        link_block : 2D array or None
+            Link block already computed for this frame pair.
         """
 
         self.t_in = t_in
         self.t_out = t_out
 
-        pos_in = self.pos_in
-        pos_out = self.pos_out
+        if self.link_cf.array_context:
+            pos_in = self._get_positions(t_in)
+            pos_out = self._get_positions(t_out)
+        else:
+            pos_in = self.pos_in
+            pos_out = self.pos_out
 
         self.link_cf.context['pos_in'] = pos_in
         self.link_cf.context['pos_out'] = pos_out
-        self.link_cf.get_block()
+        if link_block is None:
+            self.link_cf.get_block()
+        else:
+            self.link_cf.mat = link_block
 
         self.birth_cf.context['objects'] = pos_out
         self.birth_cf.get_block()
@@ -229,34 +326,190 @@ class ByFrameSolver(AbstractSolver):
         self.death_cf.context['objects'] = pos_in
         self.death_cf.get_block()
 
-        self.cm = CostMatrix(self.blocks_structure)
-        self.cm.solve()
+        if self.decompose:
+            self.cm = DecomposedCostMatrix(self.blocks_structure, threads=self.threads,
+                                           backend=self.backend)
+            self.cm.solve()
+        else:
+            # Keep the solver using the warm start for every frame, the first
+            # frames are solved without one
+            backend = self.backend
+            if backend == 'auto' and self.warm_start:
+                backend = 'lapjv'
+
+            if self.sparse:
+                self.cm = SparseCostMatrix(self.blocks_structure, backend=backend)
+            else:
+                self.cm = CostMatrix(self.blocks_structure, backend=backend)
+
+            # Only some backends give dual variables and use them
+            if (self.warm_start and self._previous_solution is not None and
+                    self._previous_solution[3] is not None and
+                    BACKENDS[backend].warm_start):
+                self.cm.solve(*self._get_warm_start())
+            else:
+                self.cm.solve()
+
+            # Non-finite dual variables can't start the next solve
+            v = self.cm.v
+            if v is not None and not np.all(np.isfinite(v)):
+                v = None
+
+            row_shapes, col_shapes = self.cm.get_shapes()
+            self._previous_solution = (row_shapes[0], col_shapes[0],
+                                       self.cm.out_links, v)
+
         self.assign()
 
     def assign(self):
-        """
+        """Give the labels of `t_in` objects to the `t_out` objects they are
+        linked to and new labels to the others.
         """
 
         row_shapes, col_shapes = self.cm.get_shapes()
         last_in_link = row_shapes[0]
         last_out_link = col_shapes[0]
 
-        new_labels_in = self.trajs.loc[self.t_in]['new_label'].values
-        new_labels_out = np.arange(last_out_link)
+        rows_in = self._get_rows(self.t_in)
+        rows_out = self._get_rows(self.t_out)
 
-        for idx_out, idx_in in enumerate(self.cm.out_links[:last_out_link]):
-            if idx_in >= last_in_link:
-                # new segment
-                new_label = self.trajs['new_label'].max() + 1.
-            else:
-                # assignment
-                new_label = new_labels_in[idx_in]
-                self._update_max_assign_cost(self.cm.mat[idx_in, idx_out])
-
-            new_labels_out[idx_out] = new_label
-            self.trajs.loc[self.t_out, 'new_label'] = new_labels_out
-            # The line below looks much slower than the two lines above
-            # self.trajs.loc[self.t_out, 'new_label'].iloc[idx_out] = new_label
+        idxs_in = self.cm.out_links[:last_out_link]
+        linked = idxs_in < last_in_link
+        idxs_out = np.arange(last_out_link)
+
+        new_labels_out = np.empty(last_out_link, dtype='int')
+
+        # Assignments
+        new_labels_out[linked] = self.new_labels[rows_in[idxs_in[linked]]]
+
+        # New segments
+        n_births = np.sum(~linked)
+        new_labels_out[~linked] = self._next_label + np.arange(n_births)
+        self._next_label += n_births
+
+        self.new_labels[rows_out] = new_labels_out
+
+        if np.any(linked):
+            costs = self.cm.get_costs(idxs_in[linked], idxs_out[linked])
+            self._update_max_assign_cost(np.max(costs))
+
+    def _get_warm_start(self):
+        """Map the solution of the previous frame pair on the current cost
+        matrix to warm start the solver.
+
+        Objects at `t_in` were the columns of the previous matrix. An object
+        at `t_out` takes the dual variable of the closest (lowest link cost)
+        object at `t_in` and each object at `t_in` is guessed to be linked to
+        the closest of these objects. The death column of an object at `t_in`
+        takes the dual variable of the death column of its predecessor.
+        Other columns start from their lowest cost.
+
+        Returns
+        -------
+        v_init : 1D :class:`numpy.ndarray`
+        x_init : 1D :class:`numpy.ndarray`
+        """
+
+        prev_n_in, prev_n_out, prev_out_links, prev_v = self._previous_solution
+
+        row_shapes, col_shapes = self.cm.get_shapes()
+        n_in, n_out = row_shapes[0], col_shapes[0]
+        n = n_in + n_out
+
+        idxs_in, idxs_out, costs = self.cm.get_flat()
+
+        v_init = np.ones(n) * np.inf
+        np.minimum.at(v_init, idxs_out, costs)
+        x_init = np.ones(n, dtype='int') * -1
+
+        # Closest object at t_in of each object at t_out
+        links = (idxs_in < n_in) & (idxs_out < n_out)
+        link_in, link_out, link_costs = idxs_in[links], idxs_out[links], costs[links]
+        order = np.lexsort((link_costs, link_out))
+        cols, first = np.unique(link_out[order], return_index=True)
+        rows = link_in[order][first]
+        link_costs = link_costs[order][first]
+        v_init[cols] = prev_v[rows]
+
+        order = np.lexsort((link_costs, rows))
+        guessed_rows, first = np.unique(rows[order], return_index=True)
+        x_init[guessed_rows] = cols[order][first]
+
+        # Death columns
+        predecessors = prev_out_links[:prev_n_out].astype('int')
+        continued = np.nonzero(predecessors < prev_n_in)[0]
+        v_init[n_out + continued] = prev_v[prev_n_out + predecessors[continued]]
+
+        return v_init, x_init
+
+    def _iter_link_blocks(self, ts_in, ts_out, prefetch):
+        """Compute link blocks of the frame pairs in a thread pool, at most
+        `prefetch` frame pairs ahead, and yield them in order.
+        """
+
+        pairs = zip(ts_in, ts_out)
+        pool = ThreadPool(max(self.threads, 1))
+        pending = deque()
+        try:
+            for t_in, t_out in itertools.islice(pairs, prefetch):
+                pending.append(pool.apply_async(self._build_link_block, (t_in, t_out)))
+
+            while pending:
+                link_block = pending.popleft().get()
+                for t_in, t_out in itertools.islice(pairs, 1):
+                    pending.append(pool.apply_async(self._build_link_block, (t_in, t_out)))
+                yield link_block
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _build_link_block(self, t_in, t_out):
+        """Compute the link block of a frame pair with a copy of the link cost
+        function (safe to call from several threads).
+        """
+        link_cf = copy.copy(self.link_cf)
+        link_cf.context = dict(self.link_cf.context,
+                               pos_in=self._get_positions(t_in),
+                               pos_out=self._get_positions(t_out))
+        link_cf.get_block()
+        return link_cf.mat
+
+    def _init_frames(self):
+        """Copy positions in a contiguous array sorted by frame (`coords` then
+        `t` columns) where each frame is a slice, and initialize new labels
+        with the current ones.
+        """
+
+        t_stamps = self.trajs.index.get_level_values('t_stamp').values
+        self._rows_order = np.argsort(t_stamps, kind='mergesort')
+        self._t_stamps, self._rows_bounds = np.unique(t_stamps[self._rows_order],
+                                                      return_index=True)
+        self._rows_bounds = np.append(self._rows_bounds, len(t_stamps))
+
+        positions = self.trajs[list(self.coords) + ['t']].values.astype('float')
+        self._positions = np.ascontiguousarray(positions[self._rows_order])
+
+        old_labels = self.trajs.index.get_level_values('label').values
+        self.new_labels = old_labels.astype('int')
+        self._previous_solution = None
+        self._next_label = self.new_labels.max() + 1 if len(old_labels) else 0
+
+    def _get_slice(self, t_stamp):
+        """Slice of the `t_stamp` objects in the frame sorted arrays.
+        """
+        n = np.searchsorted(self._t_stamps, t_stamp)
+        return slice(self._rows_bounds[n], self._rows_bounds[n + 1])
+
+    def _get_rows(self, t_stamp):
+        """Row positions of the `t_stamp` objects in `self.trajs`.
+        """
+        return self._rows_order[self._get_slice(t_stamp)]
+
+    def _get_positions(self, t_stamp):
+        """Positions of the `t_stamp` objects (a view, `coords` then `t`
+        columns).
+        """
+        return self._positions[self._get_slice(t_stamp)]
 
     def _update_max_assign_cost(self, cost):
         """
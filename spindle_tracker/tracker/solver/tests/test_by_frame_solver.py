@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from spindle_tracker.trajectories import Trajectories
+from spindle_tracker.tracker.solver import ByFrameSolver
+
+
+def brownian_trajs(n_objects=40, n_frames=30, p_missing=0., seed=0):
+    """Objects moving randomly in 2D, with a single label per position.
+    Positions are missing with a `p_missing` probability.
+    """
+    rng = np.random.RandomState(seed)
+    pos = rng.uniform(0, 30, (n_objects, 2))
+    pos = pos + np.cumsum(rng.normal(0, 1, (n_frames, n_objects, 2)), axis=0)
+    pos = pos.reshape(-1, 2)
+
+    t_stamps = np.repeat(np.arange(n_frames), n_objects)
+    kept = rng.uniform(size=len(t_stamps)) >= p_missing
+    pos, t_stamps = pos[kept], t_stamps[kept]
+
+    df = pd.DataFrame({'t_stamp': t_stamps,
+                       'label': np.arange(len(t_stamps)),
+                       't': t_stamps * 1.,
+                       'x': pos[:, 0],
+                       'y': pos[:, 1],
+                       'z': 0.})
+    return Trajectories(df.set_index(['t_stamp', 'label']))
+
+
+def track_labels(trajs, **kwargs):
+    solver = ByFrameSolver.for_brownian_motion(trajs.copy(), max_speed=3., **kwargs)
+    return solver.track().index.get_level_values('label').values
+
+
+def assert_same_partition(labels, expected):
+    pairs = set(zip(labels, expected))
+    assert len(pairs) == len(set(labels)) == len(set(expected))
+
+
+def test_warm_start():
+    for seed in range(3):
+        trajs = brownian_trajs(seed=seed)
+        solver = ByFrameSolver.for_brownian_motion(trajs.copy(), max_speed=3.,
+                                                   backend='lapjv')
+
+        # Dual variables of each frame pair, the next one starts from them
+        duals = []
+        assign = solver.assign
+
+        def record_duals():
+            duals.append(solver.cm.v)
+            assign()
+
+        solver.assign = record_duals
+        labels = solver.track().index.get_level_values('label').values
+
+        assert len(duals) == len(trajs.t_stamps) - 1
+        for v in duals:
+            assert np.all(np.isfinite(v))
+        np.testing.assert_array_equal(labels, track_labels(trajs, warm_start=False))
+
+
+def test_default_backend():
+    # 'auto' with the default warm start solves every frame with lapjv
+    for seed in range(5):
+        trajs = brownian_trajs(seed=seed)
+        np.testing.assert_array_equal(track_labels(trajs),
+                                      track_labels(trajs, backend='scipy'))
+
+
+def test_assign():
+    # Labels of the old assign loop, computed on the same cost matrices
+    trajs = brownian_trajs(p_missing=0.1)
+    solver = ByFrameSolver.for_brownian_motion(trajs.copy(), max_speed=3.)
+
+    expected = {}
+    t0 = trajs.t_stamps[0]
+    for x, label in zip(trajs.loc[t0]['x'], trajs.loc[t0].index):
+        expected[x] = label
+    new_labels = itertools.count(trajs.labels.max() + 1)
+    assign = solver.assign
+
+    def reference_assign():
+        assign()
+
+        row_shapes, col_shapes = solver.cm.get_shapes()
+        labels_in = [expected[x] for x in trajs.loc[solver.t_in]['x']]
+        for x, idx_in in zip(trajs.loc[solver.t_out]['x'],
+                             solver.cm.out_links[:col_shapes[0]]):
+            if idx_in >= row_shapes[0]:
+                expected[x] = next(new_labels)
+            else:
+                expected[x] = labels_in[idx_in]
+
+    solver.assign = reference_assign
+    tracked = solver.track()
+
+    labels = tracked.index.get_level_values('label').values
+    assert_same_partition(labels, [expected[x] for x in tracked['x']])
+    # Births, deaths and gaps
+    assert len(np.unique(labels)) > 40
+
+
+def test_frames():
+    trajs = brownian_trajs(p_missing=0.1)
+    solver = ByFrameSolver.for_brownian_motion(trajs.copy(), max_speed=3.)
+    solver._init_frames()
+
+    for t_stamp in trajs.t_stamps:
+        frame = trajs.loc[t_stamp]
+        np.testing.assert_array_equal(solver._get_positions(t_stamp),
+                                      frame[['x', 'y', 'z', 't']].values)
+        np.testing.assert_array_equal(solver.new_labels[solver._get_rows(t_stamp)],
+                                      frame.index.values)
+
+
+def test_prefetch():
+    for seed in range(3):
+        trajs = brownian_trajs(p_missing=0.1, seed=seed)
+        expected = track_labels(trajs)
+
+        for threads, prefetch in [(1, 1), (2, 2), (2, 8)]:
+            solver = ByFrameSolver.for_brownian_motion(trajs.copy(), max_speed=3.,
+                                                       threads=threads)
+            tracked = solver.track(prefetch=prefetch)
+            np.testing.assert_array_equal(tracked.index.get_level_values('label').values,
+                                          expected)
+
+        # Solved on another cost matrix, the same trajectories are found
+        for kwargs in [{'sparse': True}, {'decompose': True}]:
+            assert_same_partition(track_labels(trajs, **kwargs), expected)
@@ -5,7 +5,9 @@ import itertools
 import numpy as np
 import pandas as pd
 import scipy.spatial.distance as dist
-import scipy.cluster.hierarchy as hier
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
 from ..tracker.solver import ByFrameSolver
 from ..utils.progress import progress_apply
@@ -182,7 +184,7 @@ class Cen2Tracker(Tracker):
         """
         Find peaks with same x and y coordinate (with a cluster algorithm).
         Keep the peak with biggest intensity and add z coordinates
-        according to his position in the z-stack.
+        according to his position in the z-stack (see :func:`collapse_z`).
 
         Parameters
         ----------
@@ -201,30 +203,14 @@ class Cen2Tracker(Tracker):
             self.peaks_z = self.peaks.copy()
             return
 
-        log.info("*** Running find_z()")
-
-        bads = []
-        clusters_count = []
-
-        peaks = self.peaks
+        if 'w_z' in self.peaks.columns:
+            log.info('Peaks have been detected in 3D, pass Z projection clustering.')
+            self.save(self.peaks.copy(), 'peaks_z')
+            return
 
-        for t, pos in peaks.groupby('t'):
-            if pos.shape[0] > 1:
-                dist_mat = dist.squareform(dist.pdist(pos[['x', 'y']]))
-                link_mat = hier.linkage(dist_mat)
-                clusters = hier.fcluster(
-                    link_mat, treshold, criterion='distance')
-                pos['clusters'] = clusters
-                for cluster, p in pos.groupby('clusters'):
-                    bads_peak = p.sort(columns='I').iloc[:-1].index.values
-                    bads.extend(bads_peak)
-                    clusters_count.append(len(p))
-            else:
-                for p in pos.iterrows():
-                    clusters_count.append(0)
+        log.info("*** Running find_z()")
 
-        peaks_z = peaks.drop(bads)
-        peaks_z['clusters_count'] = clusters_count
+        peaks_z = collapse_z(self.peaks, treshold)
         self.save(peaks_z, 'peaks_z')
 
         log.info("*** End")
@@ -1180,3 +1166,53 @@ class Cen2Tracker(Tracker):
         linked_runs['AP-P'] = link_runs(ap_A, p_B, start_time_offset=15, min_time=0.5)
 
         return linked_runs
+
+
+def collapse_z(peaks, treshold):
+    """Merge peaks of the same time point closer than `treshold` in x and y
+    (single linkage clustering: connected groups of peaks) and keep the
+    brightest peak of each group.
+
+    All time points are processed at once with a radius search in a KD-tree.
+
+    Results differ from the former hierarchical clustering of find_z: it
+    gave a square distance matrix to :func:`scipy.cluster.hierarchy.linkage`,
+    which reads it as observations, so clusters didn't group the peaks
+    closer than `treshold`.
+
+    Returns
+    -------
+    peaks_z : :class:`pandas.DataFrame`
+        Kept peaks (in the same order than in `peaks`) with a
+        'clusters_count' column: the number of peaks merged in each one (0
+        for time points with a single peak).
+    """
+    n_peaks = len(peaks)
+
+    # Time points are moved far apart along a third axis so peaks of
+    # different time points are never neighbours
+    t_codes = np.unique(peaks['t'].values, return_inverse=True)[1].ravel()
+    t_sizes = np.bincount(t_codes)
+    points = np.column_stack([peaks['x'].values, peaks['y'].values,
+                              t_codes * 2 * (treshold + 1)])
+
+    pairs = cKDTree(points).query_pairs(r=treshold, output_type='ndarray')
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+                       shape=(n_peaks, n_peaks))
+    _, clusters = connected_components(graph, directed=False)
+
+    # Brightest peak of each cluster: last one when sorted by cluster then
+    # intensity
+    order = np.lexsort((peaks['I'].values, clusters))
+    sorted_clusters = clusters[order]
+    last = np.ones(n_peaks, dtype='bool')
+    last[:-1] = sorted_clusters[1:] != sorted_clusters[:-1]
+    kept = np.sort(order[last])
+
+    clusters_count = np.bincount(clusters)[clusters[kept]]
+    clusters_count[t_sizes[t_codes[kept]] == 1] = 0
+
+    peaks_z = peaks.iloc[kept].copy()
+    peaks_z['clusters_count'] = clusters_count
+
+    return peaks_z
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+
+from __future__ import unicode_literals
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+
+
+import numpy as np
+import pandas as pd
+
+from spindle_tracker.tracking.cen2_tracker import collapse_z
+
+
+def test_collapse_z():
+    peaks = pd.DataFrame([
+        # A chain of peaks closer than the treshold two by two
+        (0, 0., 0., 10.),
+        (0, 0.8, 0., 30.),
+        (0, 1.6, 0., 20.),
+        # An isolated peak
+        (0, 10., 0., 5.),
+        # A single peak at the same position as the chain
+        (1, 0.8, 0., 1.),
+        # Two close peaks
+        (2, 5., 5., 40.),
+        (2, 5., 5.5, 50.)],
+        columns=['t', 'x', 'y', 'I'])
+
+    peaks_z = collapse_z(peaks, 1.)
+
+    np.testing.assert_array_equal(peaks_z.index, [1, 3, 4, 6])
+    np.testing.assert_array_equal(peaks_z['clusters_count'], [3, 1, 0, 2])
+    np.testing.assert_array_equal(peaks_z['I'], [30., 5., 1., 50.])
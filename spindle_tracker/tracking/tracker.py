@@ -7,6 +7,9 @@ import pandas as pd
 import numpy as np
 
 from ..detector import peak_detector
+from ..detector import multichannel_peak_detector
+from ..detector import DetectionCache
+from ..detector.cache import file_fingerprint
 
 from ..trajectories import Trajectories
 
@@ -250,8 +253,36 @@ class Tracker():
                      z_projection=False,
                      show_progress=False,
                      parallel=True,
-                     erase=False):
-        """
+                     erase=False,
+                     processes=None,
+                     executor=None,
+                     streaming=True,
+                     volume=False,
+                     cache=None,
+                     guide=None,
+                     roi_radius=1.,
+                     metrics=None):
+        """Detect peaks with :func:`spindle_tracker.detector.peak_detector`.
+
+        If `streaming` is True, planes are read page by page from the TIFF
+        file and fed to the detector as workers get free: only a few planes
+        are in memory at once instead of the whole file (see
+        :meth:`spindle_tracker.io.StackIO.plane_iterator`).
+
+        If `volume` is True, peaks are detected in 3D on whole Z stacks and
+        their z position is fitted (no need to cluster peaks along Z
+        afterwards).
+
+        If `cache` is a :class:`spindle_tracker.detector.DetectionCache` (or
+        True to use the default cache), frames already detected with the same
+        parameters are not computed again.
+
+        If `guide` is 'previous' or a :class:`spindle_tracker.trajectories.Trajectories`,
+        peaks are only searched within `roi_radius` (in um) of their expected
+        positions (see :func:`spindle_tracker.detector.peak_detector`).
+
+        `metrics` is called with the metrics of each detected frame (see
+        :class:`spindle_tracker.detector.DetectionMetrics`).
         """
 
         if hasattr(self, 'raw') and not erase:
@@ -266,8 +297,16 @@ class Tracker():
                           json_discovery=False,
                           metadata=self.metadata)
 
-        data_iterator = self.st.image_iterator(channel_index=channel,
-                                               z_projection=z_projection)
+        if volume:
+            z_projection = False
+
+        if streaming or volume:
+            data_iterator = self.st.plane_iterator(channel_index=channel,
+                                                   z_projection=z_projection,
+                                                   volume=volume)
+        else:
+            data_iterator = self.st.image_iterator(channel_index=channel,
+                                                   z_projection=z_projection)
 
         if z_projection and 'Z' in self.metadata['DimensionOrder']:
             z_position = self.metadata['DimensionOrder'].index('Z')
@@ -278,17 +317,118 @@ class Tracker():
         else:
             metadata = self.metadata
 
+        source_key = None
+        if cache is True:
+            cache = DetectionCache()
+        if cache is not None:
+            source_key = {'file': file_fingerprint(self.full_tif_path),
+                          'channel': channel,
+                          'z_projection': z_projection}
+
         peaks = peak_detector(data_iterator(),
                               metadata,
                               parallel=parallel,
                               show_progress=show_progress,
-                              parameters=detection_parameters)
+                              parameters=detection_parameters,
+                              processes=processes,
+                              executor=executor,
+                              volume=volume,
+                              cache=cache,
+                              source_key=source_key,
+                              guide=guide,
+                              roi_radius=roi_radius,
+                              metrics=metrics)
 
         self.stored_data.append('raw')
         self.raw = peaks
 
         self.save_oio()
 
+    def detect_peaks_multichannel(self,
+                                  channel_parameters,
+                                  z_projection=False,
+                                  show_progress=False,
+                                  parallel=True,
+                                  erase=False,
+                                  processes=None,
+                                  executor=None,
+                                  metrics=None):
+        """Detect peaks of several channels reading the TIFF file only once
+        (see :func:`spindle_tracker.detector.multichannel_peak_detector`).
+
+        Parameters
+        ----------
+        channel_parameters : OrderedDict
+            Keys are channels (index or name) and values detection parameters.
+
+        Peaks of all channels are stored in `self.raw_channels`, a single
+        table with a 'channel' column.
+
+        `metrics` is called with the metrics of each detected frame and
+        channel (see :class:`spindle_tracker.detector.DetectionMetrics`).
+
+        Returns
+        -------
+        peaks : dict
+            One peaks table per channel.
+        """
+
+        if hasattr(self, 'raw_channels') and not erase:
+            log.info("Peaks already detected")
+            return None
+
+        if not self.full_tif_path or not os.path.isfile(self.full_tif_path):
+            raise IOError("Tif path does not exist.")
+
+        self.st = StackIO(image_path=self.tif_path,
+                          base_dir=self.base_dir,
+                          json_discovery=False,
+                          metadata=self.metadata)
+
+        channels = list(channel_parameters.keys())
+        data_iterator = self.st.plane_iterator(channel_index=channels,
+                                               z_projection=z_projection)
+
+        if z_projection and 'Z' in self.metadata['DimensionOrder']:
+            metadata = self.metadata.copy()
+            metadata['SizeZ'] = 1
+        else:
+            metadata = self.metadata
+
+        peaks = multichannel_peak_detector(data_iterator(),
+                                           metadata,
+                                           channel_parameters,
+                                           parallel=parallel,
+                                           show_progress=show_progress,
+                                           processes=processes,
+                                           executor=executor,
+                                           metrics=metrics)
+
+        tables = []
+        for channel, channel_peaks in peaks.items():
+            if len(channel_peaks):
+                channel_peaks = channel_peaks.copy()
+                channel_peaks['channel'] = channel
+                tables.append(channel_peaks)
+
+        if tables:
+            raw = pd.concat(tables)
+            # Labels are unique within a channel only
+            t_stamps = raw.index.get_level_values('t_stamp').values
+            raw = raw.iloc[np.argsort(t_stamps, kind='mergesort')]
+            raw.index = pd.MultiIndex.from_arrays([raw.index.get_level_values('t_stamp'),
+                                                   np.arange(len(raw))],
+                                                  names=['t_stamp', 'label'])
+        else:
+            raw = pd.DataFrame([])
+
+        self.stored_data.append('raw_channels')
+        self.raw_channels = raw
+
+        self.save_oio()
+
+        return peaks
+
     def get_peaks_from_trackmate(self, suffix=None, get_tracks=True):
         """
         """
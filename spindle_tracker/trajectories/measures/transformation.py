@@ -124,9 +124,9 @@ def _segment_interpolate_(segment, sampling, s=0, k=3,
     t_stamp0, t_stamp1 = t_stamps_in[0], t_stamps_in[-1]
     t0, t1 = segment.t.iloc[0], segment.t.iloc[-1]
     t_stamps = np.arange(t_stamp0*sampling,
-                         t_stamp1*sampling+1, dtype=np.int)
+                         t_stamp1*sampling+1, dtype=int)
     times = np.linspace(t0, t1, t_stamps.size)
-    t_stamps = pd.Index(t_stamps, dtype=np.int, name='t_stamp')
+    t_stamps = pd.Index(t_stamps, dtype=int, name='t_stamp')
     tmp_df = pd.DataFrame(index=t_stamps)
     tmp_df['t'] = times
     if segment.shape[0] < 2:
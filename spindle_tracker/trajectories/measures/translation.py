@@ -147,8 +147,8 @@ def get_MSD(trajs):
 def shifted_dif_(segment, shift, coords):
     '''
     '''
-    left_shift = - np.floor(shift/2).astype(np.int)
-    right_shift = np.ceil(shift/2).astype(np.int)
+    left_shift = - np.floor(shift/2).astype(int)
+    right_shift = np.ceil(shift/2).astype(int)
     return segment[coords].shift(left_shift) - segment[coords].shift(right_shift)
 
 
@@ -198,9 +198,9 @@ def compute_MSD_(segment, dts, coords=['x', 'y', 'z']):
             \left(\mathbf{r}(t + \Delta t)  - \mathbf{r}(t) \right)^2}{(T - \Delta t) / \delta t}
         \end{aligned}
     '''
-    dts = np.asarray(dts, dtype=np.int)
+    dts = np.asarray(dts, dtype=int)
     msds = pd.DataFrame(index=pd.Index(dts, name='Dt_stamp'),
-                        columns=['MSD', 'MSD_std'], dtype=np.float)
+                        columns=['MSD', 'MSD_std'], dtype=float)
     msds.loc[0] = 0, 0
     for dt in dts[1:]:
         msd = ((segment[coords]
@@ -650,7 +650,7 @@ class Trajectories(pd.DataFrame):
             if time_step > dt:
                 raise NotImplementedError('''Subsampling is not supported, '''
                                           '''give a time_step bigger than the original''')
-            sampling = np.int(dt/time_step)
+            sampling = int(dt/time_step)
             log.warning('''sampling was set to {} ({}/{})'''
                         .format(sampling, dt, time_step))
 